@@ -0,0 +1,83 @@
+"""
+Zoomed-out DO history of a long run: raw rows versus the rollup tables.
+
+Records a synthetic run of --hours of readings at --rate Hz through the rollup trigger (timing the insert overhead
+against the same inserts without rollups), then times loading the whole run for a plot --width pixels wide, once by
+reading every raw row and thinning it with LTTB and once with controllers.history.load_history.
+
+    python benchmarks/bench_do_history.py --hours 24 --rate 1
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from controllers import history, schema  # noqa: E402
+
+START = 1_700_000_000  # Epoch seconds of the first synthetic reading
+
+
+def record(path, rows, rate, target):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    schema.migrate(conn, target=target)
+    conn.execute("INSERT INTO dissolved_oxygen_study_table (sample_name) VALUES ('sample')")
+
+    t = START + np.arange(rows) / rate
+    do = 8.0 * np.exp(-(t - START) / (rows / rate / 3)) + np.random.default_rng(0).normal(0, 0.02, rows)
+    batch = [('sample', 1, float(ti), float(d), 50.0, 25.0) for ti, d in zip(t, do)]
+
+    start = time.perf_counter()
+    for k in range(0, rows, 500):  # DatabaseWriter-sized batches
+        conn.executemany(schema.INSERT_DO_RECORD, batch[k:k + 500])
+        conn.commit()
+    return conn, time.perf_counter() - start
+
+
+def timed(function, repeats=5):
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        latencies.append(time.perf_counter() - start)
+    return min(latencies), result
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--hours', type=float, default=24, help='Length of the synthetic run')
+    parser.add_argument('--rate', type=float, default=1, help='DO readings per second')
+    parser.add_argument('--width', type=int, default=1000, help='Plot width in pixels')
+    options = parser.parse_args(args)
+    rows = int(options.hours * 3600 * options.rate)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conn, plain = record(os.path.join(tmp_dir, 'plain.db'), rows, options.rate, target=4)
+        conn.close()
+        conn, rolled = record(os.path.join(tmp_dir, 'rollups.db'), rows, options.rate, target=schema.SCHEMA_VERSION)
+        print(f'Inserted {rows:,} readings: {rows / plain:,.0f} rows/s without rollups, '
+              f'{rows / rolled:,.0f} rows/s with rollups')
+
+        def raw():
+            data = np.asarray(conn.execute('''
+                SELECT epoch_time, dissolved_oxygen, temperature FROM dissolved_oxygen_records
+                WHERE sample_id = 1 ORDER BY epoch_time''').fetchall())
+            t, do, T = data.T
+            return history.decimate(t, (schema.DEFAULT_MODEL.po2(do, T),), options.width)
+
+        latency, _ = timed(raw)
+        print(f'Raw rows + LTTB:   {latency * 1e3:8.1f} ms')
+        latency, (resolution, columns) = timed(lambda: history.load_history(conn, 1, options.width))
+        print(f'load_history:      {latency * 1e3:8.1f} ms  ({len(columns["time"])} points at {resolution} s)')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
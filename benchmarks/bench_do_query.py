@@ -0,0 +1,104 @@
+"""
+Per-sample range-query latency on dissolved_oxygen_records before and after the epoch_time schema migration.
+
+Builds a synthetic study database with the version 1 layout (text timestamps, no index), times random per-sample
+time-range queries, upgrades it with controllers.schema.migrate and times the equivalent queries on the indexed
+epoch_time column.
+
+    python benchmarks/bench_do_query.py --rows 20000000 --samples 200
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from controllers import schema  # noqa: E402
+
+START = 1_700_000_000  # Epoch seconds of the first synthetic reading
+
+
+def build_database(path, rows, samples):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    schema.migrate(conn, target=1)
+
+    per_sample = rows // samples
+    conn.executemany('INSERT INTO dissolved_oxygen_study_table (sample_name) VALUES (?)',
+                     [(f'sample{i}',) for i in range(samples)])
+    # Generate rows inside SQLite so building tens of millions of rows is not bound by Python
+    for sample_id in range(1, samples + 1):
+        conn.execute('''
+            WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < ?)
+            INSERT INTO dissolved_oxygen_records (sample_name, sample_id, time, dissolved_oxygen, nanoamperes,
+                                                  temperature)
+            SELECT ?, ?, datetime(? + i, 'unixepoch'), 8.0 - i * 1e-5, 50.0, 20.0 FROM seq
+        ''', (per_sample, f'sample{sample_id}', sample_id, START + (sample_id - 1) * per_sample))
+    conn.commit()
+    return conn, per_sample
+
+
+def time_queries(conn, queries, sql):
+    latencies = []
+    for params in queries:
+        t = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        latencies.append(time.perf_counter() - t)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=20_000_000, help='Total number of DO readings')
+    parser.add_argument('--samples', type=int, default=200, help='Number of samples the readings are spread over')
+    parser.add_argument('--queries', type=int, default=50, help='Number of range queries to time')
+    parser.add_argument('--window', type=int, default=600, help='Length of each queried time range (s)')
+    parser.add_argument('--db', default=None, help='Database path (default: a temporary file)')
+    options = parser.parse_args(args)
+
+    tmp_dir = None
+    if options.db is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        options.db = os.path.join(tmp_dir.name, 'bench.db')
+
+    t = time.perf_counter()
+    conn, per_sample = build_database(options.db, options.rows, options.samples)
+    print(f'Built {per_sample * options.samples:,} rows in {time.perf_counter() - t:.1f} s')
+
+    rng = random.Random(0)
+    starts = []
+    for _ in range(options.queries):
+        sample_id = rng.randint(1, options.samples)
+        offset = rng.randint(0, max(per_sample - options.window, 0))
+        starts.append((sample_id, START + (sample_id - 1) * per_sample + offset))
+
+    legacy = [(s, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t0)),
+               time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t0 + options.window))) for s, t0 in starts]
+    p50, p95 = time_queries(conn, legacy, '''
+        SELECT time, dissolved_oxygen, temperature FROM dissolved_oxygen_records
+        WHERE sample_id = ? AND time BETWEEN ? AND ?''')
+    print(f'v1 (text time, no index):  p50 {p50 * 1e3:9.3f} ms  p95 {p95 * 1e3:9.3f} ms')
+
+    t = time.perf_counter()
+    schema.migrate(conn)
+    print(f'Migrated to schema version {schema.schema_version(conn)} in {time.perf_counter() - t:.1f} s')
+
+    indexed = [(s, t0, t0 + options.window) for s, t0 in starts]
+    p50, p95 = time_queries(conn, indexed, '''
+        SELECT epoch_time, dissolved_oxygen, temperature FROM dissolved_oxygen_records
+        WHERE sample_id = ? AND epoch_time BETWEEN ? AND ?''')
+    print(f'v2 (epoch_time, indexed):  p50 {p50 * 1e3:9.3f} ms  p95 {p95 * 1e3:9.3f} ms')
+
+    conn.close()
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Cold-start import time of the controllers entry points, measured with python -X importtime.
+
+Each target is imported in a fresh interpreter (best of --repeats runs) and reported with its cumulative import
+time, the slowest modules it pulls in, and any heavy or hardware-specific module it loads that it should not. Exits
+with status 1 when a target loads a forbidden module or takes longer than --budget milliseconds, so it can guard
+startup latency in CI.
+
+    python benchmarks/bench_import_time.py --budget 500
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules each entry point must not import: DO work has to run without the DCAM SDK, OpenCV or a plotting stack
+HEAVY = ('hamamatsu', 'cv2', 'matplotlib', 'tifffile', 'PIL', 'jupyter_server')
+TARGETS = {
+    'controllers': HEAVY,
+    'controllers.device': HEAVY,
+    'controllers.runner': HEAVY,
+    'controllers.routines': HEAVY,
+}
+
+
+def run_importtime(code):
+    """(stdout, {module: cumulative microseconds}) of python -X importtime -c code in a fresh interpreter."""
+    pythonpath = os.pathsep.join(filter(None, (ROOT, os.environ.get('PYTHONPATH'))))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=pythonpath))
+    if result.returncode:
+        raise RuntimeError(f'{code!r} failed:\n{result.stderr.strip().splitlines()[-1]}')
+
+    # Lines look like "import time:       self [us] |  cumulative | imported package"
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, total, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(total)
+    return result.stdout, cumulative
+
+
+def import_time(module, repeats=5):
+    """Best-of-repeats (total microseconds, {module: cumulative microseconds}, heavy modules loaded) for module."""
+    _, startup = run_importtime('pass')  # Modules every interpreter loads before running anything
+    code = f'import sys, {module}; print(" ".join(m for m in {HEAVY!r} if m in sys.modules))'
+    best = None
+    for _ in range(repeats):
+        stdout, cumulative = run_importtime(code)
+        cumulative = {name: t for name, t in cumulative.items() if name not in startup}
+        total = cumulative[module]
+        if best is None or total < best[0]:
+            best = (total, cumulative, stdout.split())
+    return best
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('targets', nargs='*', default=list(TARGETS), help='Modules to import')
+    parser.add_argument('--repeats', type=int, default=5, help='Fresh interpreters per target (best is reported)')
+    parser.add_argument('--budget', type=float, default=None, help='Fail if a target takes longer (ms)')
+    parser.add_argument('--top', type=int, default=5, help='Slowest top-level imports to list per target')
+    options = parser.parse_args(args)
+
+    failed = False
+    for module in options.targets:
+        total, cumulative, loaded = import_time(module, options.repeats)
+        forbidden = [name for name in loaded if name in TARGETS.get(module, ())]
+        over = options.budget is not None and total / 1e3 > options.budget
+        failed |= bool(forbidden) or over
+        print(f'{module:24s} {total / 1e3:8.1f} ms{"  OVER BUDGET" if over else ""}')
+        top = sorted(((t, name) for name, t in cumulative.items() if '.' not in name and name != module.split('.')[0]),
+                     reverse=True)[:options.top]
+        print('    slowest: ' + ', '.join(f'{name} {t / 1e3:.1f} ms' for t, name in top))
+        if forbidden:
+            print(f'    loads {", ".join(forbidden)}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
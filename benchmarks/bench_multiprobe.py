@@ -0,0 +1,96 @@
+"""
+CPU cost of recording N DO probes at once: one selector thread (MultiDOReader) against one blocking thread per probe.
+
+Simulated probes (DOProbeSimulator) stream on localhost sockets from a separate process, so the CPU time measured here
+is only the recorder's: reading and parsing every port, draining the queue every 100 ms like the GUI and storing the
+readings through one DatabaseWriter. For each probe count it reports the recorder's CPU use, the readings stored and
+the reader threads that were running.
+
+    python benchmarks/bench_multiprobe.py --probes 1 2 4 8 16 --rate 10 --seconds 5
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from controllers.database import DatabaseWriter  # noqa: E402
+from controllers.device import DOProbe  # noqa: E402
+from controllers.readers import MultiDOReader  # noqa: E402
+from controllers.schema import migrate, INSERT_DO_RECORD  # noqa: E402
+from controllers.simulators import DOProbeSimulator  # noqa: E402
+
+
+def serve_probes(count, rate, conn):
+    """Run count simulated probes until the parent says stop, sending it their URLs."""
+    simulators = [DOProbeSimulator(rate=rate, seed=k) for k in range(count)]
+    conn.send([simulator.start() for simulator in simulators])
+    conn.recv()
+    for simulator in simulators:
+        simulator.stop()
+
+
+def record(urls, seconds, multiplex, study_db):
+    """Record every URL for seconds; returns (CPU seconds, readings stored, reader threads)."""
+    writer = DatabaseWriter(study_db)
+    writer.start()
+    probes = {sample_id: DOProbe(url) for sample_id, url in enumerate(urls, 1)}
+    reader = MultiDOReader(probes, multiplex=multiplex)
+    threads = threading.active_count()
+
+    cpu = time.process_time()
+    reader.start()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        time.sleep(0.1)  # The GUI's after(100) drain
+        rows = [(f'sample{sample_id}', sample_id, r.time, r.dissolved_oxygen, r.nanoamperes, r.temperature)
+                for sample_id, records in reader.drain() for r in records]
+        if rows:
+            writer.insert_many(INSERT_DO_RECORD, rows)
+    threads = threading.active_count() - threads
+    reader.stop()
+    writer.close()
+    cpu = time.process_time() - cpu
+
+    for probe in probes.values():
+        probe.close()
+    with sqlite3.connect(study_db) as conn:
+        stored = conn.execute('SELECT COUNT(*) FROM dissolved_oxygen_records').fetchone()[0]
+        conn.execute('DELETE FROM dissolved_oxygen_records')
+    return cpu, stored, threads
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='Probe counts to run')
+    parser.add_argument('--rate', type=float, default=10, help='Readings per second from each probe')
+    parser.add_argument('--seconds', type=float, default=5, help='Recording time per run')
+    options = parser.parse_args(args)
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        study_db = os.path.join(tmp_dir, 'bench.db')
+        migrate(study_db)
+        print(f'{options.rate:g} readings/s per probe, {options.seconds:g} s per run')
+        print(f'{"probes":>6} {"reader":>8} {"threads":>8} {"stored":>8} {"CPU":>8} {"CPU/probe":>10}')
+        for count in options.probes:
+            for multiplex, name in ((True, 'select'), (False, 'threads')):
+                parent, child = context.Pipe()
+                server = context.Process(target=serve_probes, args=(count, options.rate, child))
+                server.start()
+                try:
+                    cpu, stored, threads = record(parent.recv(), options.seconds, multiplex, study_db)
+                finally:
+                    parent.send('stop')
+                    server.join()
+                usage = 100 * cpu / options.seconds
+                print(f'{count:6d} {name:>8} {threads:8d} {stored:8d} {usage:7.2f}% {usage / count:9.3f}%')
+
+
+if __name__ == '__main__':
+    main()
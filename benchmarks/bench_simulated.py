@@ -0,0 +1,233 @@
+"""
+End-to-end throughput of the acquisition code against simulated instruments.
+
+Runs the real drivers, readers, writers and stack pipeline over controllers.simulators: the DO probe and LCTF are
+served on localhost sockets and the camera is a SimulatedDCAM. Reports
+
+    do        record_do-style study: readings/s through DOProbe + DOReader and DB rows/s through DatabaseWriter
+    camera    frames/s of a continuous acquisition into the frame ring, of single snaps, and of averaging captures
+              (with their peak memory against averaging a list of frames)
+    stacks    capture_images-style stacks: stack time against the plan's prediction, frames/s and DB rows/s
+    calibration  with --calibrate, stacks are dark/flat corrected in place as they are captured (synthetic
+                 masters), and the cost of correcting one band is reported
+    analysis  with --analyze, online unmixing of every stack in worker processes: stacks analysed and skipped, and
+              the time per analysis (stack times above then include any interference from the workers)
+
+With --timing, per-stage latencies (controllers.timing) are recorded and printed after each benchmark, and the
+cost of the instrumentation itself is reported.
+
+    python benchmarks/bench_simulated.py --readings 50000 --size 1024 --stacks 3 --timing
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from controllers import timing  # noqa: E402
+from controllers.camera import CMOS  # noqa: E402
+from controllers.database import DatabaseWriter  # noqa: E402
+from controllers.device import DOProbe, LCTF  # noqa: E402
+from controllers.plan import AcquisitionPlan  # noqa: E402
+from controllers.acquisition import record_study, create_stack_tables, capture_stack  # noqa: E402
+from controllers.schema import migrate  # noqa: E402
+from controllers.simulators import DOProbeSimulator, LCTFSimulator, SimulatedCamera, SimulatedDCAM  # noqa: E402
+
+
+def bench_do(study_db, readings, rate):
+    migrate(study_db)
+    received = []
+    stored = []
+
+    def on_records(records):
+        received.append(len(records))
+        if sum(received) == readings:
+            # Time until the last reading is committed, not the reader's silence timeout that ends the study
+            arrived = time.perf_counter()
+            writer.flush()
+            stored.extend((arrived, time.perf_counter()))
+
+    with DOProbeSimulator(rate=rate, count=readings, seed=0) as simulator:
+        probe = DOProbe(simulator.url)
+        writer = DatabaseWriter(study_db)
+        writer.start()
+        start = time.perf_counter()
+        _, count = record_study(probe, writer, {'sample_name': 'bench'}, timeout=0.5, on_records=on_records)
+        writer.close()
+        probe.close()
+
+    conn = sqlite3.connect(study_db)
+    rows = conn.execute('SELECT count(*) FROM dissolved_oxygen_records').fetchone()[0]
+    conn.close()
+    if not stored:
+        print(f'do      only {count:,} of {readings:,} readings arrived')
+        return
+    arrived, committed = stored[0] - start, stored[1] - start
+    print(f'do      {count:,} readings in {arrived:.2f} s: {count / arrived:,.0f} readings/s, '
+          f'{rows / committed:,.0f} DB rows/s ({rows:,} rows, {probe.framer.dropped} lines dropped, '
+          f'{len(received)} batches)')
+
+
+def bench_camera(cmos, frames, average_frames):
+    ring = cmos.start_continuous(ring_size=64)
+    start = time.perf_counter()
+    ring.wait(frames - 1, timeout=60)
+    elapsed = time.perf_counter() - start
+    cmos.stop_continuous()
+    print(f'camera  continuous: {frames / elapsed:,.1f} frames/s ({ring.dropped} dropped)', end='')
+
+    snaps = max(1, frames // 10)
+    start = time.perf_counter()
+    for _ in range(snaps):
+        cmos.snap()
+    print(f', snap: {snaps / (time.perf_counter() - start):,.1f} frames/s')
+
+    # Averaging in place against stacking a list of frames and taking their mean
+    for label, capture in (('accumulated', lambda: cmos.capture(average_frames, variance=True)),
+                           ('list + np.mean', lambda: np.mean(cmos.capture(average_frames), axis=0))):
+        tracemalloc.start()
+        start = time.perf_counter()
+        capture()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'        average of {average_frames} ({label}): {average_frames / elapsed:,.1f} frames/s, '
+              f'peak {peak / 2 ** 20:,.1f} MiB')
+
+
+def bench_calibration(tmp_dir, size, wavelengths, exposures, repeats=50):
+    """A CalibrationStore with synthetic masters for every band, and the time to correct one uint16 band."""
+    from controllers.calibration import CalibrationStore
+
+    store = CalibrationStore(os.path.join(tmp_dir, 'calibration'))
+    rng = np.random.default_rng(0)
+    for exposure in sorted(set(exposures)):
+        store.save_dark(rng.normal(100, 2, (size, size)), exposure, 1)
+    for wavelength in (min(wavelengths), max(wavelengths)):
+        store.save_flat(rng.normal(1000, 20, (size, size)), wavelength, exposures[0], 1)
+
+    frame = rng.integers(100, 4000, (size, size), dtype=np.uint16)
+    store.correct(frame, exposures[0], wavelengths[0])  # Fill the cache
+    start = time.perf_counter()
+    for k in range(repeats):
+        store.correct(frame, exposures[0], wavelengths[0])
+    print(f'calibration {(time.perf_counter() - start) / repeats * 1e3:.2f} ms to correct a {size}x{size} band')
+    return store
+
+
+def bench_stacks(study_db, tmp_dir, lctf, cmos, wavelengths, exposures, stacks, analysis_workers=0, calibration=None):
+    plan = AcquisitionPlan(wavelengths, exposures)
+    predicted = plan.predicted_time()
+    writer = DatabaseWriter(study_db)
+    writer.start()
+    create_stack_tables(writer, 'bench')
+    analysis = None
+    if analysis_workers:
+        from controllers.unmixing import OnlineAnalysis
+        analysis = OnlineAnalysis(writer, workers=analysis_workers)
+
+    times = []
+    start = time.perf_counter()
+    for k in range(stacks):
+        trace = capture_stack(lctf, cmos, writer, 'bench', os.path.join(tmp_dir, f'stack_{k:04d}.tiff'), plan,
+                              analysis=analysis, calibration=calibration)
+        times.append(trace.stack_time)
+    writer.flush()
+    elapsed = time.perf_counter() - start
+    if analysis is not None:
+        analysis.close()
+        analysed = [stats['analysis_s'] for _, stats in analysis.results]
+        drained = time.perf_counter() - start
+    writer.close()
+
+    conn = sqlite3.connect(study_db)
+    rows = conn.execute('SELECT count(*) FROM bench_details').fetchone()[0]
+    conn.close()
+    bands = len(plan) * stacks
+    print(f'stacks  {stacks} x {len(plan)} bands: {np.mean(times):.3f} s/stack (best {min(times):.3f} s, predicted '
+          f'{predicted:.3f} s, bound {trace.minimum_time:.3f} s), {bands / elapsed:,.1f} frames/s, '
+          f'{rows / elapsed:,.1f} DB rows/s')
+    if analysis is not None:
+        print(f'analysis {len(analysed)} stacks analysed, {analysis.skipped} skipped, '
+              f'{np.mean(analysed) if analysed else 0:.3f} s/stack in a worker, all done '
+              f'{drained - elapsed:.2f} s after the last stack')
+
+
+def bench_overhead(calls=1_000_000):
+    """Nanoseconds per start()/stop() pair with timing disabled and enabled."""
+    costs = []
+    for on in (False, True):
+        timing.enable(on)
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            timing.stop('overhead', timing.start())
+        costs.append((time.perf_counter_ns() - start) / calls)
+    timing.stages.pop('overhead', None)
+    print(f'timing  start/stop: {costs[0]:.0f} ns disabled, {costs[1]:.0f} ns enabled')
+
+
+def report_timing():
+    if timing.enabled:
+        print(timing.summary())
+        timing.reset()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--readings', type=int, default=50_000, help='DO readings to record')
+    parser.add_argument('--do-rate', type=float, default=0, help='DO lines per second (0: as fast as possible)')
+    parser.add_argument('--size', type=int, default=1024, help='Simulated sensor width and height')
+    parser.add_argument('--fps', type=float, default=100, help='Simulated camera readout rate')
+    parser.add_argument('--frames', type=int, default=200, help='Frames for the camera benchmark')
+    parser.add_argument('--average', type=int, default=32, help='Frames per averaging capture')
+    parser.add_argument('--stacks', type=int, default=3, help='Stacks to capture')
+    parser.add_argument('--wavelengths', type=float, nargs='+', default=list(range(500, 701, 10)))
+    parser.add_argument('--exposure', type=float, default=0.01, help='Exposure of every band (s)')
+    parser.add_argument('--settle', type=float, default=0.01, help='LCTF settle time per tune (s)')
+    parser.add_argument('--settle-per-nm', type=float, default=2e-4, help='Additional LCTF settle time per nm (s)')
+    parser.add_argument('--timing', action='store_true', help='Record and print per-stage latencies')
+    parser.add_argument('--calibrate', action='store_true', help='Dark/flat correct every band as it is captured')
+    parser.add_argument('--analyze', type=int, default=0, metavar='WORKERS',
+                        help='Unmix every stack online in this many worker processes')
+    options = parser.parse_args(args)
+
+    if options.timing:
+        bench_overhead()
+    timing.enable(options.timing)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        study_db = os.path.join(tmp_dir, 'bench.db')
+        bench_do(study_db, options.readings, options.do_rate)
+        report_timing()
+
+        filter_simulator = LCTFSimulator(settle=options.settle, settle_per_nm=options.settle_per_nm)
+        # Brighter towards the red, so bands differ like a real spectrum
+        camera = SimulatedCamera(options.size, options.size, fps=options.fps,
+                                 brightness=lambda: 2e5 * (1 + (filter_simulator.wavelength - 400) / 100))
+        cmos = CMOS(sdk=SimulatedDCAM(camera))
+        cmos.exposure_time = options.exposure
+        bench_camera(cmos, options.frames, options.average)
+        report_timing()
+
+        exposures = [options.exposure] * len(options.wavelengths)
+        calibration = None
+        if options.calibrate:
+            calibration = bench_calibration(tmp_dir, options.size, options.wavelengths, exposures)
+
+        with filter_simulator:
+            lctf = LCTF(filter_simulator.url)
+            bench_stacks(study_db, tmp_dir, lctf, cmos, options.wavelengths, exposures, options.stacks,
+                         options.analyze, calibration)
+            print(f'        LCTF round trips:\n{lctf.latency_summary()}')
+            report_timing()
+            lctf.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Time-lapse storage: one TIFF per stack (StackWriter) against a compressed TimeLapse container.
+
+Writes --stacks synthetic stacks (a vignetted illumination pattern with shot and read noise, like the simulated
+camera) both ways and reports write throughput and size on disk, then the time to read one band's series over the
+whole time-lapse and one pixel's spectrum over time.
+
+    python benchmarks/bench_timelapse.py --stacks 50 --bands 21 --size 1024 --workers 4
+"""
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tifffile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from controllers.stacks import StackWriter  # noqa: E402
+from controllers.timelapse import TimeLapse  # noqa: E402
+
+
+def synthetic_frames(size, bands, seed=0):
+    """Function (t, band) -> uint16 frame, cheap enough not to dominate the write timings."""
+    rng = np.random.default_rng(seed)
+    y, x = np.ogrid[-1:1:size * 1j, -1:1:size * 1j]
+    pattern = np.exp(-(x ** 2 + y ** 2)) * (0.8 + 0.2 * np.sin(12 * x) * np.cos(9 * y))
+    levels = 2000 * (1 + np.arange(bands) / bands)
+    noise = [rng.normal(100, 2 + np.sqrt(levels.mean()) / 4, (size, size)).astype(np.float32) for _ in range(4)]
+
+    def frame(t, band):
+        signal = pattern * levels[band] * (1 - 0.3 * t / 100)
+        return (signal + noise[(t + band) % len(noise)]).clip(0, 65535).astype(np.uint16)
+    return frame
+
+
+def disk_size(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--stacks', type=int, default=50, help='Time points')
+    parser.add_argument('--bands', type=int, default=21, help='Bands per stack')
+    parser.add_argument('--size', type=int, default=1024, help='Frame width and height')
+    parser.add_argument('--workers', type=int, default=4, help='Compression threads')
+    parser.add_argument('--chunk', type=int, default=128, help='Tile size')
+    parser.add_argument('--codec', default=None, help='zstd or zlib (default: zstd if installed)')
+    parser.add_argument('--level', type=int, default=None, help='Compression level (default: per codec)')
+    options = parser.parse_args(args)
+
+    frame = synthetic_frames(options.size, options.bands)
+    frames = [[frame(t, band) for band in range(options.bands)] for t in range(min(options.stacks, 8))]
+    wavelengths = list(np.linspace(500, 700, options.bands))
+    exposures = [0.01] * options.bands
+    raw = options.stacks * options.bands * options.size ** 2 * 2
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        for t in range(options.stacks):
+            with StackWriter(os.path.join(tmp_dir, f'stack_{t:04d}.tiff'), wavelengths, exposures) as stack:
+                for band in range(options.bands):
+                    stack.write(band, frames[t % len(frames)][band])
+        tiff_time = time.perf_counter() - start
+        tiffs = sorted(glob.glob(os.path.join(tmp_dir, 'stack_*.tiff')))
+
+        path = os.path.join(tmp_dir, 'bench.lapse')
+        start = time.perf_counter()
+        with TimeLapse(path, wavelengths, exposures, chunk=options.chunk, codec=options.codec, level=options.level,
+                       workers=options.workers) as lapse:
+            for t in range(options.stacks):
+                with lapse.stack() as stack:
+                    for band in range(options.bands):
+                        stack.write(band, frames[t % len(frames)][band])
+        lapse_time = time.perf_counter() - start
+        lapse_size = disk_size(glob.glob(os.path.join(path, '*')))
+
+        print(f'{options.stacks} stacks x {options.bands} bands of {options.size}x{options.size} '
+              f'({raw / 2 ** 30:.2f} GiB raw)')
+        print(f'write   tiff   {tiff_time:6.2f} s {raw / tiff_time / 2 ** 20:8,.0f} MiB/s '
+              f'{disk_size(tiffs) / 2 ** 20:8,.0f} MiB on disk in {len(tiffs)} files')
+        print(f'write   lapse  {lapse_time:6.2f} s {raw / lapse_time / 2 ** 20:8,.0f} MiB/s '
+              f'{lapse_size / 2 ** 20:8,.0f} MiB on disk ({raw / lapse_size:.2f}x, {lapse.codec}, '
+              f'{options.workers} threads)')
+
+        band, y, x = options.bands // 2, options.size // 3, options.size // 2
+        start = time.perf_counter()
+        # Every TIFF has to be opened; memory-mapping them reads only the pages needed
+        series = np.array([np.array(tifffile.memmap(tiff, mode='r')[band]) for tiff in tiffs])
+        tiff_band = time.perf_counter() - start
+        start = time.perf_counter()
+        spectra = np.array([np.array(tifffile.memmap(tiff, mode='r')[:, y, x]) for tiff in tiffs])
+        tiff_pixel = time.perf_counter() - start
+
+        with TimeLapse(path) as lapse:
+            start = time.perf_counter()
+            lapse_series = lapse.band_series(wavelengths[band])
+            lapse_band = time.perf_counter() - start
+            start = time.perf_counter()
+            lapse_spectra = lapse.pixel_series(y, x)
+            lapse_pixel = time.perf_counter() - start
+        assert np.array_equal(series, lapse_series) and np.array_equal(spectra, lapse_spectra)
+
+        print(f'read    band series over time:  tiff {tiff_band * 1e3:8.1f} ms, lapse {lapse_band * 1e3:8.1f} ms')
+        print(f'read    pixel spectrum over time: tiff {tiff_pixel * 1e3:6.1f} ms, lapse {lapse_pixel * 1e3:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,20 @@
-import serial
-from controllers.device import DOProbe, CMOS, LCTF
+import importlib
+
+# Devices are imported on first use so DO-only work needs neither the DCAM SDK nor OpenCV
+_LAZY = {
+    'DOProbe': 'controllers.device',
+    'LCTF': 'controllers.device',
+    'CMOS': 'controllers.camera',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_LAZY[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))
@@ -0,0 +1,156 @@
+"""
+Acquisition steps shared by the Tk routines and the headless protocol runner: recording a DO study, resolving the
+band plan and capturing a stack into a study's tables.
+"""
+import queue
+import time
+
+from controllers.exposure import AutoExposure, load_exposure_table
+from controllers.readers import DOReader
+from controllers.schema import INSERT_STUDY, INSERT_DO_RECORD, STUDY_FIELDS
+
+
+def study_params(metadata):
+    """INSERT_STUDY parameters from a sample metadata dict, filling in defaults for missing fields."""
+    if not metadata.get('sample_name'):
+        raise ValueError('Sample name is required!')
+    return tuple(metadata.get(field, default) for field, default in STUDY_FIELDS.items())
+
+
+def record_study(probe, writer, metadata, timeout=10, duration=None, on_records=None):
+    """
+    Record one DO study until the probe has been silent for timeout seconds or duration has passed.
+
+    Readings are stored through writer as they arrive; on_records, if given, is called with each batch.
+    Returns (sample_id, number of readings).
+    """
+    sample_name = metadata['sample_name']
+    sample_id = writer.execute(INSERT_STUDY, study_params(metadata))
+    probe.framer.reset()  # Drop any partial line left over from the previous study
+    reader = DOReader(probe, timeout=timeout)
+    reader.start()
+    end = None if duration is None else time.monotonic() + duration
+    count = 0
+    try:
+        while not reader.finished and (end is None or time.monotonic() < end):
+            try:
+                records = reader.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            writer.insert_many(INSERT_DO_RECORD, [(sample_name, sample_id, r.time, r.dissolved_oxygen, r.nanoamperes,
+                                                   r.temperature) for r in records])
+            count += len(records)
+            if on_records is not None:
+                on_records(records)
+    finally:
+        reader.stop()
+    if reader.dropped:
+        print(f'{reader.dropped} reads were dropped because the queue was full.')
+    return sample_id, count
+
+
+def resolve_bands(cmos, lctf, study_db, wavelengths=None, exposures=None, auto_exposure=False, sample_type=None):
+    """
+    Fill in the band plan: (wavelengths, exposures, found, levels).
+
+    Missing wavelengths default to the filter's current one and missing exposures to the camera's. With
+    auto_exposure the saved exposure table for (sample_type, binning) is used and only the wavelengths it lacks are
+    searched; found and levels hold those new results so they can be saved with save_exposure_table().
+    """
+    found, levels = {}, {}
+    if auto_exposure and exposures is None and wavelengths is not None:
+        table = load_exposure_table(study_db, sample_type, cmos.binning)
+        missing = [lam for lam in wavelengths if lam not in table]
+        if missing:
+            search = AutoExposure(cmos)
+            found = search.run(lctf, missing, start=table)
+            levels = search.levels
+            table.update(found)
+        exposures = [table[lam] for lam in wavelengths]
+
+    if exposures is None and wavelengths is None:
+        exposures = [cmos.exposure_time]
+        wavelengths = [lctf.wavelength]
+    elif exposures is None:
+        exposures = [cmos.exposure_time] * len(wavelengths)
+    elif wavelengths is None:
+        wavelengths = [lctf.wavelength] * len(exposures)
+    return wavelengths, exposures, found, levels
+
+
+# Exposure a dry run assumes for bands whose exposure would only be known by asking the camera or searching
+DRY_RUN_EXPOSURE = 0.05
+
+
+def dry_run_bands(study_db, wavelengths, exposures=None, auto_exposure=False, sample_type=None, binning=1,
+                  exposure=DRY_RUN_EXPOSURE):
+    """
+    The (wavelengths, exposures) resolve_bands() would plan, without opening any device.
+
+    With auto_exposure the saved exposure table is read (the database is neither created nor upgraded); any other
+    missing exposure is the given placeholder. The wavelengths are required, since only the filter knows its own.
+    """
+    if wavelengths is None:
+        raise ValueError('A dry run needs the wavelengths; only the filter can tell its current one.')
+    if exposures is None:
+        table = load_exposure_table(study_db, sample_type, binning, read_only=True) if auto_exposure else {}
+        exposures = [table.get(lam, exposure) for lam in wavelengths]
+    return list(wavelengths), list(exposures)
+
+
+def create_stack_tables(writer, study_name):
+    writer.execute(f"""
+    CREATE TABLE IF NOT EXISTS {study_name}_index (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        image_name TEXT NOT NULL,
+        time DATETIME DEFAULT CURRENT_TIMESTAMP)""")
+
+    writer.execute(f"""
+    CREATE TABLE IF NOT EXISTS {study_name}_details (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        image_name TEXT NOT NULL,
+        exposure_time FLOAT NOT NULL,
+        lambda INT NOT NULL,
+        time DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (image_name) REFERENCES {study_name}_index (image_name)) """)
+
+
+def capture_stack(lctf, cmos, writer, study_name, image_name, plan, analysis=None, calibration=None, lapse=None):
+    """
+    Capture and save one stack of a study (tables from create_stack_tables()). Returns the StackTrace.
+
+    If calibration (a CalibrationStore) is given, every band is dark/flat corrected in place before it is written.
+    If analysis (an OnlineAnalysis) is given, the finished stack is queued on it for unmixing. If lapse (a TimeLapse)
+    is given, the stack is appended to it as its next time point instead of being written to image_name, and is
+    recorded in the study's tables as '<container>#<time point>'.
+    """
+    from controllers.stacks import StackWriter
+
+    if analysis is not None and lapse is not None:
+        raise ValueError('Online analysis reads TIFF stacks; it cannot be combined with a time-lapse container.')
+    metadata = {'study_name': study_name}
+    if calibration is not None:
+        binning = cmos.binning
+        calibration.check(plan.exposures, plan.wavelengths, binning)
+        metadata['calibration'] = calibration.directory
+    if lapse is not None:
+        stack = lapse.stack()
+        image_name = stack.name
+    else:
+        stack = StackWriter(image_name, plan.wavelengths, plan.exposures, metadata=metadata)
+    writer.execute(f"""INSERT INTO {study_name}_index (image_name) VALUES (?)""", (image_name,))
+
+    # Each band is written to disk as soon as it is captured. Tuning, capture and saving overlap between bands.
+    with stack:
+        def save_band(index, frame, lam, tau):
+            if calibration is not None:
+                calibration.correct(frame, tau, lam, binning)
+            stack.write(index, frame)
+            writer.insert(f"""
+            INSERT INTO {study_name}_details (image_name, exposure_time, lambda) VALUES (?, ?, ?)""",
+                          (image_name, tau, lam))
+
+        trace = plan.run(lctf, cmos, save_band)
+    if analysis is not None:
+        analysis.submit(image_name, plan.wavelengths, plan.exposures, study_name)
+    return trace
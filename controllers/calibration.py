@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from controllers import timing
+
+
+class CalibrationStore:
+    """
+    Master dark frames keyed by (exposure, binning) and flat fields keyed by (wavelength, binning), kept on disk.
+
+    Each master is a float32 .npy file in directory, listed in an index.json, and is opened memory-mapped, so only the
+    frames actually used are read. Darks for exposures that were not measured are interpolated (or extrapolated)
+    linearly from the two nearest measured exposures, since dark signal is an offset plus a current times the
+    exposure; flats for unmeasured wavelengths are interpolated between their neighbours. The dark and gain (1 / flat)
+    frames in use are kept in an LRU cache of cache_size frames, so correcting a stack reads each of them only once.
+    """
+
+    def __init__(self, directory, cache_size=8):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()  # (kind, binning, key) -> float32 frame
+        self._lock = threading.Lock()
+        self._local = threading.local()  # Per-thread scratch frame for correcting integer frames
+        self.entries = self._load_index()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def keys(self, kind, binning):
+        """Sorted exposures (kind 'dark') or wavelengths (kind 'flat') with a master frame at this binning."""
+        return sorted(entry['key'] for entry in self.entries if entry['kind'] == kind and entry['binning'] == binning)
+
+    def save_dark(self, frame, exposure, binning, nb_frames=None):
+        """Store an averaged dark frame as the master dark for (exposure, binning)."""
+        self._save('dark', frame, float(exposure), binning, nb_frames)
+
+    def save_flat(self, frame, wavelength, exposure, binning, nb_frames=None):
+        """
+        Store an averaged frame of a uniform target as the flat field for (wavelength, binning).
+
+        The dark for its exposure is subtracted (if darks exist) and the result is normalised to a mean of 1.
+        """
+        flat = np.asarray(frame, dtype=np.float32)
+        if self.keys('dark', binning):
+            flat = flat - self.dark(exposure, binning)
+        mean = flat.mean()
+        if mean <= 0:
+            raise ValueError(f'The flat at {wavelength} nm has no signal above the dark.')
+        self._save('flat', flat / mean, float(wavelength), binning, nb_frames)
+
+    def load(self, kind, key, binning):
+        """Memory-mapped master frame stored for exactly (key, binning)."""
+        for entry in self.entries:
+            if (entry['kind'], entry['key'], entry['binning']) == (kind, key, binning):
+                return np.load(os.path.join(self.directory, entry['file']), mmap_mode='r')
+        raise KeyError(f'No {kind} frame for {key} at binning {binning}.')
+
+    def dark(self, exposure, binning):
+        """Dark frame for any exposure (s), interpolated from the measured ones."""
+        return self._cached('dark', binning, float(exposure), extrapolate=True)
+
+    def gain(self, wavelength, binning):
+        """Flat-field gain (1 / flat; 0 where the flat has no signal) for any wavelength within the measured ones."""
+        return self._cached('gain', binning, float(wavelength), extrapolate=False)
+
+    def correct(self, frame, exposure, wavelength=None, binning=1):
+        """
+        Subtract the dark and, if flats exist for this binning and wavelength is given, divide by the flat, in place.
+
+        Float frames are corrected directly. Integer frames are corrected in a reusable float32 scratch frame and
+        written back rounded and clipped to their dtype, so a raw uint16 frame stays uint16 and nothing is allocated
+        per frame. Returns frame.
+        """
+        start = timing.start()
+        dark = self.dark(exposure, binning)
+        if dark.shape != frame.shape:
+            raise ValueError(f'Frame shape {frame.shape} does not match the calibration frames {dark.shape}.')
+        gain = None
+        if wavelength is not None and self.keys('flat', binning):
+            gain = self.gain(wavelength, binning)
+
+        if np.issubdtype(frame.dtype, np.floating):
+            frame -= dark
+            if gain is not None:
+                frame *= gain
+        else:
+            work = self._scratch(frame.shape)
+            np.subtract(frame, dark, out=work)
+            if gain is not None:
+                work *= gain
+            limits = np.iinfo(frame.dtype)
+            np.clip(work, limits.min, limits.max, out=work)
+            np.rint(work, out=work)
+            np.copyto(frame, work, casting='unsafe')
+        timing.stop('calibration.correct', start)
+        return frame
+
+    def check(self, exposures, wavelengths, binning):
+        """Raise ValueError unless every (exposure, wavelength) band of a plan can be corrected at this binning."""
+        if not self.keys('dark', binning):
+            raise ValueError(f'No dark frames at binning {binning} in {self.directory}.')
+        flats = self.keys('flat', binning)
+        outside = [lam for lam in wavelengths if flats and not flats[0] <= lam <= flats[-1]]
+        if outside:
+            raise ValueError(f'No flats around {outside} nm at binning {binning} (measured {flats[0]}-{flats[-1]} nm).')
+
+    def _cached(self, kind, binning, key, extrapolate):
+        cache_key = (kind, binning, key)
+        with self._lock:
+            frame = self._cache.get(cache_key)
+            if frame is not None:
+                self._cache.move_to_end(cache_key)
+                self.hits += 1
+                return frame
+            self.misses += 1
+
+            stored = 'dark' if kind == 'dark' else 'flat'
+            frame = self._interpolate(stored, binning, key, extrapolate)
+            if kind == 'gain':
+                gain = np.zeros_like(frame)
+                np.divide(1, frame, out=gain, where=frame > 1e-3)  # Dead pixels get no gain instead of inf
+                frame = gain
+            frame.flags.writeable = False  # Shared by every caller
+            self._cache[cache_key] = frame
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return frame
+
+    def _interpolate(self, kind, binning, key, extrapolate):
+        keys = self.keys(kind, binning)
+        if not keys:
+            raise KeyError(f'No {kind} frames at binning {binning} in {self.directory}.')
+        if key in keys or len(keys) == 1:
+            return np.array(self.load(kind, key if key in keys else keys[0], binning), dtype=np.float32)
+
+        # The two nearest measured keys around key (or, outside the measured range, at the end it is closest to)
+        upper = int(np.clip(np.searchsorted(keys, key), 1, len(keys) - 1))
+        low, high = keys[upper - 1], keys[upper]
+        if not extrapolate and not low <= key <= high:
+            return np.array(self.load(kind, low if key < low else high, binning), dtype=np.float32)
+        weight = np.float32((key - low) / (high - low))
+        frame = np.array(self.load(kind, low, binning), dtype=np.float32)
+        frame += weight * (self.load(kind, high, binning) - frame)
+        return frame
+
+    def _scratch(self, shape):
+        scratch = getattr(self._local, 'frame', None)
+        if scratch is None or scratch.shape != shape:
+            scratch = self._local.frame = np.empty(shape, dtype=np.float32)
+        return scratch
+
+    def _save(self, kind, frame, key, binning, nb_frames):
+        name = f'{kind}_bin{binning}_{key:g}{"s" if kind == "dark" else "nm"}.npy'
+        np.save(os.path.join(self.directory, name), np.asarray(frame, dtype=np.float32))
+        with self._lock:
+            self.entries = [entry for entry in self.entries
+                            if (entry['kind'], entry['key'], entry['binning']) != (kind, key, binning)]
+            self.entries.append({'kind': kind, 'key': key, 'binning': binning, 'file': name, 'nb_frames': nb_frames,
+                                 'epoch_time': time.time()})
+            self._cache.clear()  # Interpolated frames may depend on the new master
+            self._save_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def _save_index(self):
+        tmp = f'{self.index_path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp, self.index_path)  # Atomic, so the index is never half written
+
+
+def measure_darks(cmos, store, exposures, nb_frames=32):
+    """Average nb_frames frames at each exposure (with the light path blocked) and store them as master darks."""
+    binning = cmos.binning
+    for exposure in exposures:
+        cmos.exposure_time = exposure
+        store.save_dark(cmos.capture(nb_frames, average=True), exposure, binning, nb_frames)
+        print(f'Dark at {exposure} s stored.')
+
+
+def measure_flats(cmos, lctf, store, wavelengths, exposures, nb_frames=32):
+    """Average nb_frames frames of a uniform target at each band and store them as flat fields (darks first)."""
+    binning = cmos.binning
+    for wavelength, exposure in zip(wavelengths, exposures):
+        lctf.wavelength = wavelength
+        cmos.exposure_time = exposure
+        store.save_flat(cmos.capture(nb_frames, average=True), wavelength, exposure, binning, nb_frames)
+        print(f'Flat at {wavelength} nm stored.')
@@ -0,0 +1,351 @@
+import ctypes
+import threading
+
+import numpy as np
+
+from controllers import timing
+from controllers.frames import FrameRing, FrameAccumulator
+from controllers.properties import CameraProperties
+
+
+class CMOS:
+    def __init__(self, camera_index=0, sdk=None):
+        # sdk provides the hamamatsu.dcam interface (dcam, Stream, copy_frame, ...), e.g. a simulators.SimulatedDCAM
+        if sdk is None:
+            from hamamatsu import dcam as sdk
+        self.sdk = sdk
+
+        # Instantiate DCAM and enter context
+        self.dcam = sdk.dcam
+        self.dcam.__enter__()
+        self.camera = self.dcam[camera_index]
+        self.camera.__enter__()
+        self.properties = CameraProperties(self.camera)
+
+        self.streaming = False
+        self.root = None
+        self.live_view = None
+
+        # Continuous acquisition state
+        self.ring = None
+        self._continuous = None
+        self._continuous_stream = None
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Stop any continuous acquisition and release the camera and the DCAM API. Safe to call more than once."""
+        if getattr(self, 'camera', None) is None:
+            return
+        try:
+            self.stop_continuous()
+        finally:
+            camera, self.camera = self.camera, None
+            camera.__exit__(None, None, None)
+            self.dcam.__exit__(None, None, None)
+
+    def __getitem__(self, name):
+        return self.properties[name]
+
+    def __setitem__(self, name, value):
+        self.properties[name] = value
+
+    def configure(self, config):
+        """Apply a dict of camera properties (exposure_time, binning, roi, trigger_source, ...) in one batch."""
+        return self.properties.apply(config)
+
+    @property
+    def exposure_time(self):
+        return self.properties['exposure_time']
+
+    @exposure_time.setter
+    def exposure_time(self, exposure_time):
+        self.properties['exposure_time'] = exposure_time
+
+    @property
+    def binning(self):
+        return self.properties['binning']
+
+    @binning.setter
+    def binning(self, binning):
+        self.properties['binning'] = binning
+
+    def capture(self, nb_frames=1, average=False, variance=False, nb_buffers=8):
+        """
+        Capture nb_frames frames: one frame, a list of frames, or with average their float32 mean.
+
+        Averaging adds each frame straight from the DCAM buffer into one preallocated accumulator (see
+        FrameAccumulator) while the camera cycles through nb_buffers buffers, so memory stays at a few frames however
+        many are averaged. With variance it returns (mean, variance) for a per-pixel noise map.
+        """
+        if average or variance:
+            return self._capture_average(nb_frames, variance, nb_buffers)
+        if self.continuous:
+            # Take the next frames from the running acquisition instead of setting up a new stream
+            return self._capture_continuous(nb_frames)
+
+        with self.sdk.Stream(self.camera, nb_frames) as stream:
+            self.camera.start()
+            frames = []
+            try:
+                for i, frame_buffer in enumerate(stream):
+                    frame = self.sdk.copy_frame(frame_buffer)
+                    frames.append(frame)
+            finally:
+                self.camera.stop()
+        if nb_frames == 1:
+            return frames[0]
+        return frames
+
+    def _capture_average(self, nb_frames, variance, nb_buffers):
+        accumulator = FrameAccumulator(variance)
+        if self.continuous:
+            # Add the next frames of the running acquisition straight from the ring
+            first = self.ring.count
+            for index in range(first, first + nb_frames):
+                if not self.ring.wait(index, timeout=10):
+                    raise TimeoutError('No frame received from the camera.')
+                frame, index = self.ring.view(index)
+                try:
+                    accumulator.add(frame)
+                finally:
+                    self.ring.release(index)
+        else:
+            nb_buffers = min(nb_buffers, nb_frames)
+            lost = 0
+            with self.sdk.Stream(self.camera, nb_buffers) as stream:
+                self.camera.start(live=True)  # Cycle through the buffers until enough frames were added
+                try:
+                    for frame_buffer, overrun in self._live_buffers(stream, nb_buffers):
+                        lost += overrun
+                        with timing.timed('camera.accumulate'):
+                            accumulator.add(self._frame_view(frame_buffer))
+                        if accumulator.count == nb_frames:
+                            break
+                finally:
+                    self.camera.stop()
+            if lost:
+                print(f'{lost} frames were overwritten before they could be averaged; later frames were used.')
+        if accumulator.count < nb_frames:
+            raise RuntimeError(f'Camera stopped after {accumulator.count} of {nb_frames} frames.')
+        if variance:
+            return accumulator.mean, accumulator.variance
+        return accumulator.mean
+
+    def _frame_view(self, frame_buffer):
+        """Zero-copy array over a locked DCAM buffer, in the layout copy_frame produces. Only valid until reused."""
+        dtype = np.dtype(self.sdk.EImagePixelType(frame_buffer.type).dtype())
+        nbytes = frame_buffer.width * frame_buffer.height * dtype.itemsize
+        address = ctypes.cast(frame_buffer.buf, ctypes.c_void_p).value
+        data = (ctypes.c_char * nbytes).from_address(address)
+        return np.frombuffer(data, dtype=dtype).reshape(frame_buffer.width, frame_buffer.height)
+
+    def snap(self, on_exposure_end=None):
+        """
+        Capture a single frame, calling on_exposure_end as soon as the sensor stops integrating.
+
+        The callback fires before the frame is read out, so other hardware (e.g. the LCTF) can start moving while
+        the readout is still in progress. Cameras that do not report exposure end get the callback when the frame
+        is ready instead.
+        """
+        EWaitEvent = self.sdk.EWaitEvent
+        mask = EWaitEvent.CAP_FRAMEREADY | EWaitEvent.CAP_STOPPED | EWaitEvent.CAP_EXPOSUREEND
+        frame = None
+        with self.sdk.FrameStream(self.camera, 1) as frames, self.sdk.EventStream(self.camera, mask=mask) as events:
+            started = timing.start()
+            self.camera.start()
+            exposure_end = 0
+            try:
+                for event in events:
+                    if event & EWaitEvent.CAP_EXPOSUREEND:
+                        timing.stop('camera.exposure', started)
+                        exposure_end = timing.start()
+                    if event & (EWaitEvent.CAP_EXPOSUREEND | EWaitEvent.CAP_FRAMEREADY) and on_exposure_end:
+                        on_exposure_end()
+                        on_exposure_end = None
+                    if event & EWaitEvent.CAP_FRAMEREADY:
+                        timing.stop('camera.readout', exposure_end)
+                        with timing.timed('camera.copy'):
+                            frame = self.sdk.copy_frame(next(frames))
+                        break
+                    if event & EWaitEvent.CAP_STOPPED:
+                        break
+            finally:
+                self.camera.stop()
+        if frame is None:
+            raise RuntimeError('Camera stopped before a frame was captured.')
+        return frame
+
+    @property
+    def continuous(self):
+        return self._continuous is not None and self._continuous.is_alive()
+
+    def start_continuous(self, nb_buffers=8, ring_size=32):
+        """
+        Start a continuous acquisition that keeps the camera running and return the FrameRing it fills.
+
+        One DCAM stream with nb_buffers buffers is opened for the whole acquisition. A background thread copies every
+        new frame into a preallocated ring of ring_size frames and counts frames the camera overwrote before they
+        could be copied.
+        """
+        if self.continuous:
+            return self.ring
+
+        self.ring = FrameRing(ring_size)
+        self._continuous_stream = self.sdk.Stream(self.camera, nb_buffers)
+        self._continuous_stream.__enter__()
+        try:
+            self.camera.start(live=True)  # Sequence mode cycles through the buffers until stopped
+        except Exception:
+            self._continuous_stream.close()
+            self._continuous_stream = None
+            raise
+        self._continuous = threading.Thread(target=self._acquire_continuous, args=(self._continuous_stream, nb_buffers),
+                                            daemon=True)
+        self._continuous.start()
+        return self.ring
+
+    def stop_continuous(self):
+        """Stop a continuous acquisition started with start_continuous and release its buffers."""
+        if self._continuous is None:
+            return
+        try:
+            self.camera.stop()
+        finally:
+            self._continuous_stream.event_stream.abort()
+            self._continuous.join()
+            self._continuous = None
+            self._continuous_stream = None
+
+    def _live_buffers(self, stream, nb_buffers):
+        """
+        Yield (locked buffer, frames lost just before it) for each new frame of a live acquisition until it stops.
+
+        The camera cycles through nb_buffers buffers; frames it overwrote before they were reached are skipped.
+        """
+        EWaitEvent = self.sdk.EWaitEvent
+        transfers = self.camera.transfer_stream()
+        copied = 0
+        for event in stream.event_stream:
+            if event & EWaitEvent.CAP_STOPPED:
+                break
+            if not event & EWaitEvent.CAP_FRAMEREADY:
+                continue
+
+            # Only the last nb_buffers frames are still in the camera buffers
+            captured = next(transfers).nFrameCount
+            first = max(copied, captured - nb_buffers)
+            lost = first - copied
+            for index in range(first, captured):
+                yield self.camera._lock_frame_index(index % nb_buffers), lost
+                lost = 0
+            copied = captured
+
+    def _acquire_continuous(self, stream, nb_buffers):
+        try:
+            for frame_buffer, lost in self._live_buffers(stream, nb_buffers):
+                self.ring.add_dropped(lost)
+                self._copy_into_ring(frame_buffer)
+        except Exception as e:
+            print(f"Error during continuous acquisition: {e}")
+        finally:
+            stream.close()
+
+    def _copy_into_ring(self, frame_buffer):
+        dtype = self.sdk.EImagePixelType(frame_buffer.type).dtype()
+        # Same layout copy_frame produces
+        slot = self.ring.reserve((frame_buffer.width, frame_buffer.height), dtype)
+        if slot is None:
+            return
+        ctypes.memmove(slot.ctypes.data, frame_buffer.buf, slot.nbytes)
+        self.ring.commit()
+
+    def _capture_continuous(self, nb_frames, timeout=10):
+        first = self.ring.count
+        frames = []
+        for index in range(first, first + nb_frames):
+            if not self.ring.wait(index, timeout):
+                raise TimeoutError('No frame received from the camera.')
+            frames.append(self.ring.get(index))
+        if nb_frames == 1:
+            return frames[0]
+        return frames
+
+    def stream(self):
+        """Yield the newest frame from a continuous acquisition for as long as streaming is on."""
+        ring = self.start_continuous()
+        last = ring.newest
+        try:
+            while self.streaming:
+                if not ring.wait(last + 1, timeout=1):
+                    continue
+                last = ring.newest
+                yield ring.get(last)
+        except Exception as e:
+            print(f"Error during streaming: {e}")
+            self.streaming = False
+        finally:
+            self.stop_continuous()
+
+    def view(self, live=True):
+        if not live:
+            import cv2
+
+            frame = self.capture(nb_frames=1)
+            frame = self._display_frame(frame)
+            cv2.imshow("CMOS View", frame)
+            cv2.waitKey(0)
+            cv2.destroyAllWindows()
+            return
+
+        import tkinter as tk
+        from controllers.liveview import LiveView
+
+        # Initialize Tkinter window
+        self.root = tk.Toplevel()  # Use Toplevel() so this can be called from other GUIs
+        self.root.title("CMOS Camera Stream")
+        self.root.geometry('800x800')
+
+        container = tk.Frame(self.root)
+        container.pack(pady=10)
+
+        # Create a label to display the camera feed
+        self.video_label = tk.Label(container, width=640, height=640)
+        self.video_label.pack()
+
+        # Frame rate and latency readout
+        status_label = tk.Label(self.root, font=("Courier", 10))
+        status_label.pack()
+
+        # OK Button to stop streaming
+        stop_button = tk.Button(self.root, text="OK", command=self.stop_stream, width=10, height=2)
+        stop_button.pack(pady=10)
+
+        self.streaming = True  # Start streaming
+        self.live_view = LiveView(self, self.video_label, status_label)
+        self.live_view.start()  # Capture and convert frames in the background
+        self.root.mainloop()  # Start Tkinter event loop
+
+    def stop_stream(self):
+        """Stop the live stream and close the Tkinter window."""
+        self.streaming = False
+        if self.live_view is not None:
+            self.live_view.stop()
+            self.live_view = None
+        self.stop_continuous()
+        if self.root:
+            self.root.destroy()
+            self.root = None  # Reset the reference
+
+    def _display_frame(self, frame):
+        """Scale a raw frame to an 8-bit RGB array for display (auto-contrast instead of wrapping)."""
+        import cv2
+        from controllers.liveview import to_display
+
+        image = to_display(frame)
+
+        # Convert grayscale to BGR
+        if len(image.shape) == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        return image
@@ -0,0 +1,221 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from controllers import timing
+
+
+def connect(study_db, synchronous='NORMAL', timeout=30):
+    """
+    Open a study database in WAL mode.
+
+    WAL lets several acquisitions and readers share the same .db file without blocking each other, and with
+    synchronous=NORMAL commits no longer wait on an fsync (the database stays consistent, only the last commits can be
+    lost on power failure until the next checkpoint).
+    """
+    conn = sqlite3.connect(study_db, timeout=timeout)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={synchronous}')
+    return conn
+
+
+class DatabaseWriter(threading.Thread):
+    """
+    Group-commit writer for a study database running on its own thread.
+
+    Rows queued with insert()/insert_many() are batched per statement, written with executemany and committed once
+    batch_size rows are pending or interval seconds have passed since the first pending row. execute() runs single
+    statements (DDL, metadata inserts) in order with the rows and returns their lastrowid. flush() and close() block
+    until everything queued so far is committed; close() also checkpoints the WAL so the data is durable on disk.
+
+    Every flush is one transaction. The rows of each insert()/insert_many() call go in with one executemany under a
+    savepoint; if that fails (e.g. a constraint violation) the call's rows are retried one at a time, so only the rows
+    that fail are reported and counted in rows_failed, without losing the rest or stopping the writer. If the thread
+    does die (e.g. the database cannot be opened), every later call raises its error.
+    """
+
+    def __init__(self, study_db, batch_size=500, interval=0.25, maxsize=100_000, synchronous='NORMAL'):
+        super().__init__(daemon=True)
+        self.study_db = study_db
+        self.batch_size = batch_size
+        self.interval = interval
+        self.synchronous = synchronous
+        self.queue = queue.Queue(maxsize=maxsize)
+
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.commits = 0
+        self.error = None
+
+        self._pending = []  # (SQL, list of parameter tuples) per insert call, in call order
+        self._n_pending = 0
+        self._first_pending = None
+        self._closed = False
+
+    def __enter__(self):
+        if not self.is_alive():
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def insert(self, sql, params):
+        """Queue a single row for a batched insert."""
+        self._put(('rows', sql, [params]))
+
+    def insert_many(self, sql, rows):
+        """Queue several rows for a batched insert."""
+        rows = list(rows)
+        if rows:
+            self._put(('rows', sql, rows))
+
+    def execute(self, sql, params=(), wait=True):
+        """Run a single statement on the writer thread, after everything queued before it, and return its lastrowid."""
+        future = Future()
+        self._put(('execute', (sql, params), future))
+        return self._result(future) if wait else future
+
+    def flush(self):
+        """Block until every row queued so far has been committed."""
+        future = Future()
+        self._put(('flush', None, future))
+        self._result(future)
+
+    def close(self):
+        """Commit everything, checkpoint the WAL and stop the writer thread."""
+        if self._closed:
+            return
+        if self.is_alive():
+            future = Future()
+            self._put(('close', None, future))
+            self._closed = True
+            self._result(future)
+            self.join()
+        self._closed = True
+        if self.error is not None:
+            raise self.error
+
+    def _put(self, item):
+        if self._closed:
+            raise RuntimeError('Database writer is closed.')
+        if self.error is not None:
+            raise self.error
+        self.queue.put(item)
+
+    def _result(self, future):
+        # Poll so a writer thread that died before answering cannot hang the caller
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeout:
+                if not self.is_alive():
+                    raise self.error or RuntimeError('Database writer stopped unexpectedly.')
+
+    def run(self):
+        conn = None
+        try:
+            conn = connect(self.study_db, synchronous=self.synchronous)
+            cursor = conn.cursor()
+            while True:
+                item = self._next_item()
+                if item is None:
+                    # Batch interval elapsed without new work
+                    self._write(conn, cursor)
+                    continue
+
+                kind, payload, target = item
+                if kind == 'rows':
+                    self._pending.append((payload, target))
+                    if self._first_pending is None:
+                        self._first_pending = time.monotonic()
+                    self._n_pending += len(target)
+                    if self._n_pending >= self.batch_size:
+                        self._write(conn, cursor)
+                elif kind == 'execute':
+                    # Keep statement order: pending rows go first, then the statement joins the same transaction
+                    self._write(conn, cursor, commit=False)
+                    try:
+                        cursor.execute(*payload)
+                        target.set_result(cursor.lastrowid)
+                    except Exception as e:
+                        target.set_exception(e)
+                    if self._first_pending is None:
+                        self._first_pending = time.monotonic()
+                elif kind == 'flush':
+                    self._write(conn, cursor)
+                    target.set_result(None)
+                elif kind == 'close':
+                    self._write(conn, cursor)
+                    conn.execute('PRAGMA wal_checkpoint(FULL)')
+                    target.set_result(None)
+                    break
+        except Exception as e:
+            self.error = e
+            self._fail_waiting(e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _next_item(self):
+        if self._first_pending is None:
+            return self.queue.get()
+        remaining = self._first_pending + self.interval - time.monotonic()
+        if remaining <= 0:
+            return None
+        try:
+            return self.queue.get(timeout=remaining)
+        except queue.Empty:
+            return None
+
+    def _write(self, conn, cursor, commit=True):
+        if self._pending:
+            start = timing.start()
+            if not conn.in_transaction:
+                cursor.execute('BEGIN')  # Without it each savepoint release would commit on its own
+            for sql, rows in self._pending:
+                self._insert(cursor, sql, rows)
+            timing.stop('db.insert', start)
+        self._pending.clear()
+        self._n_pending = 0
+        if commit:
+            if conn.in_transaction:
+                start = timing.start()
+                conn.commit()
+                timing.stop('db.commit', start)
+                self.commits += 1
+            self._first_pending = None
+
+    def _insert(self, cursor, sql, rows):
+        cursor.execute('SAVEPOINT pending_rows')
+        try:
+            cursor.executemany(sql, rows)
+            self.rows_written += len(rows)
+        except sqlite3.Error:
+            # Undo the partial executemany and retry row by row, so only the rows that fail are lost
+            cursor.execute('ROLLBACK TO pending_rows')
+            errors = []
+            for params in rows:
+                try:
+                    cursor.execute(sql, params)
+                except sqlite3.Error as e:
+                    errors.append(e)
+                else:
+                    self.rows_written += 1
+            self.rows_failed += len(errors)
+            if errors:
+                print(f'Database writer discarded {len(errors)} of {len(rows)} rows that failed to insert:\n'
+                      f'{errors[0]}\n{sql.strip()}')
+        finally:
+            cursor.execute('RELEASE pending_rows')
+
+    def _fail_waiting(self, error):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item[2], Future) and not item[2].done():
+                item[2].set_exception(error)
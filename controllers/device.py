@@ -1,257 +1,266 @@
 import time
 
-import numpy as np
 import serial
-from PIL import Image, ImageTk
-import tkinter as tk
-from hamamatsu.dcam import dcam, Stream, copy_frame
-import cv2
 
+from controllers import timing
+from controllers.parsing import DOFramer
 
-class Device(serial.Serial):
-    def __init__(self, port=None, encoding='utf-8', **kwargs):
-        super().__init__(port, **kwargs)
-        self.encoding = encoding
-
-    def read(self, size=1):
-        out = super().read(size)
-        return out.decode(self.encoding, errors='ignore')
-
-    def write(self, command):
-        # Send to the device
-        return super().write(command.encode(self.encoding))
 
-    def read_until(self, expected=serial.CR, size=None):
-        line = super().read_until(expected=expected, size=size)
-        return line.decode(self.encoding).strip()
+class DOProbe:
+    """
+    Reads the dissolved oxygen probe's ';'-delimited output into DORecords.
 
+    port is a serial port name, any pyserial URL (e.g. 'socket://localhost:7777' for a simulated probe) or an already
+    open serial-like object.
+    """
 
-class DOProbe(Device):
     def __init__(self, port):
-        super().__init__(port=port,
-                         baudrate=115200,
-                         bytesize=serial.EIGHTBITS,
-                         parity=serial.PARITY_NONE,
-                         stopbits=serial.STOPBITS_ONE,
-                         xonxoff=False,
-                         rtscts=False,
-                         dsrdtr=False)
-
-        # Set controls for manual management
-        self.dtr = True
-        self.rts = True
-        self.bytesize = serial.EIGHTBITS
+        if isinstance(port, str):
+            port = serial.serial_for_url(port,
+                                         baudrate=115200,
+                                         bytesize=serial.EIGHTBITS,
+                                         parity=serial.PARITY_NONE,
+                                         stopbits=serial.STOPBITS_ONE,
+                                         xonxoff=False,
+                                         rtscts=False,
+                                         dsrdtr=False)
+
+            # Set controls for manual management
+            port.dtr = True
+            port.rts = True
+        self.port = port
+        # Local serial ports count their buffered bytes exactly; network ports (socket://, rfc2217://) report at
+        # most one byte
+        self._exact_in_waiting = isinstance(port, serial.Serial)
+
+        # Keeps partial lines between reads
+        self.framer = DOFramer()
+        self.clock = time.time  # Timestamps the records; a synchronized run swaps in its shared clock
+        self.chunk_size = 65536  # Most bytes taken from the port per read
 
-    def read(self, bytes_to_read='all'):
-        if bytes_to_read == 'all':
-            bytes_to_read = self.in_waiting
-        out = super().read(bytes_to_read)
+    @property
+    def timeout(self):
+        return self.port.timeout
 
-        out_lines = out.splitlines()
-        out_split = [line.split(';') for line in out_lines]
-        data = []
-        for out in out_split:
-            data.append([d for d in out if d])
+    @timeout.setter
+    def timeout(self, timeout):
+        self.port.timeout = timeout
 
-        return data
+    @property
+    def in_waiting(self):
+        return self.port.in_waiting
 
+    def close(self):
+        self.port.close()
 
-class LCTF(Device):
-    def __init__(self, port):
-        super().__init__(port=port,
-                         baudrate=115200,
-                         timeout=1,
-                         parity=serial.PARITY_NONE,
-                         bytesize=serial.EIGHTBITS,
-                         stopbits=serial.STOPBITS_ONE
-                         )
-
-        # Configure CR line terminator
+    def read(self, bytes_to_read='all'):
+        """Read from the port and return a DORecord for every complete line received so far."""
+        start = timing.start()
+        if bytes_to_read != 'all':
+            out = self.port.read(bytes_to_read)
+        else:
+            # Wait for at least one byte (bounded by the port timeout) so callers can block instead of polling
+            out = self.port.read(max(self.port.in_waiting, 1))
+            if out and self._exact_in_waiting:
+                # Then take everything else that has arrived. Reading exactly in_waiting bytes never waits, so the
+                # timeout is left alone (on a local port every change reprograms the device)
+                out += self.port.read(min(self.port.in_waiting, self.chunk_size))
+            elif out:
+                # A network port's in_waiting is not enough, but its timeout is a plain attribute, so it is cheap to
+                # read the rest without waiting
+                timeout = self.port.timeout
+                self.port.timeout = 0
+                out += self.port.read(self.chunk_size)
+                self.port.timeout = timeout
+        if not out:
+            return []
+        timing.stop('do.serial_read', start)  # Includes waiting for the first byte
+
+        start = timing.start()
+        records = self.framer.feed(out, self.clock())
+        timing.stop('do.parse', start)
+        return records
+
+
+class CommandLatency:
+    """Running round-trip statistics (seconds) for one LCTF command."""
+    __slots__ = ('count', 'total', 'last', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        self.max = max(self.max, seconds)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def __repr__(self):
+        return (f'CommandLatency(count={self.count}, mean={self.mean * 1e3:.1f} ms, last={self.last * 1e3:.1f} ms, '
+                f'max={self.max * 1e3:.1f} ms)')
+
+
+class LCTF:
+    """
+    Event-driven driver for the VariSpec liquid crystal tunable filter.
+
+    Commands are CR-terminated and every response line is read as soon as it arrives, bounded by a deadline instead
+    of fixed sleeps. Commands that do not depend on each other are written back to back and their responses
+    collected afterwards (see pipeline()). The round trip of every command keyword is kept in self.latency.
+
+    port is a serial port name, any pyserial URL (e.g. 'loop://') or an already open serial-like object, so the
+    protocol can be exercised without the filter attached. The port's own timeout is set once to poll: a read returns
+    as soon as a byte arrives, so poll only bounds how long a wait can overrun its deadline when nothing does.
+    """
+
+    def __init__(self, port, timeout=1, encoding='utf-8', wake=True, poll=0.05):
+        if isinstance(port, str):
+            port = serial.serial_for_url(port,
+                                         baudrate=115200,
+                                         timeout=poll,
+                                         parity=serial.PARITY_NONE,
+                                         bytesize=serial.EIGHTBITS,
+                                         stopbits=serial.STOPBITS_ONE
+                                         )
+        self.port = port
+        self.port.timeout = poll  # Set once: changing it on a local port reprograms the device every time
+        self.timeout = timeout  # Default deadline (s) for a response
+        self.encoding = encoding
         self.expected = serial.CR  # Line terminator
 
+        self.latency = {}  # Command keyword -> CommandLatency
+        self._wavelength = None
+        self._received = bytearray()  # Bytes read past the last complete line
+
         # Wake up the LCTF
-        self.wake()
+        if wake:
+            self.wake()
 
-    def write(self, command):
-        super().write(command)
-        super().read()  # Clear the written command form the buffer
+    def close(self):
+        self.port.close()
 
-    def read(self):
-        return super().read_until(self.expected, size=None)
+    def write(self, command):
+        self.port.write((command + '\r').encode(self.encoding))
+
+    def readline(self, deadline):
+        """Return the next response line, or None once time.monotonic() passes deadline."""
+        while True:
+            end = self._received.find(self.expected)
+            if end >= 0:
+                line = bytes(self._received[:end])
+                del self._received[:end + 1]
+                return line.decode(self.encoding, errors='ignore').strip()
+
+            if time.monotonic() >= deadline:
+                return None
+            # Block for the first byte (up to poll), then take whatever else has arrived
+            self._received += self.port.read(max(self.port.in_waiting, 1))
+
+    def expect(self, response, deadline=None):
+        """Read lines until one equals response. Raises ValueError on an error reply or when the deadline passes."""
+        deadline = time.monotonic() + self.timeout if deadline is None else deadline
+        while True:
+            line = self.readline(deadline)
+            if line is None:
+                raise ValueError(f'Failed to validate LCTF Status. No response {response!r} before the deadline.')
+            if '*' in line:
+                raise ValueError('Filter failed/cannot execute command. Parameter out of boounds or filter is asleep.')
+            if line == response:
+                return line
+
+    def command(self, command, response=None, timeout=None):
+        """Send a command and wait for its response (by default the echoed command)."""
+        return self.pipeline([(command, response)], timeout)[0]
+
+    def pipeline(self, commands, timeout=None):
+        """
+        Send independent (command, response) pairs back to back, then collect their responses in order.
+
+        A response of None waits for the echoed command. The deadline applies to the whole batch and each command's
+        latency is measured from the moment the batch was written.
+        """
+        start = time.monotonic()
+        deadline = start + (self.timeout if timeout is None else timeout)
+        for command, _ in commands:
+            self.write(command)
+
+        responses = []
+        try:
+            for command, response in commands:
+                responses.append(self.expect(command if response is None else response, deadline))
+                self._record(command, time.monotonic() - start)
+        except ValueError:
+            # The rest of the batch's replies would be taken as answers to the next command, so drop them
+            self._received.clear()
+            self.port.reset_input_buffer()
+            raise
+        return responses
+
+    def query(self, quest, timeout=None):
+        """Ask for a setting ('W', 'A', ...) and return the filter's answer."""
+        start = time.monotonic()
+        deadline = start + (self.timeout if timeout is None else timeout)
+        question = quest + ' ?'
+        self.write(question)
+        self.expect(question, deadline)  # The answer follows the echo of the question
+        line = self.readline(deadline)
+        if line is None:
+            raise ValueError(f'Failed to validate LCTF Status. No answer to {question!r}.')
+        if '*' in line:
+            raise ValueError('Filter failed/cannot execute command. Parameter out of boounds or filter is asleep.')
+        self._record(question, time.monotonic() - start)
+        return line
+
+    def check_status(self, check_status, timeout=None):
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        return self.expect(check_status, deadline)
 
     def wake(self):
-        # Wake up LCTF
-        self.write('A')  # Send wakeup command
-        time.sleep(0.1)
-
-        # Enusre it is awake
-        self.query('A')  # Query wake status
-        self.check_status('a     0')
-        self.write('R 1')  # Reset LED and clear errors
+        self._wavelength = None  # Waking may reset the filter, so its wavelength has to be asked again
+        # Wake up LCTF and ensure it is awake: the wake command and status query are answered in order
+        self.pipeline([('A', None), ('A ?', 'a     0')])
+        # Reset the LED and clear errors. Its echo is not waited for (the original driver never checked it); the next
+        # command's expect() skips it
+        self.write('R 1')
 
-    def query(self, quest):
-        self.write(quest + ' ?')
-        time.sleep(0.1)
-        return self.read()
+    @property
+    def known_wavelength(self):
+        """The wavelength the filter was last tuned to or reported, without asking it; None if unknown."""
+        return self._wavelength
 
     @property
     def wavelength(self):
         if self._wavelength is None:
-            self._wavelength = self.query('W')
+            answer = self.query('W')
+            try:
+                self._wavelength = float(answer.split()[-1])
+            except ValueError:
+                return answer
         return self._wavelength
 
     @wavelength.setter
     def wavelength(self, wavelength):
-        command = f'W {wavelength}.000'
-        self.write(command)
-
-        self.query('W')
-        self.check_status(command)
+        # Set and read back in one batch; the read back only arrives once the filter has tuned
+        command = f'W {float(wavelength):.3f}'
+        self._wavelength = None  # Unknown until the tune is confirmed
+        self.pipeline([(command, None), ('W ?', command)])
         self._wavelength = wavelength
 
-    def check_status(self, check_status):
-        try_count = 0
-        status = None
-        while status != f'{check_status}':
-            status = self.read()
-
-            try_count += 1
-            if try_count > 10:
-                break
-
-            if '*' in status:
-                raise ValueError('Filter failed/cannot execute command. Parameter out of boounds or filter is asleep.')
-
-        if status != f'{check_status}':
-            raise ValueError('Failed to validate LCTF Status. No/unexpected response.')
-
-
-class CMOS:
-    def __init__(self, camera_index=0):
-        # Instantiate DCAM and enter context
-        self.dcam = dcam
-        self.dcam.__enter__()
-        self.camera = self.dcam[camera_index]
-        self.camera.__enter__()
-
-        self.streaming = False
-        self.root = None
-
-    def __del__(self):
-        self.camera.__exit__(None, None, None)
-        self.dcam.__exit__(None, None, None)
-
-    # TODO: Add a getitem method to self.camera so that dict calls automatically open the context and all attributes of
-    #  the camera class will be accessible through cmos (like exposure time and binning currently are)
-
-    @property
-    def exposure_time(self):
-        with self.camera as camera:
-            return camera["exposure_time"].value
-
-    @exposure_time.setter
-    def exposure_time(self, exposure_time):
-        with self.camera as camera:
-            camera["exposure_time"] = exposure_time
-
-    @property
-    def binning(self):
-        with self.camera as camera:
-            return camera["binning"].value
-
-    @binning.setter
-    def binning(self, binning):
-        with self.camera as camera:
-            camera["binning"] = binning
-
-
-    def capture(self, nb_frames=1):
-        with Stream(self.camera, nb_frames) as stream:
-            self.camera.start()
-            frames = []
-            try:
-                for i, frame_buffer in enumerate(stream):
-                    frame = copy_frame(frame_buffer)
-                    frames.append(frame)
-            finally:
-                self.camera.stop()
-        if nb_frames == 1:
-            return frames[0]
-        return frames
-
-    def stream(self):
-        while self.streaming:
-            try:
-                yield self.capture(1)
-            except Exception as e:
-                print(f"Error during streaming: {e}")
-                self.streaming = False
-            finally:
-                self.camera.stop()
-
-    def view(self, live=True):
-        if not live:
-            frame = self.capture(nb_frames=1)
-            frame = self._display_frame(frame)
-            cv2.imshow("CMOS View", np.array(frame))
-            cv2.waitKey(0)
-            cv2.destroyAllWindows()
-            return
-
-        # Initialize Tkinter window
-        self.root = tk.Toplevel()  # Use Toplevel() so this can be called from other GUIs
-        self.root.title("CMOS Camera Stream")
-        self.root.geometry('800x800')
-
-        container = tk.Frame(self.root)
-        container.pack(pady=10)
-
-        # Create a label to display the camera feed
-        self.video_label = tk.Label(container, width=640, height=640)
-        self.video_label.pack()
-
-        # OK Button to stop streaming
-        stop_button = tk.Button(self.root, text="OK", command=self.stop_stream, width=10, height=2)
-        stop_button.pack(pady=10)
-
-        self.streaming = True  # Start streaming
-        self.update_frame()  # Start updating frames
-        self.root.mainloop()  # Start Tkinter event loop
-
-    cv2.destroyAllWindows()
-
-    def update_frame(self):
-        """Capture a frame from the camera and update the Tkinter label."""
-        if self.streaming:
-            try:
-                frame = next(self.stream())  # Get the next frame
-                frame = self._display_frame(frame)  # Convert for display
-
-                # Update Tkinter label with new frame
-                self.video_label.configure(image=frame)
-                self.video_label.image = frame  # Keep reference
-
-            except ValueError as e:
-                print(f"Error during streaming: {e}")
-
-            # Schedule the next frame update
-            self.root.after(10, self.update_frame)
-
-    def stop_stream(self):
-        """Stop the live stream and close the Tkinter window."""
-        self.streaming = False
-        self.camera.stop()
-        if self.root:
-            self.root.destroy()
-            self.root = None  # Reset the reference
-
-    def _display_frame(self, frame):
-        image = np.array(frame, dtype=np.uint8)
-
-        # Convert grayscale to BGR
-        if len(image.shape) == 2:
-            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-
-        # Convert to PIL image and then to Tkinter-compatible format
-        image = Image.fromarray(image)
-        return ImageTk.PhotoImage(image)
\ No newline at end of file
+    def latency_summary(self):
+        return '\n'.join(f'{command:>12} {stats}' for command, stats in self.latency.items())
+
+    def _record(self, command, seconds):
+        keyword = command.split()[0]
+        if command.endswith('?'):
+            keyword += ' ?'
+        if keyword not in self.latency:
+            self.latency[keyword] = CommandLatency()
+        self.latency[keyword].add(seconds)
+        timing.add(f'lctf.{keyword}', seconds)  # 'lctf.W ?' is the settle time of a tune
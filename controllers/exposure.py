@@ -0,0 +1,139 @@
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+import numpy as np
+
+from controllers.schema import migrate
+
+
+def signal_level(frame, percentile=99.0, stride=2):
+    """Signal level of a frame: the given percentile of a subsampled copy, so a few hot pixels do not dominate."""
+    return float(np.percentile(frame[::stride, ::stride], percentile))
+
+
+class AutoExposure:
+    """
+    Finds the exposure that brings each band to a target signal level.
+
+    Each test frame is reduced to one number, the percentile-th percentile of its counts. Counts above the camera
+    offset grow linearly with exposure, so each iteration rescales the exposure by that ratio and the search usually
+    converges in two or three frames; saturated frames (whose true level is unknown) cut the exposure by
+    saturation_step instead. Test frames can be taken with a smaller ROI or more binning through test_config, which
+    is applied for the search and restored afterwards.
+    """
+
+    def __init__(self, cmos, target=0.6, percentile=99.0, tolerance=0.1, max_iterations=6, offset=100,
+                 min_exposure=1e-4, max_exposure=2.0, saturation_step=4, test_config=None):
+        self.cmos = cmos
+        self.target = target  # Fraction of full scale the percentile should reach
+        self.percentile = percentile
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.offset = offset  # Camera counts with no light
+        self.min_exposure = min_exposure
+        self.max_exposure = max_exposure
+        self.saturation_step = saturation_step
+        self.test_config = test_config
+        self.levels = {}  # Wavelength -> fraction of full scale reached with the chosen exposure
+        self.full_scale = np.iinfo(np.uint16).max
+
+    def measure(self, exposure):
+        """Snap a test frame and return its signal level as a fraction of full scale."""
+        self.cmos.exposure_time = exposure
+        frame = self.cmos.snap()
+        if frame.dtype.kind in 'ui':
+            self.full_scale = np.iinfo(frame.dtype).max
+        return signal_level(frame, self.percentile) / self.full_scale
+
+    def find(self, exposure):
+        """Iterate from a starting exposure until the signal level is within tolerance. Returns (exposure, level)."""
+        exposure = float(np.clip(exposure, self.min_exposure, self.max_exposure))
+        level = None
+        for _ in range(self.max_iterations):
+            level = self.measure(exposure)
+            offset = self.offset / self.full_scale
+            if abs(level - self.target) <= self.tolerance * self.target:
+                break
+            if level >= 0.98:
+                scale = 1 / self.saturation_step
+            else:
+                # Counts above the offset are proportional to exposure; limit each step in case of a near-dark frame
+                scale = np.clip((self.target - offset) / max(level - offset, 1e-6), 1 / 8, 8)
+            new_exposure = float(np.clip(exposure * scale, self.min_exposure, self.max_exposure))
+            if new_exposure == exposure:
+                break  # Pinned at a limit
+            exposure = new_exposure
+        return exposure, level
+
+    def run(self, lctf, wavelengths, start=None, default=0.05):
+        """
+        Find the exposure of every wavelength and return {wavelength: exposure}.
+
+        start is a {wavelength: exposure} table to begin from (e.g. load_exposure_table()); wavelengths missing from
+        it begin from the nearest band already found. Bands are searched in wavelength order so the filter moves
+        little and neighbouring bands give good starting points.
+        """
+        start = dict(start or {})
+        restore = None
+        if self.test_config:
+            restore = {name: self.cmos[name] for name in self.test_config if name != 'roi'}
+            self.cmos.configure(self.test_config)
+
+        exposures = {}
+        try:
+            for wavelength in sorted(wavelengths):
+                if wavelength in start:
+                    first = start[wavelength]
+                elif exposures or start:
+                    known = {**start, **exposures}
+                    first = known[min(known, key=lambda lam: abs(lam - wavelength))]
+                else:
+                    first = default
+                lctf.wavelength = wavelength
+                exposures[wavelength], self.levels[wavelength] = self.find(first)
+        finally:
+            if restore is not None:
+                if 'roi' in self.test_config:
+                    self.cmos['subarray_mode'] = 'OFF'
+                self.cmos.configure(restore)
+        return exposures
+
+
+def load_exposure_table(study_db, sample_type, binning, read_only=False):
+    """
+    The saved {wavelength: exposure} table for a sample type and binning (empty if none was saved).
+
+    With read_only the database is neither created nor upgraded (e.g. for a dry run): it is opened read-only and a
+    missing file or exposure table just gives an empty table.
+    """
+    if read_only:
+        try:
+            conn = sqlite3.connect(f'file:{pathname2url(os.path.abspath(study_db))}?mode=ro', uri=True)
+        except sqlite3.OperationalError:
+            return {}
+    else:
+        migrate(study_db)
+        conn = sqlite3.connect(study_db)
+    try:
+        rows = conn.execute('''
+            SELECT wavelength, exposure_time FROM exposure_table WHERE sample_type = ? AND binning = ?
+        ''', (sample_type, int(binning))).fetchall()
+    except sqlite3.OperationalError:
+        if not read_only:
+            raise
+        rows = []  # Read-only and not migrated yet, so there is no exposure table
+    finally:
+        conn.close()
+    return dict(rows)
+
+
+def save_exposure_table(writer, sample_type, binning, exposures, levels=None):
+    """Queue an upsert of a {wavelength: exposure} table (and optional signal levels) on a DatabaseWriter."""
+    levels = levels or {}
+    writer.insert_many('''
+        INSERT INTO exposure_table (sample_type, binning, wavelength, exposure_time, signal_level)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(sample_type, binning, wavelength) DO UPDATE SET
+        exposure_time = excluded.exposure_time, signal_level = excluded.signal_level, updated = CURRENT_TIMESTAMP
+    ''', [(sample_type, int(binning), float(lam), float(tau), levels.get(lam)) for lam, tau in exposures.items()])
@@ -0,0 +1,183 @@
+import threading
+import time
+
+import numpy as np
+
+
+class FrameRing:
+    """
+    Preallocated ring of camera frames filled by a continuous acquisition.
+
+    The acquisition thread copies each frame straight into the next free slot (reserve/commit) so no array is
+    allocated per frame. Frames are numbered from 0 in capture order. Consumers can copy a frame out with get(), or
+    borrow a zero-copy view with view() and give it back with release(); the writer skips borrowed slots until they
+    are released. dropped counts frames lost before they reached the ring (camera buffer overrun, or every slot
+    borrowed), overwritten counts frames a consumer asked for after the ring had already wrapped past them.
+    """
+
+    def __init__(self, size=32):
+        self.size = size
+        self.frames = None
+        self.timestamps = np.zeros(size)  # time.monotonic() when each slot was filled
+        self.indices = np.full(size, -1, dtype=np.int64)  # Frame number held by each slot
+        self.count = 0  # Frames committed so far
+        self.dropped = 0
+        self.overwritten = 0
+
+        self._held = {}  # Slot -> number of outstanding views
+        self._write_slot = 0
+        self._next_slot = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    @property
+    def newest(self):
+        """Index of the most recent frame, or -1 if nothing was captured yet."""
+        return self.count - 1
+
+    def reserve(self, shape, dtype):
+        """Return the slot array the next frame should be written into, or None if every slot is borrowed."""
+        with self._cond:
+            if self.frames is None or self.frames.shape[1:] != tuple(shape) or self.frames.dtype != dtype:
+                if self._held:
+                    raise RuntimeError('Cannot change the frame format while views are held.')
+                self.frames = np.empty((self.size,) + tuple(shape), dtype=dtype)
+                self.indices[:] = -1
+
+            for offset in range(self.size):
+                slot = (self._next_slot + offset) % self.size
+                if slot not in self._held:
+                    self._write_slot = slot
+                    # The old frame is gone as soon as the copy starts, so readers must not find it any more
+                    self.indices[slot] = -1
+                    return self.frames[slot]
+            self.dropped += 1
+        return None
+
+    def add_dropped(self, count):
+        """Count frames lost before they reached the ring (e.g. a camera buffer overrun)."""
+        if count:
+            with self._cond:
+                self.dropped += count
+
+    def commit(self, timestamp=None):
+        """Publish the frame written into the slot returned by reserve(); until then it cannot be read."""
+        with self._cond:
+            slot = self._write_slot
+            self.timestamps[slot] = time.monotonic() if timestamp is None else timestamp
+            self.indices[slot] = self.count
+            self.count += 1
+            self._next_slot = (slot + 1) % self.size
+            self._cond.notify_all()
+
+    def wait(self, index, timeout=None):
+        """Block until frame index has been captured. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.count > index, timeout)
+
+    def _slot(self, index):
+        if index < 0 or index >= self.count:
+            raise IndexError(f'Frame {index} has not been captured.')
+        slots = np.flatnonzero(self.indices == index)
+        if not slots.size:
+            self.overwritten += 1
+            raise IndexError(f'Frame {index} was already overwritten.')
+        return int(slots[0])
+
+    def timestamp(self, index=None):
+        """time.monotonic() at which frame index (default: the newest) was committed."""
+        with self._cond:
+            index = self.newest if index is None else index
+            return self.timestamps[self._slot(index)]
+
+    def get(self, index=None, out=None):
+        """Copy frame index (default: the newest) into out, or a new array, and return it."""
+        with self._cond:
+            index = self.newest if index is None else index
+            frame = self.frames[self._slot(index)]
+            if out is None:
+                return frame.copy()
+            np.copyto(out, frame)
+            return out
+
+    def view(self, index=None):
+        """Borrow a zero-copy view of frame index (default: the newest). Returns (view, index); see release()."""
+        with self._cond:
+            index = self.newest if index is None else index
+            slot = self._slot(index)
+            self._held[slot] = self._held.get(slot, 0) + 1
+            return self.frames[slot], index
+
+    def release(self, index):
+        """Give back a view borrowed with view()."""
+        with self._cond:
+            slot = self._slot(index)
+            if self._held.get(slot, 0) <= 1:
+                self._held.pop(slot, None)
+            else:
+                self._held[slot] -= 1
+
+
+class FrameAccumulator:
+    """
+    Per-pixel mean (and optionally variance) of frames added one at a time, without keeping the frames.
+
+    Unsigned integer frames are summed exactly into a uint32 accumulator (switching to float64 only before it could
+    overflow), other frames into float32. With variance, Welford's update keeps a float32 running mean and sum of
+    squared deviations instead, which does not lose precision the way a sum of squares does. Every array is allocated
+    on the first add(); later frames are added in place with no temporaries.
+    """
+
+    def __init__(self, variance=False):
+        self.track_variance = variance
+        self.count = 0
+        self._sum = None
+        self._limit = None  # Frames the uint32 sum can hold without overflowing
+        self._mean = self._m2 = self._delta = self._step = None
+
+    def add(self, frame):
+        if self.count == 0:
+            self._allocate(frame)
+        self.count += 1
+        if not self.track_variance:
+            if self.count == self._limit:
+                self._sum = self._sum.astype(np.float64)
+            np.add(self._sum, frame, out=self._sum)
+            return
+
+        # mean += (x - mean) / n; m2 += (x - old mean) * (x - new mean)
+        np.subtract(frame, self._mean, out=self._delta)
+        np.multiply(self._delta, 1 / self.count, out=self._step)
+        self._mean += self._step
+        np.subtract(frame, self._mean, out=self._step)
+        self._delta *= self._step
+        self._m2 += self._delta
+
+    @property
+    def mean(self):
+        """float32 mean of the frames added so far."""
+        if self.count == 0:
+            raise ValueError('No frames were added.')
+        if self.track_variance:
+            return self._mean.copy()
+        return np.divide(self._sum, self.count, dtype=np.float32)
+
+    @property
+    def variance(self):
+        """float32 per-pixel sample variance (zero for a single frame); needs variance=True."""
+        if not self.track_variance:
+            raise ValueError('Variance was not tracked; create the accumulator with variance=True.')
+        if self.count == 0:
+            raise ValueError('No frames were added.')
+        return self._m2 / max(self.count - 1, 1)
+
+    def _allocate(self, frame):
+        if self.track_variance:
+            self._mean, self._m2, self._delta, self._step = (np.zeros(frame.shape, dtype=np.float32) for _ in range(4))
+        elif np.issubdtype(frame.dtype, np.unsignedinteger) and frame.dtype.itemsize <= 2:
+            self._sum = np.zeros(frame.shape, dtype=np.uint32)
+            self._limit = np.iinfo(np.uint32).max // np.iinfo(frame.dtype).max + 1
+        else:
+            self._sum = np.zeros(frame.shape, dtype=np.float32)
@@ -0,0 +1,101 @@
+import numpy as np
+
+from controllers.oxygen import DEFAULT_MODEL
+from controllers.schema import ROLLUP_RESOLUTIONS, ROLLUP_COLUMNS
+
+
+def lttb(x, y, n_out):
+    """
+    Indices of n_out points that keep the visual shape of (x, y), by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. Every other bucket contributes the point forming the largest
+    triangle with the point kept from the previous bucket and the mean of the next bucket.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)  # n_out - 2 buckets between the first and last point
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    for k in range(n_out - 2):
+        start, stop = edges[k], max(edges[k + 1], edges[k] + 1)
+        if k + 2 < len(edges):
+            next_x, next_y = x[edges[k + 1]:edges[k + 2]].mean(), y[edges[k + 1]:edges[k + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        a = keep[k]
+        # Twice the triangle areas for every candidate in the bucket at once
+        areas = np.abs((x[a] - next_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (next_y - y[a]))
+        keep[k + 1] = start + int(np.argmax(areas))
+    return keep
+
+
+def decimate(t, columns, width):
+    """Thin (t, *columns) to about width points with LTTB on the first column; returns them unchanged if they fit."""
+    keep = lttb(t, columns[0], width)
+    return (np.asarray(t)[keep],) + tuple(np.asarray(column)[keep] for column in columns)
+
+
+def load_history(conn, sample_id, width=1000, start=None, end=None, model=None):
+    """
+    DO history of a sample sized for a plot width pixels wide: (resolution, columns).
+
+    Uses the raw readings when they fit, otherwise the finest rollup with at most twice width buckets in the range
+    (resolution is the bucket width in seconds, 0 for raw readings), thinned to width points with LTTB if needed.
+    columns maps 'time' (epoch s) and '<do|temperature|po2|so2>_<min|mean|max>' to arrays; raw readings give the
+    same value for min, mean and max. Only the rollups are scanned to decide, never the raw rows.
+    """
+    model = DEFAULT_MODEL if model is None else model
+    finest = ROLLUP_RESOLUTIONS[0]
+    count, first, last = conn.execute(f'''
+        SELECT sum(n), min(bucket), max(bucket) FROM dissolved_oxygen_rollups
+        WHERE sample_id = ? AND resolution = {finest} AND bucket >= ? AND bucket <= ?
+    ''', _bucket_range(sample_id, finest, start, end)).fetchone()
+
+    if not count or count <= width:
+        rows = conn.execute('''
+            SELECT epoch_time, dissolved_oxygen, temperature FROM dissolved_oxygen_records
+            WHERE sample_id = ? AND epoch_time >= ? AND epoch_time <= ?
+            AND dissolved_oxygen IS NOT NULL AND temperature IS NOT NULL ORDER BY epoch_time
+        ''', (sample_id, -np.inf if start is None else start, np.inf if end is None else end)).fetchall()
+        t, do, T = np.asarray(rows, dtype=float).reshape(-1, 3).T
+        columns = {'time': t}
+        for name, values in (('do', do), ('temperature', T), ('po2', model.po2(do, T))):
+            columns.update({f'{name}_min': values, f'{name}_mean': values, f'{name}_max': values})
+        _add_so2(columns, model)
+        return 0, columns
+
+    span = last + finest - first
+    # A rollup up to twice the width is still worth thinning with LTTB rather than dropping to a coarser one
+    resolution = next((r for r in ROLLUP_RESOLUTIONS if span / r <= 2 * width), ROLLUP_RESOLUTIONS[-1])
+    names = ', '.join(f'{name}_min, {name}_sum / n, {name}_max' for name in ROLLUP_COLUMNS)
+    rows = conn.execute(f'''
+        SELECT bucket + {resolution} / 2.0, {names} FROM dissolved_oxygen_rollups
+        WHERE sample_id = ? AND resolution = {resolution} AND bucket >= ? AND bucket <= ? ORDER BY bucket
+    ''', _bucket_range(sample_id, resolution, start, end)).fetchall()
+    data = np.asarray(rows, dtype=float).reshape(-1, 1 + 3 * len(ROLLUP_COLUMNS))
+    if len(data) > width:
+        po2_mean = 1 + 3 * list(ROLLUP_COLUMNS).index('po2') + 1
+        data = data[lttb(data[:, 0], data[:, po2_mean], width)]  # Keep the shape of the mean pO2
+
+    columns = {'time': data[:, 0]}
+    for k, name in enumerate(ROLLUP_COLUMNS):
+        for j, stat in enumerate(('min', 'mean', 'max')):
+            columns[f'{name}_{stat}'] = data[:, 1 + 3 * k + j]
+    _add_so2(columns, model)
+    return resolution, columns
+
+
+def _bucket_range(sample_id, resolution, start, end):
+    # Buckets are labelled by their start, so include the one the range starts in
+    first = -2 ** 62 if start is None else int(start // resolution) * resolution
+    last = 2 ** 62 if end is None else int(end)
+    return sample_id, first, last
+
+
+def _add_so2(columns, model):
+    # sO2 is monotonic in pO2, so the pO2 extremes give the sO2 extremes ('mean' is the sO2 at the mean pO2)
+    for stat in ('min', 'mean', 'max'):
+        columns[f'so2_{stat}'] = model.so2(columns[f'po2_{stat}'])
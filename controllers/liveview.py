@@ -0,0 +1,187 @@
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageTk
+
+
+def bin_to_fit(frame, size=640, out=None):
+    """
+    Downsample a frame by integer binning so it fits in a size x size label.
+
+    Bins are averaged in one vectorized reduction. Rows and columns that do not fill a whole bin are cropped.
+    """
+    factor = max(1, -(-max(frame.shape[:2]) // size))
+    if factor == 1:
+        return frame
+    h, w = frame.shape[0] // factor, frame.shape[1] // factor
+    blocks = frame[:h * factor, :w * factor].reshape(h, factor, w, factor)
+    binned = blocks.sum(axis=(1, 3), dtype=np.uint32)
+    binned //= factor * factor
+    if out is None:
+        return binned.astype(frame.dtype)
+    np.copyto(out, binned, casting='unsafe')
+    return out
+
+
+class ContrastLUT:
+    """
+    Precomputed auto-contrast lookup table from 16-bit (or any integer) camera counts to 8-bit display values.
+
+    The table maps the [low, high] percentile range of a reference frame linearly onto 0-255, so converting a frame
+    for display is a single table lookup instead of per-frame arithmetic. Values outside the range are clipped
+    rather than wrapped.
+    """
+
+    def __init__(self, bits=16, low=0.5, high=99.5):
+        self.bits = bits
+        self.low = low
+        self.high = high
+        self.lut = (np.arange(2 ** bits, dtype=np.uint32) >> (bits - 8)).astype(np.uint8)
+        self.range = (0, 2 ** bits - 1)
+
+    def update(self, frame, stride=4):
+        """Recompute the table from a (subsampled) reference frame."""
+        sample = frame[::stride, ::stride]
+        lo, hi = np.percentile(sample, (self.low, self.high))
+        hi = max(hi, lo + 1)
+        self.range = (lo, hi)
+        values = np.arange(2 ** self.bits, dtype=np.float32)
+        values -= lo
+        values *= 255 / (hi - lo)
+        np.clip(values, 0, 255, out=values)
+        self.lut = values.astype(np.uint8)
+
+    def apply(self, frame, out=None):
+        """Convert a frame to 8 bits through the table."""
+        return np.take(self.lut, frame, out=out)
+
+
+def to_display(frame, size=640, lut=None):
+    """Convert a raw frame to an 8-bit array that fits the live view label."""
+    binned = bin_to_fit(frame, size)
+    if binned.dtype == np.uint8:
+        return binned
+    if lut is None:
+        lut = ContrastLUT(bits=8 * binned.dtype.itemsize)
+        lut.update(binned)
+    return lut.apply(binned)
+
+
+class LiveView:
+    """
+    Frame-dropping live view of a continuously acquiring CMOS.
+
+    A worker thread takes only the newest frame from the camera's FrameRing, bins it to the label size and converts
+    it to 8 bits through a ContrastLUT that is refreshed every lut_interval seconds. The Tk side polls for the newest
+    converted frame with after() and pastes it into a single PhotoImage in place, so the display never queues up
+    stale frames. The status label shows camera FPS, display FPS and capture-to-display latency, which tells whether
+    focusing is limited by the camera or the UI.
+    """
+
+    def __init__(self, cmos, label, status_label=None, size=640, refresh_ms=15, lut_interval=1.0):
+        self.cmos = cmos
+        self.label = label
+        self.status_label = status_label
+        self.size = size
+        self.refresh_ms = refresh_ms
+        self.lut_interval = lut_interval
+        self.lut = ContrastLUT()
+
+        self.running = False
+        self._worker = None
+        self._photo = None
+
+        # Double-buffered display frames handed from the worker to the Tk thread
+        self._lock = threading.Lock()
+        self._ready = None  # (array, capture time) waiting to be shown
+        self._spare = None
+
+        # Readout statistics
+        self.displayed = 0
+        self.latency = 0.0
+        self._stats_time = time.monotonic()
+        self._stats_frames = (0, 0)
+
+    def start(self):
+        self.running = True
+        self.ring = self.cmos.start_continuous()
+        self._worker = threading.Thread(target=self._process, daemon=True)
+        self._worker.start()
+        self.label.after(self.refresh_ms, self._show)
+
+    def stop(self):
+        self.running = False
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+        self.cmos.stop_continuous()
+
+    def _process(self):
+        raw = None
+        lut_time = 0
+        last = self.ring.newest
+        while self.running:
+            if not self.ring.wait(last + 1, timeout=0.5):
+                continue
+            # Skip straight to the newest frame; anything older is already stale
+            last = self.ring.newest
+            frames = self.ring.frames
+            if raw is None or raw.shape != frames.shape[1:] or raw.dtype != frames.dtype:
+                raw = None
+            try:
+                capture_time = self.ring.timestamp(last)
+                raw = self.ring.get(last, out=raw)
+            except IndexError:
+                continue
+
+            binned = bin_to_fit(raw, self.size)
+            now = time.monotonic()
+            if now - lut_time > self.lut_interval:
+                self.lut.update(binned)
+                lut_time = now
+
+            with self._lock:
+                out = self._spare if self._spare is not None and self._spare.shape == binned.shape else None
+                self._spare = None
+            out = self.lut.apply(binned, out=out)
+            with self._lock:
+                if self._ready is not None:
+                    self._spare = self._ready[0]  # Never shown; recycle its buffer
+                self._ready = (out, capture_time)
+
+    def _show(self):
+        if not self.running:
+            return
+        with self._lock:
+            ready, self._ready = self._ready, None
+
+        if ready is not None:
+            frame, capture_time = ready
+            image = Image.fromarray(frame)
+            if self._photo is None or (self._photo.width(), self._photo.height()) != image.size:
+                self._photo = ImageTk.PhotoImage(image)
+                self.label.configure(image=self._photo)
+                self.label.image = self._photo  # Keep reference
+            else:
+                self._photo.paste(image)  # Update in place
+            self.displayed += 1
+            self.latency = time.monotonic() - capture_time
+            with self._lock:
+                if self._spare is None:
+                    self._spare = frame
+
+        self._update_status()
+        self.label.after(self.refresh_ms, self._show)
+
+    def _update_status(self):
+        now = time.monotonic()
+        elapsed = now - self._stats_time
+        if self.status_label is None or elapsed < 0.5:
+            return
+        captured, displayed = self.ring.count, self.displayed
+        camera_fps = (captured - self._stats_frames[0]) / elapsed
+        display_fps = (displayed - self._stats_frames[1]) / elapsed
+        self._stats_time, self._stats_frames = now, (captured, displayed)
+        self.status_label.configure(text=f'Camera {camera_fps:5.1f} FPS | Display {display_fps:5.1f} FPS | '
+                                         f'Latency {self.latency * 1000:5.0f} ms | Dropped {self.ring.dropped}')
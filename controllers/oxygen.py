@@ -0,0 +1,121 @@
+"""Vectorized conversion of dissolved oxygen probe readings to oxygen partial pressure and hemoglobin saturation."""
+import numpy as np
+
+
+class OxygenModel:
+    """
+    Henry's law and Hill equation constants used to turn DO readings into pO2 and sO2.
+
+    Dissolved oxygen is expected in mg/L and temperature in degrees C. pO2 is returned in mmHg and sO2 in percent.
+    """
+
+    def __init__(self, Hcc=3.2e-2, R=8314, m=31.999, h=2.7, p50=27):
+        self.Hcc = Hcc  # Dimensionless Henry's constant
+        self.R = R  # LPaK-1mol-1
+        self.m = m  # g/mol
+        self.h = h  # Hill coefficient
+        self.p50 = p50  # mmHg
+
+    def __repr__(self):
+        return f'OxygenModel(Hcc={self.Hcc}, R={self.R}, m={self.m}, h={self.h}, p50={self.p50})'
+
+    @property
+    def scale(self):
+        """pO2 (mmHg) per mg/L of dissolved oxygen per kelvin: pO2 = [O2] / kH with kH = Hcc / (R * T)."""
+        return 7.5 * self.R / (1000 * 1000 * self.m * self.Hcc)
+
+    def po2(self, do, T):
+        """Partial pressure of oxygen (mmHg) from dissolved oxygen (mg/L) and temperature (C)."""
+        do = np.asarray(do, dtype=float)
+        T = np.asarray(T, dtype=float)
+        return do * (T + 273.15) * self.scale
+
+    def so2(self, pO2):
+        """Hemoglobin oxygen saturation (%) from pO2 (mmHg) using the Hill equation."""
+        pO2 = np.asarray(pO2, dtype=float)
+        ratio = np.asarray(np.clip(pO2, 0, None) / self.p50)  # Still an array for a scalar, for the in-place power
+        np.power(ratio, self.h, out=ratio)
+        return 100 * ratio / (1 + ratio)
+
+    def convert(self, do, T):
+        """Return (pO2, sO2) arrays for whole columns of dissolved oxygen and temperature readings."""
+        pO2 = self.po2(do, T)
+        return pO2, self.so2(pO2)
+
+    def dissolved_oxygen(self, pO2, T):
+        """Dissolved oxygen (mg/L) expected at a given pO2 (mmHg) and temperature (C)."""
+        pO2 = np.asarray(pO2, dtype=float)
+        T = np.asarray(T, dtype=float)
+        return pO2 / ((T + 273.15) * self.scale)
+
+
+DEFAULT_MODEL = OxygenModel()
+
+
+def to_seconds(times, t0=None):
+    """
+    Convert a column of timestamps to float seconds.
+
+    Accepts epoch floats, datetime64 arrays, or SQLite 'YYYY-MM-DD HH:MM:SS' strings. If t0 is given, it is subtracted
+    so the result is relative to it. t0 uses the same units as the output (epoch seconds).
+    """
+    times = np.asarray(times)
+    if times.dtype.kind in 'iuf':
+        seconds = times.astype(float)
+    else:
+        if times.dtype.kind != 'M':
+            times = times.astype('datetime64[ns]')
+        seconds = times.astype('datetime64[ns]').astype(np.int64) / 1e9
+    if t0 is not None:
+        seconds -= t0
+    return seconds
+
+
+def convert(times, do, T, model=None, sort=True, t0=None):
+    """
+    Return (t, pO2, sO2) for whole columns of readings in one vectorized pass.
+
+    t is in seconds relative to t0, which defaults to the first timestamp. Rows are sorted by time unless sort is
+    False.
+    """
+    model = DEFAULT_MODEL if model is None else model
+    t = to_seconds(times)
+    if t.size and t0 is None:
+        t0 = t[0]
+    if t0 is not None:
+        t -= t0
+    pO2, sO2 = model.convert(do, T)
+
+    if sort and t.size and np.any(t[1:] < t[:-1]):
+        order = np.argsort(t, kind='stable')
+        t, pO2, sO2 = t[order], pO2[order], sO2[order]
+    return t, pO2, sO2
+
+
+def convert_chunks(chunks, model=None, t0=None):
+    """
+    Lazily convert an iterable of (times, do, T) column chunks.
+
+    All chunks share the time origin of the first one, so the output can be concatenated or plotted piecewise. Chunks
+    are expected in time order (e.g. from an ORDER BY time query) and are not re-sorted.
+    """
+    for times, do, T in chunks:
+        t = to_seconds(times)
+        if t0 is None and t.size:
+            t0 = t[0]
+        yield convert(t, do, T, model=model, sort=False, t0=t0)
+
+
+def query_chunks(cursor, query, params=(), chunk_size=100_000):
+    """
+    Run a (time, dissolved_oxygen, temperature) query and yield its result as NumPy column chunks.
+
+    Only chunk_size rows are held as Python objects at a time, so millions of stored readings can be processed.
+    """
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        times, do, T = zip(*rows)
+        yield np.asarray(times), np.asarray(do, dtype=float), np.asarray(T, dtype=float)
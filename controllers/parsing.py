@@ -0,0 +1,101 @@
+class DORecord:
+    """A single parsed dissolved oxygen probe reading."""
+    __slots__ = ('time', 'dissolved_oxygen', 'nanoamperes', 'temperature')
+
+    def __init__(self, time, dissolved_oxygen, nanoamperes, temperature):
+        self.time = time  # Epoch seconds when the line was received
+        self.dissolved_oxygen = dissolved_oxygen  # mg/L
+        self.nanoamperes = nanoamperes  # nA
+        self.temperature = temperature  # C
+
+    def __repr__(self):
+        return (f'DORecord(time={self.time}, dissolved_oxygen={self.dissolved_oxygen}, '
+                f'nanoamperes={self.nanoamperes}, temperature={self.temperature})')
+
+    def __iter__(self):
+        return iter((self.time, self.dissolved_oxygen, self.nanoamperes, self.temperature))
+
+
+class DOFramer:
+    """
+    Incremental framer and parser for the DO probe's ';'-delimited line output.
+
+    Bytes are fed in as they arrive from the port. Complete lines are parsed straight out of a reused bytearray and
+    anything after the last line terminator is kept for the next feed, so a line split across two reads is parsed
+    once it is complete instead of being dropped as two fragments.
+    """
+
+    # Positions of the values among the non-empty ';'-separated fields of a line
+    DISSOLVED_OXYGEN = 8
+    NANOAMPERES = 10
+    TEMPERATURE = 12
+
+    def __init__(self, max_line=1024):
+        self.max_line = max_line  # Longest plausible line; longer unterminated data is discarded
+        self._buffer = bytearray()
+
+        self.parsed = 0  # Lines turned into records
+        self.dropped = 0  # Complete lines that could not be parsed
+        self.resynced = 0  # Times unterminated garbage was discarded to find the next line start
+
+    def reset(self):
+        """Discard buffered bytes and counters, e.g. after reopening the port."""
+        self._buffer.clear()
+        self.parsed = self.dropped = self.resynced = 0
+
+    @property
+    def pending(self):
+        """Number of buffered bytes that do not yet form a complete line."""
+        return len(self._buffer)
+
+    def feed(self, data, time=None):
+        """Add raw bytes from the port and return a list of DORecord for every complete line."""
+        buffer = self._buffer
+        buffer += data
+
+        records = []
+        start = 0
+        end = len(buffer)
+        while start < end:
+            # Lines may be terminated by CR, LF or CRLF
+            stop = _find_terminator(buffer, start, end)
+            if stop < 0:
+                break
+            if stop > start:
+                record = self._parse(buffer, start, stop, time)
+                if record is None:
+                    self.dropped += 1
+                else:
+                    records.append(record)
+            start = stop + 1
+        del buffer[:start]
+
+        if len(buffer) > self.max_line:
+            # No terminator in sight; the stream is out of sync, so drop what we have and wait for the next line
+            buffer.clear()
+            self.resynced += 1
+
+        self.parsed += len(records)
+        return records
+
+    def _parse(self, buffer, start, stop, time):
+        fields = buffer[start:stop].split(b';')
+        if len(fields) <= self.TEMPERATURE:
+            return None
+        if not all(fields):
+            fields = [f for f in fields if f]
+            if len(fields) <= self.TEMPERATURE:
+                return None
+        try:
+            return DORecord(time,
+                            float(fields[self.DISSOLVED_OXYGEN]),
+                            float(fields[self.NANOAMPERES]),
+                            float(fields[self.TEMPERATURE]))
+        except ValueError:
+            return None
+
+
+def _find_terminator(buffer, start, end):
+    lf = buffer.find(b'\n', start, end)
+    cr = buffer.find(b'\r', start, end if lf < 0 else lf)
+    return cr if cr >= 0 else lf
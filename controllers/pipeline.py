@@ -0,0 +1,184 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from controllers import timing
+
+
+class BandTiming:
+    """Timestamps (seconds, from the pipeline clock) of one band's trip through the acquisition pipeline."""
+    __slots__ = ('index', 'wavelength', 'exposure', 'tune_start', 'tuned', 'capture_start', 'exposure_end',
+                 'frame_ready', 'saved')
+
+    def __init__(self, index, wavelength, exposure):
+        self.index = index
+        self.wavelength = wavelength
+        self.exposure = exposure
+        self.tune_start = self.tuned = None
+        self.capture_start = self.exposure_end = self.frame_ready = self.saved = None
+
+    # Durations are None for a band whose step never happened (e.g. the stack stopped before it)
+
+    @property
+    def tune_time(self):
+        return _duration(self.tune_start, self.tuned)
+
+    @property
+    def readout_time(self):
+        return _duration(self.exposure_end, self.frame_ready)
+
+    @property
+    def save_time(self):
+        return _duration(self.frame_ready, self.saved)
+
+
+def _duration(start, end):
+    return None if start is None or end is None else end - start
+
+
+def _ms(seconds, width):
+    return f'{seconds * 1e3:{width}.1f}' if seconds is not None else f'{"-":>{width}}'
+
+
+class StackTrace:
+    """Per-band timing trace of one stack, with the achieved stack time and the bound the pipeline could reach."""
+
+    def __init__(self, bands):
+        self.bands = bands
+        self.start = None
+        self.end = None
+
+    @property
+    def stack_time(self):
+        return self.end - self.start
+
+    @property
+    def exposure_time(self):
+        """Time the sensor actually had to integrate; no schedule can beat this."""
+        return sum(band.exposure for band in self.bands)
+
+    @property
+    def minimum_time(self):
+        """
+        Fastest possible stack with the measured tuning and readout times, if every overlap were perfect.
+
+        The first tune cannot be hidden; after that each band costs its exposure plus whichever is longer of its
+        readout and the next band's tune.
+        """
+        bands = self.bands
+        total = (bands[0].tune_time or 0) if bands else 0
+        for k, band in enumerate(bands):
+            if band.frame_ready is None:
+                continue  # Never captured
+            next_tune = (bands[k + 1].tune_time or 0) if k + 1 < len(bands) else 0
+            total += band.exposure + max(band.readout_time or 0, next_tune)
+        return total
+
+    def summary(self):
+        lines = [f'{"band":>4} {"nm":>6} {"tune ms":>8} {"exp ms":>8} {"readout ms":>10} {"save ms":>8}']
+        for band in self.bands:
+            lines.append(f'{band.index:>4} {band.wavelength:>6} {_ms(band.tune_time, 8)} {band.exposure * 1e3:8.1f} '
+                         f'{_ms(band.readout_time, 10)} {_ms(band.save_time, 8)}')
+        lines.append(f'Stack time {self.stack_time:.3f} s | pipelined minimum {self.minimum_time:.3f} s | '
+                     f'exposure only {self.exposure_time:.3f} s')
+        return '\n'.join(lines)
+
+
+class BandPipeline:
+    """
+    Pipelined acquisition of a stack of (wavelength, exposure) bands.
+
+    Three things run concurrently: a tuner thread that moves the LCTF to band k+1 as soon as band k's exposure has
+    ended (while band k is still being read out), the calling thread that sets the exposure and captures each band
+    once the filter has settled, and a worker pool that hands finished frames to the save callback (stack file and
+    database) so disk and DB I/O never hold up the next band. At most max_pending frames wait for saving at once.
+    Every timestamp comes from clock, so a run can share its time base with other instruments.
+    """
+
+    def __init__(self, lctf, cmos, save, max_pending=4, save_workers=1, clock=time.perf_counter):
+        self.lctf = lctf
+        self.cmos = cmos
+        self.save = save  # Called as save(index, frame, wavelength, exposure) on a worker thread
+        self.max_pending = max_pending
+        self.save_workers = save_workers
+        self.clock = clock
+
+    def run(self, wavelengths, exposures):
+        """Capture every band and return its StackTrace."""
+        bands = [BandTiming(k, lam, tau) for k, (lam, tau) in enumerate(zip(wavelengths, exposures))]
+        trace = StackTrace(bands)
+        if not bands:
+            return trace
+
+        tuned = [threading.Event() for _ in bands]
+        exposed = [threading.Event() for _ in bands]
+        failed = threading.Event()
+        errors = []
+
+        def tune():
+            try:
+                for k, band in enumerate(bands):
+                    # The filter may only move once the previous band stopped integrating
+                    if k and not self._wait(exposed[k - 1], failed):
+                        return
+                    band.tune_start = self.clock()
+                    self.lctf.wavelength = band.wavelength
+                    band.tuned = self.clock()
+                    tuned[k].set()
+            except Exception as e:
+                errors.append(e)
+                failed.set()
+
+        pending = threading.BoundedSemaphore(self.max_pending)
+
+        def save(band, frame):
+            try:
+                with timing.timed('stack.save'):
+                    self.save(band.index, frame, band.wavelength, band.exposure)
+                band.saved = self.clock()
+            except Exception as e:
+                errors.append(e)
+                failed.set()
+            finally:
+                pending.release()
+
+        trace.start = self.clock()
+        tuner = threading.Thread(target=tune, daemon=True)
+        tuner.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.save_workers) as savers:
+                for k, band in enumerate(bands):
+                    self.cmos.exposure_time = band.exposure
+                    if not self._wait(tuned[k], failed):
+                        break
+
+                    band.capture_start = self.clock()
+                    frame = self.cmos.snap(on_exposure_end=lambda b=band, e=exposed[k]: self._exposure_ended(b, e))
+                    band.frame_ready = self.clock()
+
+                    pending.acquire()
+                    savers.submit(save, band, frame)
+        except Exception:
+            failed.set()
+            raise
+        finally:
+            for event in exposed:
+                event.set()  # Let the tuner run out if we stopped early
+            tuner.join()
+        trace.end = self.clock()
+        timing.add('stack.capture', trace.stack_time)
+
+        if errors:
+            raise errors[0]
+        return trace
+
+    def _exposure_ended(self, band, event):
+        band.exposure_end = self.clock()
+        event.set()
+
+    @staticmethod
+    def _wait(event, failed):
+        while not event.wait(0.1):
+            if failed.is_set():
+                return False
+        return not failed.is_set()
@@ -0,0 +1,252 @@
+import time
+
+import numpy as np
+
+from controllers.pipeline import BandPipeline
+
+
+class CostModel:
+    """
+    Predicted time (seconds) of each step of a pipelined stack.
+
+    Tuning the filter costs tune_base plus tune_per_nm for every nanometre moved and nothing if the wavelength does
+    not change; changing the exposure costs exposure_change. The defaults are rough guesses until fit() has seen a
+    real stack.
+    """
+
+    def __init__(self, tune_base=0.05, tune_per_nm=0.0, exposure_change=0.01, readout=0.03):
+        self.tune_base = tune_base
+        self.tune_per_nm = tune_per_nm
+        self.exposure_change = exposure_change
+        self.readout = readout
+
+    def tune_time(self, start, end):
+        if start is not None and float(start) == float(end):
+            return 0.0
+        distance = 0.0 if start is None else abs(float(end) - float(start))
+        return self.tune_base + self.tune_per_nm * distance
+
+    def exposure_time(self, start, end):
+        if start is not None and float(start) == float(end):
+            return 0.0
+        return self.exposure_change
+
+    def fit(self, trace, start_wavelength=None, exposure_changes=()):
+        """Refit the model from a StackTrace and the measured durations of exposure changes."""
+        distances, tunes = [], []
+        previous = start_wavelength
+        for band in trace.bands:
+            if band.tuned is not None and band.tune_start is not None and previous != band.wavelength:
+                distances.append(np.nan if previous is None else abs(band.wavelength - previous))
+                tunes.append(band.tune_time)
+            previous = band.wavelength
+
+        distances, tunes = np.asarray(distances, dtype=float), np.asarray(tunes, dtype=float)
+        known = ~np.isnan(distances)
+        if np.unique(distances[known]).size > 1:
+            # Least squares line through (distance, tune time)
+            self.tune_per_nm, self.tune_base = np.polyfit(distances[known], tunes[known], 1)
+            self.tune_per_nm = max(self.tune_per_nm, 0.0)
+            self.tune_base = max(self.tune_base, 0.0)
+        elif tunes.size:
+            self.tune_base, self.tune_per_nm = float(np.median(tunes)), 0.0
+
+        readouts = [band.readout_time for band in trace.bands
+                    if band.frame_ready is not None and band.exposure_end is not None]
+        if readouts:
+            self.readout = float(np.median(readouts))
+        if len(exposure_changes):
+            self.exposure_change = float(np.median(exposure_changes))
+        return self
+
+    def __repr__(self):
+        return (f'CostModel(tune_base={self.tune_base:.4f}, tune_per_nm={self.tune_per_nm:.6f}, '
+                f'exposure_change={self.exposure_change:.4f}, readout={self.readout:.4f})')
+
+
+class FilterState:
+    """
+    LCTF stand-in that only sends a tune when the wavelength changes.
+
+    What the filter is at comes from the LCTF itself (known_wavelength, kept by its wavelength setter and cleared by
+    a re-wake), so tuning it from anywhere else is never mistaken for the plan's last tune.
+    """
+
+    def __init__(self, lctf):
+        self.lctf = lctf
+        self.sent = 0
+        self.skipped = 0
+
+    @property
+    def current(self):
+        """Wavelength the filter is known to be at without asking it, or None."""
+        return getattr(self.lctf, 'known_wavelength', None)
+
+    @property
+    def wavelength(self):
+        return self.lctf.wavelength
+
+    @wavelength.setter
+    def wavelength(self, wavelength):
+        current = self.current
+        if current is not None and float(current) == float(wavelength):
+            self.skipped += 1
+            return
+        self.lctf.wavelength = wavelength
+        self.sent += 1
+
+
+class CameraState:
+    """
+    CMOS stand-in that only sends the exposure time when it changes and times every change.
+
+    The camera's exposure comes from the CMOS (whose CameraProperties cache answers without a device round trip). A
+    request is skipped if it repeats the last one and the camera still reports the value it did after that request,
+    so an exposure the camera rounded is not re-sent, and one changed from elsewhere is.
+    """
+
+    def __init__(self, cmos):
+        self.cmos = cmos
+        self.sent = 0
+        self.skipped = 0
+        self.change_times = []
+        self._last = None  # (requested, reported by the camera) of the last exposure sent
+
+    def __getattr__(self, name):
+        return getattr(self.cmos, name)
+
+    @property
+    def current(self):
+        """Exposure time the camera is known to be at, or None."""
+        if self._last is None:
+            return None
+        requested, reported = self._last
+        return requested if self.cmos.exposure_time == reported else None
+
+    @property
+    def exposure_time(self):
+        return self.cmos.exposure_time
+
+    @exposure_time.setter
+    def exposure_time(self, exposure_time):
+        current = self.current
+        if current is not None and float(current) == float(exposure_time):
+            self.skipped += 1
+            return
+        start = time.perf_counter()
+        self.cmos.exposure_time = exposure_time
+        self.change_times.append(time.perf_counter() - start)
+        self._last = (exposure_time, self.cmos.exposure_time)
+        self.sent += 1
+
+
+class AcquisitionPlan:
+    """
+    Order in which the bands of a stack are acquired, chosen to minimize the predicted stack time.
+
+    Bands are given in their logical order (the order of planes in the saved stack). The plan compares the given
+    order with ascending and descending wavelength sweeps, which group equal wavelengths and within them equal
+    exposures, and keeps whichever the CostModel predicts is fastest. run() acquires the bands in that order but
+    hands each frame to save() with its logical index, and keeps the filter and camera state between runs so
+    repeated settings are never re-sent. After every run the cost model is refit from the measured timings.
+    """
+
+    def __init__(self, wavelengths, exposures, cost=None, reorder=True):
+        if len(wavelengths) != len(exposures):
+            raise ValueError('Each band needs one wavelength and one exposure.')
+        self.wavelengths = list(wavelengths)
+        self.exposures = list(exposures)
+        self.cost = CostModel() if cost is None else cost
+        self.reorder = reorder
+        self.order = list(range(len(self.wavelengths)))
+        self.filter = None
+        self.camera = None
+
+    def __len__(self):
+        return len(self.wavelengths)
+
+    @property
+    def start_state(self):
+        """(wavelength, exposure) the devices are known to be at, or None where unknown."""
+        wavelength = self.filter.current if self.filter is not None else None
+        exposure = self.camera.current if self.camera is not None else None
+        return wavelength, exposure
+
+    def band_times(self, order=None):
+        """Predicted (tune, exposure change, exposure, readout) time of each band in acquisition order."""
+        order = self.order if order is None else order
+        wavelength, exposure = self.start_state
+        times = []
+        for i in order:
+            times.append((self.cost.tune_time(wavelength, self.wavelengths[i]),
+                          self.cost.exposure_time(exposure, self.exposures[i]),
+                          self.exposures[i],
+                          self.cost.readout))
+            wavelength, exposure = self.wavelengths[i], self.exposures[i]
+        return times
+
+    def predicted_time(self, order=None):
+        """
+        Predicted stack time when acquired in order (default: the plan's order).
+
+        The first tune is not hidden. After that the filter moves during readout while the exposure is being set,
+        so each band costs its exposure plus the longer of the next band's tune and this band's readout plus the
+        next exposure change, the same schedule BandPipeline follows.
+        """
+        times = self.band_times(order)
+        if not times:
+            return 0.0
+        total = max(times[0][0], times[0][1])
+        for k, (_, _, exposure, readout) in enumerate(times):
+            if k + 1 < len(times):
+                next_tune, next_change = times[k + 1][:2]
+                total += exposure + max(next_tune, readout + next_change)
+            else:
+                total += exposure + readout
+        return total
+
+    def optimize(self):
+        """Pick the fastest candidate order. Returns the predicted stack time."""
+        logical = list(range(len(self)))
+        if not self.reorder:
+            self.order = logical
+            return self.predicted_time()
+
+        ascending = sorted(logical, key=lambda i: (self.wavelengths[i], self.exposures[i]))
+        descending = sorted(logical, key=lambda i: (-self.wavelengths[i], self.exposures[i]))
+        candidates = [logical, ascending, descending]
+        self.order = min(candidates, key=self.predicted_time)
+        return self.predicted_time()
+
+    def dry_run(self):
+        """Print the acquisition order and predicted stack time without touching any hardware."""
+        predicted = self.optimize()
+        print(f'{"step":>4} {"band":>4} {"nm":>8} {"exp ms":>8} {"tune ms":>8} {"set ms":>7}')
+        for step, (i, (tune, change, exposure, _)) in enumerate(zip(self.order, self.band_times())):
+            print(f'{step:>4} {i:>4} {self.wavelengths[i]:>8} {exposure * 1e3:8.1f} {tune * 1e3:8.1f} '
+                  f'{change * 1e3:7.1f}')
+        given = self.predicted_time(range(len(self)))
+        print(f'Predicted stack time {predicted:.3f} s (in the given order {given:.3f} s) with {self.cost}')
+        return predicted
+
+    def run(self, lctf, cmos, save, **kwargs):
+        """
+        Acquire the stack with a BandPipeline in the planned order.
+
+        save is called as save(index, frame, wavelength, exposure) with the band's logical index. Extra keyword
+        arguments go to BandPipeline. Returns the StackTrace, whose bands are in acquisition order.
+        """
+        if self.filter is None or self.filter.lctf is not lctf:
+            self.filter = FilterState(lctf)
+        if self.camera is None or self.camera.cmos is not cmos:
+            self.camera = CameraState(cmos)
+        start_wavelength = self.filter.current
+        changes = len(self.camera.change_times)
+        self.optimize()
+
+        order = self.order
+        pipeline = BandPipeline(self.filter, self.camera,
+                                lambda k, frame, lam, tau: save(order[k], frame, lam, tau), **kwargs)
+        trace = pipeline.run([self.wavelengths[i] for i in order], [self.exposures[i] for i in order])
+        self.cost.fit(trace, start_wavelength, self.camera.change_times[changes:])
+        return trace
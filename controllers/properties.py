@@ -0,0 +1,127 @@
+# Properties whose range depends on other settings are written last (e.g. the exposure limits follow binning and ROI)
+WRITE_LAST = ('exposure_time',)
+
+
+def roi_settings(x, y, width, height):
+    """DCAM subarray writes for a region of interest, ordered so no intermediate step leaves the sensor."""
+    return [('subarray_mode', 'OFF'),
+            ('subarray_hpos', 0), ('subarray_hsize', width), ('subarray_hpos', x),
+            ('subarray_vpos', 0), ('subarray_vsize', height), ('subarray_vpos', y),
+            ('subarray_mode', 'ON')]
+
+
+class CameraProperties:
+    """
+    Cached access to every DCAM property of a camera, by name ('exposure_time', 'EXPOSURE TIME') or EProp.
+
+    The camera is opened once and left open, so reads and writes no longer pay for a context enter/exit. Values read
+    from the device are cached until the next write; a write may change other properties (binning changes the image
+    size, exposure limits follow the readout mode), so it clears the whole cache and keeps only the value the camera
+    reports back for the written property.
+    """
+
+    def __init__(self, camera):
+        self.camera = camera
+        self._cache = {}
+        self.reads = 0  # Device round trips, for comparing against the cache hits
+        self.writes = 0
+
+    def __getitem__(self, name):
+        key = self._key(name)
+        if key not in self._cache:
+            self._cache[key] = self.capability(name).read()
+            self.reads += 1
+        return self._cache[key]
+
+    def __setitem__(self, name, value):
+        value = self.capability(name).write(self._resolve(name, value))
+        self.writes += 1
+        self._cache.clear()
+        self._cache[self._key(name)] = value
+
+    def __contains__(self, name):
+        return name in self._open()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._open())
+
+    def keys(self):
+        """Names of every property the camera supports."""
+        return [capability['uname'] for capability in self._open().values()]
+
+    def capability(self, name):
+        """The DCAM attribute (range, unit, value texts, read/write) of a property."""
+        return self._open()[name]
+
+    def invalidate(self, name=None):
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(self._key(name), None)
+
+    def snapshot(self):
+        """Current value of every readable property."""
+        values = {}
+        for name in self.keys():
+            try:
+                values[name] = self[name]
+            except Exception:
+                pass  # Write-only or not readable in the current camera state
+        return values
+
+    def apply(self, config):
+        """
+        Write a whole configuration in one batch, skipping values the camera already has.
+
+        config maps property names to values; 'roi' may be given as (x, y, width, height). Returns the values the
+        camera accepted, which can differ from the requested ones after rounding to the property step.
+        """
+        config = dict(config)
+        roi = config.pop('roi', None)
+        last = [(name, config.pop(name)) for name in WRITE_LAST if name in config]
+        settings = list(config.items()) + last
+
+        self._open()
+        applied = {}
+        if roi is not None:
+            steps = roi_settings(*roi)
+            # The subarray is only rewritten (every step, in order) if its final state differs from the camera's
+            final = dict(steps)
+            if any(self._differs(name, value) for name, value in final.items()):
+                for name, value in steps:
+                    self[name] = value
+            for name in final:
+                applied[name] = self[name]
+        for name, value in settings:
+            # A cache miss reads the current value back, so only values that actually differ are written
+            if self._differs(name, value):
+                self[name] = value
+            applied[name] = self[name]
+        return applied
+
+    def _differs(self, name, value):
+        try:
+            return self[name] != self._resolve(name, value)
+        except Exception:
+            return True  # Not readable in the current camera state, so write it
+
+    def _resolve(self, name, value):
+        capability = self.capability(name)
+        if isinstance(value, str) and 'enum' in capability:
+            return capability['enum'][value]  # Value text such as 'OFF' or 'INTERNAL'
+        return value
+
+    def _key(self, name):
+        try:
+            return self._open()[name]['uname']
+        except (KeyError, TypeError):
+            return name
+
+    def _open(self):
+        # The device context closes the camera on exit, so open it directly and keep it open
+        if not self.camera.is_open():
+            self.camera.open()
+        return self.camera
@@ -0,0 +1,171 @@
+import queue
+import selectors
+import threading
+import time
+
+
+class _QueuedReader(threading.Thread):
+    """Background reader thread that hands what it reads to the GUI through a bounded queue."""
+
+    def __init__(self, poll=0.1, maxsize=1024):
+        super().__init__(daemon=True)
+        self.poll = poll
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0  # Reads discarded because the queue stayed full
+
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Ask the reader to stop after the current read and wait for it to finish."""
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    @property
+    def finished(self):
+        """True once the thread has stopped and everything it read has been drained."""
+        return not self.is_alive() and self.queue.empty()
+
+    def drain(self, max_items=None):
+        """Return the queued items without blocking."""
+        items = []
+        while max_items is None or len(items) < max_items:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _put(self, item):
+        try:
+            # Wait briefly for the consumer rather than blocking the port indefinitely
+            self.queue.put(item, timeout=self.poll)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DOReader(_QueuedReader):
+    """
+    Reads a DOProbe on a background thread and pushes what it reads into a bounded queue.
+
+    The thread blocks on the serial port (up to poll seconds per read) instead of sleeping, so readings are queued as
+    soon as they arrive. It stops by itself once the probe has been silent for timeout seconds. GUI code should drain
+    the queue from an after() callback and can use idle_time to drive a timeout progress bar.
+    """
+
+    def __init__(self, probe, timeout=10, poll=0.1, maxsize=1024):
+        super().__init__(poll, maxsize)
+        self.probe = probe
+        self.probe.timeout = poll  # Serial reads block for at most this long
+        self.timeout = timeout
+        self.last_data = time.monotonic()
+
+    @property
+    def idle_time(self):
+        """Seconds since the probe last sent data."""
+        return time.monotonic() - self.last_data
+
+    @property
+    def timed_out(self):
+        return self.idle_time >= self.timeout
+
+    def run(self):
+        self.last_data = time.monotonic()
+        try:
+            while not self._stop_event.is_set() and not self.timed_out:
+                records = self.probe.read()
+                if not records:
+                    continue
+
+                self.last_data = time.monotonic()
+                self._put(records)
+        except Exception as e:
+            print(f'DO reader stopped:\n{e}')
+
+
+def _selectable(probe):
+    """True if the probe's port has a file descriptor select() can wait on (not the case for Windows COM ports)."""
+    try:
+        probe.port.fileno()
+    except Exception:
+        return False
+    return True
+
+
+class MultiDOReader(_QueuedReader):
+    """
+    Reads several DOProbes, keyed by sample_id, and pushes (sample_id, records) into one bounded queue.
+
+    Ports with a file descriptor (POSIX serial ports, socket:// URLs of simulated probes) are multiplexed on this one
+    thread: it sleeps in a single select() until any of them has data and then reads only those, so the CPU it uses
+    follows the readings that arrive, not the number of probes. Ports select() cannot wait on (Windows COM ports,
+    loop://) each get a blocking reader thread instead, as in DOReader. A probe is no longer read once it has been
+    silent for timeout seconds, and the reader stops when all of them have.
+    """
+
+    def __init__(self, probes, timeout=10, poll=0.1, maxsize=1024, multiplex=None):
+        super().__init__(poll, maxsize)
+        self.probes = dict(probes)
+        self.timeout = timeout
+        # By default every port is multiplexed if all of them can be
+        self.multiplex = all(_selectable(probe) for probe in self.probes.values()) if multiplex is None else multiplex
+        self.active = set(self.probes)  # Probes still being read
+        self.last_data = dict.fromkeys(self.probes, time.monotonic())
+
+    def idle_time(self, sample_id):
+        """Seconds since the probe of sample_id last sent data."""
+        return time.monotonic() - self.last_data[sample_id]
+
+    def timed_out(self, sample_id):
+        return self.idle_time(sample_id) >= self.timeout
+
+    def run(self):
+        self.last_data = dict.fromkeys(self.probes, time.monotonic())
+        try:
+            if self.multiplex:
+                self._select()
+            else:
+                threads = [threading.Thread(target=self._read_blocking, args=(sample_id,), daemon=True)
+                           for sample_id in self.probes]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        except Exception as e:
+            print(f'DO reader stopped:\n{e}')
+
+    def _select(self):
+        with selectors.DefaultSelector() as selector:
+            for sample_id, probe in self.probes.items():
+                probe.timeout = 0  # Ports are only read once select() reports data, so reads never wait
+                selector.register(probe.port, selectors.EVENT_READ, sample_id)
+
+            while not self._stop_event.is_set() and self.active:
+                for key, _ in selector.select(self.poll):
+                    sample_id = key.data
+                    try:
+                        self._received(sample_id, self.probes[sample_id].read())
+                    except Exception as e:
+                        # A probe that fails (e.g. is unplugged) must not stop the others
+                        print(f'DO reader of sample {sample_id} stopped:\n{e}')
+                        self.last_data[sample_id] = -float('inf')
+
+                for sample_id in [sample_id for sample_id in self.active if self.timed_out(sample_id)]:
+                    selector.unregister(self.probes[sample_id].port)
+                    self.active.discard(sample_id)
+
+    def _read_blocking(self, sample_id):
+        probe = self.probes[sample_id]
+        probe.timeout = self.poll  # Serial reads block for at most this long
+        try:
+            while not self._stop_event.is_set() and not self.timed_out(sample_id):
+                self._received(sample_id, probe.read())
+        except Exception as e:
+            print(f'DO reader of sample {sample_id} stopped:\n{e}')
+        finally:
+            self.active.discard(sample_id)
+
+    def _received(self, sample_id, records):
+        if records:
+            self.last_data[sample_id] = time.monotonic()
+            self._put((sample_id, records))
@@ -1,17 +1,64 @@
-import numpy as np
-from jupyter_server.extension.utils import get_metadata
+import math
+import os
+import queue
+import threading
 
-from controllers import DOProbe, CMOS, LCTF
-import sqlite3
 import tkinter as tk
 from tkinter import messagebox, ttk, simpledialog, filedialog
-import time
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from tifffile import tiff
 
-from controllers.subs import get_metadata_from_user, select_serial_port, update_plot, select_database, \
-    select_study_table
+from controllers import timing
+from controllers.acquisition import resolve_bands, dry_run_bands, create_stack_tables, capture_stack
+from controllers.database import DatabaseWriter
+from controllers.device import DOProbe, LCTF
+from controllers.readers import DOReader, MultiDOReader
+from controllers.schema import migrate, INSERT_STUDY, INSERT_DO_RECORD
+from controllers.subs import get_metadata_from_user, select_serial_port, select_serial_ports, select_database, \
+    select_study_table, LivePlot, TimingPanel
+
+
+def embed_live_plot(root):
+    """Create a LivePlot on a matplotlib figure packed into a Tk window."""
+    # matplotlib is only loaded once a routine actually plots
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    canvas = FigureCanvasTkAgg(fig, master=root)
+    canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    return LivePlot(fig, ax)
+
+
+def embed_live_plots(root, titles):
+    """Create one LivePlot per title on a grid of axes in a single matplotlib figure packed into a Tk window."""
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+    cols = math.ceil(math.sqrt(len(titles)))
+    rows = math.ceil(len(titles) / cols)
+    fig, axes = plt.subplots(rows, cols, figsize=(8, 6), squeeze=False)
+    for ax in axes.flat[len(titles):]:
+        ax.set_visible(False)
+    for ax, title in zip(axes.flat, titles):
+        ax.set_title(title)
+    fig.tight_layout()
+    canvas = FigureCanvasTkAgg(fig, master=root)
+    canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    return [LivePlot(fig, ax) for ax in axes.flat[:len(titles)]]
+
+
+def start_timing(root=None):
+    """Reset the stage timings for a new run and show them live in root, if timing is enabled."""
+    if timing.enabled:
+        timing.reset()
+        if root is not None:
+            TimingPanel(root)
+
+
+def finish_timing(writer, run):
+    """Store the stage timings of a run in the study database and print them, if timing is enabled."""
+    if timing.enabled:
+        timing.save(writer, run)
+        print(timing.summary())
 
 
 def record_do(port=None, study_db=None):
@@ -19,7 +66,7 @@ def record_do(port=None, study_db=None):
     root.title("DO Probe Data")
 
     # Get user input
-    port = select_serial_port() if port is None else port
+    port = select_serial_port("Select DO Probe Port") if port is None else port
     study_db = select_database() if study_db is None else study_db
 
     if not study_db:
@@ -36,9 +83,7 @@ def record_do(port=None, study_db=None):
     sample_name = metadata["sample_name"]
 
     # Prep plot
-    fig, ax = plt.subplots(figsize=(8, 6))
-    canvas = FigureCanvasTkAgg(fig, master=root)
-    canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    live_plot = embed_live_plot(root)
 
     # Create a progress bar
     progress_label = tk.Label(root, text="Timeout Progress:")
@@ -47,149 +92,359 @@ def record_do(port=None, study_db=None):
     progress_bar = ttk.Progressbar(root, length=300, mode='determinate', maximum=10)
     progress_bar.pack(pady=5)
 
-    # Initialize DO device object
+    # Initialize DO device object and start reading it in the background
     probe = DOProbe(port=port)
+    reader = DOReader(probe, timeout=10)
 
-    # Connect to database
-    conn = sqlite3.connect(study_db)
-    cursor = conn.cursor()
-
-    # Insert study metadata
-    cursor.execute("""
-        INSERT INTO dissolved_oxygen_study_table (
-            start_time, sample_name, solvent, hemoglobin_concentration_mg_mL,
-            microsphere_concentration_uL_mL, yeast_stock_added_uL_mL, yeast_concentration_mg_mL
-        ) VALUES (CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, ?)
-    """, tuple(metadata.values()))
-
-    sample_id = cursor.lastrowid  # Get the inserted study ID
-
-    data_queue = []
-    delay = 0
-    while delay < 10:
-        # Update progress bar
-        progress_bar["value"] = delay
-        root.update_idletasks()  # Force GUI update
-
-        if probe.in_waiting > 0:
-            delay = 0
-            data = probe.read()
-
-            # Write data to database
-            cursor.execute("BEGIN TRANSACTION")
-            for d in data:
-                if len(d) > 12:
-                    cursor.execute("""
-                        INSERT INTO dissolved_oxygen_records (
-                            sample_name, sample_id, time, dissolved_oxygen, nanoamperes, temperature
-                        ) VALUES (?, ?, CURRENT_TIMESTAMP, ?, ?, ?)
-                    """, (sample_name, sample_id, d[8], d[10], d[12]))
-
-                    cursor.execute(
-                        f"SELECT time, dissolved_oxygen, temperature FROM dissolved_oxygen_records WHERE sample_id = ?",
-                        (sample_id,))
-                    data_queue = cursor.fetchall()
-                else:
-                    print('Skipped', f'Malformed data:\n{d}')
-            conn.commit()
-
-            # Update plot
+    # Make sure the database has the current schema, then start the batched writer
+    migrate(study_db)
+    writer = DatabaseWriter(study_db)
+    writer.start()
+
+    # Insert study metadata and get the inserted study ID
+    sample_id = writer.execute(INSERT_STUDY, tuple(metadata.values()))
+    start_timing(root)
+
+    def process_readings():
+        """Drain the reader queue, store and plot new readings, then reschedule."""
+        for records in reader.drain():
+            # Queue data for the database writer, which commits in batches
+            writer.insert_many(INSERT_DO_RECORD, [(sample_name, sample_id, r.time, r.dissolved_oxygen, r.nanoamperes,
+                                                   r.temperature) for r in records])
+
+            # Update plot with only the new readings
             try:
-                update_plot(fig, ax, data_queue)
-                canvas.draw()
+                t, do, _, T = zip(*records)
+                live_plot.append(t, do, T)
             except Exception as e:
                 print(f'Failed to update plot:\n{e}')
 
+        # Update progress bar from the reader's idle time
+        progress_bar["value"] = min(reader.idle_time, reader.timeout)
+
+        if reader.finished:
+            finish_recording()
         else:
-            time.sleep(1)
-            delay += 1
+            root.after(100, process_readings)
+
+    def finish_recording():
+        finish_timing(writer, f'record_do {sample_id}')
+        writer.close()  # Commits and checkpoints everything that is still queued
+        probe.close()
+        print('Probe stopped sending data. Recording closed and data saved.')
+        if reader.dropped:
+            print(f'{reader.dropped} reads were dropped because the queue was full.')
+        if probe.framer.dropped or probe.framer.resynced:
+            print(f'Skipped {probe.framer.dropped} malformed lines and resynchronized {probe.framer.resynced} times.')
+
+        # Ask user if they want to record another study
+        retry = messagebox.askyesno("Continue?", "Would you like to record another study in the same database?")
+
+        # Start the next study from the event loop instead of from inside this one's callbacks
+        if retry:
+            root.master.after(0, lambda: record_do(port=port, study_db=study_db))
+        root.destroy()
 
-    conn.close()
-    print('Probe stopped sending data. Recording closed and data saved.')
+    reader.start()
+    root.after(100, process_readings)
 
-    # Ask user if they want to record another study
-    retry = messagebox.askyesno("Continue?", "Would you like to record another study in the same database?")
 
-    if retry:
-        root.destroy()
-        record_do(port=port, study_db=study_db)
-    else:
+def record_do_multi(ports=None, study_db=None, timeout=10):
+    """
+    Record several DO probes at once, e.g. one per phantom, into one study database.
+
+    Each probe gets its own study (sample_id) and its own plot in one window. All the ports are read by one
+    MultiDOReader and every reading goes through one batched DatabaseWriter, so the probes do not compete for the
+    database file. Recording ends when every probe has been silent for timeout seconds or the window is closed.
+    """
+    root = tk.Toplevel()
+    root.title("DO Probes Data")
+
+    # Get user input
+    ports = select_serial_ports("Select DO Probe Ports") if ports is None else ports
+    study_db = select_database() if study_db is None else study_db
+
+    if not ports or not study_db:
+        print("Error: At least one port and a database file must be provided!")
+        return
+
+    # One metadata form per probe
+    studies = []
+    for port in ports:
+        metadata = get_metadata_from_user(f"Study Metadata for the Probe on {port}")
+        if not metadata["sample_name"]:
+            print("Error: Sample name is required!")
+            return
+        studies.append(metadata)
+
+    # Prep plots
+    titles = [f'{metadata["sample_name"]} ({port})' for port, metadata in zip(ports, studies)]
+    live_plots = embed_live_plots(root, titles)
+
+    # One timeout progress bar per probe
+    progress = tk.Frame(root)
+    progress.pack(pady=5)
+    progress_bars = []
+    for row, metadata in enumerate(studies):
+        tk.Label(progress, text=f'{metadata["sample_name"]} timeout:').grid(row=row, column=0, sticky='e')
+        bar = ttk.Progressbar(progress, length=300, mode='determinate', maximum=timeout)
+        bar.grid(row=row, column=1, padx=5)
+        progress_bars.append(bar)
+
+    # Make sure the database has the current schema, then start the batched writer shared by every probe
+    migrate(study_db)
+    writer = DatabaseWriter(study_db)
+    writer.start()
+
+    # Insert each study's metadata and key its probe by the inserted study ID
+    sample_ids = [writer.execute(INSERT_STUDY, tuple(metadata.values())) for metadata in studies]
+    sample_names = {sample_id: metadata["sample_name"] for sample_id, metadata in zip(sample_ids, studies)}
+    plots = dict(zip(sample_ids, live_plots))
+    probes = {sample_id: DOProbe(port=port) for sample_id, port in zip(sample_ids, ports)}
+    reader = MultiDOReader(probes, timeout=timeout)
+    start_timing(root)
+
+    def process_readings():
+        """Drain the reader queue, store every probe's new readings in one batch and plot them, then reschedule."""
+        new = {}
+        for sample_id, records in reader.drain():
+            new.setdefault(sample_id, []).extend(records)
+
+        rows = [(sample_names[sample_id], sample_id, r.time, r.dissolved_oxygen, r.nanoamperes, r.temperature)
+                for sample_id, records in new.items() for r in records]
+        if rows:
+            writer.insert_many(INSERT_DO_RECORD, rows)
+
+        for sample_id, records in new.items():
+            try:
+                t, do, _, T = zip(*records)
+                plots[sample_id].append(t, do, T)
+            except Exception as e:
+                print(f'Failed to update plot:\n{e}')
+
+        for sample_id, bar in zip(sample_ids, progress_bars):
+            bar["value"] = min(reader.idle_time(sample_id), reader.timeout)
+
+        if reader.finished:
+            finish_recording()
+        else:
+            root.after(100, process_readings)
+
+    def finish_recording():
+        finish_timing(writer, f'record_do_multi {",".join(map(str, sample_ids))}')
+        writer.close()  # Commits and checkpoints everything that is still queued
+        for sample_id, probe in probes.items():
+            probe.close()
+            if probe.framer.dropped or probe.framer.resynced:
+                print(f'{sample_names[sample_id]}: skipped {probe.framer.dropped} malformed lines and resynchronized '
+                      f'{probe.framer.resynced} times.')
+        print(f'All {len(probes)} probes stopped sending data. Recording closed and data saved.')
+        if reader.dropped:
+            print(f'{reader.dropped} reads were dropped because the queue was full.')
         root.destroy()
 
+    # Closing the window stops reading every probe; what was read is still saved
+    root.protocol("WM_DELETE_WINDOW", reader.stop)
+
+    reader.start()
+    root.after(100, process_readings)
+
 
 def focus_camera(cmos=None):
+    from controllers.camera import CMOS
+
     cmos = CMOS() if cmos is None else cmos
     cmos.view(live=True)
 
 
-def capture_images(exposures=None, wavelengths=None, port=None, study_db=None):
-    cmos = CMOS()
+def capture_images(exposures=None, wavelengths=None, port=None, study_db=None, dry_run=False, plan=None,
+                   auto_exposure=False, sample_type=None, analyze=False, calibration=None, container=None):
+    from controllers.camera import CMOS
+    from controllers.exposure import save_exposure_table
+    from controllers.plan import AcquisitionPlan
+
+    if analyze and container is not None:
+        # The analysis workers memory-map TIFF stacks, so they cannot read a time point of the container
+        print("Error: Online analysis cannot be combined with a time-lapse container!")
+        return
 
     # Get user input
-    port = select_serial_port() if port is None else port
     study_db = select_database() if study_db is None else study_db
     study_name = select_study_table(study_db)
-    # User wants to create a new database
-    image_name = filedialog.asksaveasfilename(
+    if not study_name or not study_db:
+        print("Error: A study name and database are required!")
+        return
+    sample_type = study_name if sample_type is None else sample_type
+
+    if dry_run:
+        # Print the plan from the given bands and the saved exposure table, without opening any device
+        if plan is None:
+            try:
+                wavelengths, exposures = dry_run_bands(study_db, wavelengths, exposures, auto_exposure, sample_type)
+            except ValueError as e:
+                print(f"Error: {e}")
+                return
+            plan = AcquisitionPlan(wavelengths, exposures)
+        plan.dry_run()
+        return plan
+
+    port = select_serial_port("Select LCTF Port") if port is None else port
+    # User wants to create a new database (unless the stack is appended to a time-lapse container)
+    image_name = container or filedialog.asksaveasfilename(
         title="Save New Image Stack",
         defaultextension=".tiff",
         filetypes=[("TIFF", "*.tiff"), ("All Files", "*.*")]
     )
 
     # Check if the user provided valid input
-    if not port or not study_name or not study_db:
-        print("Error: All inputs (port, study name, and database) are required!")
+    if not port or not image_name:
+        print("Error: All inputs (port, study name, database and image file) are required!")
         return
 
+    cmos = CMOS()
     lctf = LCTF(port=port)
 
-    conn = sqlite3.connect(study_db)
-    c = conn.cursor()
-    c.execute(f"""
-    CREATE TABLE IF NOT EXISTS {study_name}_index (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        image_name TEXT NOT NULL,
-        time DATETIME DEFAULT CURRENT_TIMESTAMP)""")
-    conn.commit()
-
-    c.execute(f"""
-    CREATE TABLE IF NOT EXISTS {study_name}_details (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        image_name TEXT NOT NULL,
-        exposure_time FLOAT NOT NULL,
-        lambda INT NOT NULL,
-        time DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (image_name) REFERENCES {study_name}_index (image_name)) """)
-    conn.commit()
-
-    c.execute(f"""INSERT INTO {study_name}_index (image_name) (?)""", (image_name,))
-    conn.commit()
-
-    c.execute(f"""SELECT * FROM {study_name}_index WHERE image_name={image_name}""")
-    image_metadata = c.fetchone()
-
-    if exposures is None and wavelengths is None:
-        exposures = [cmos.exposure_time]
-        wavelengths = [lctf.wavelength]
-    elif exposures is None:
-        exposures = [cmos.exposure_time] * len(wavelengths)
-    elif wavelengths is None:
-        wavelengths = [lctf.wavelength] * len(exposures)
-
-    frame = []
-    for tau, lam in zip(exposures, wavelengths):
-        lctf.wavelength = lam
-        cmos.exposure_time = tau
-        frame.append(cmos.capture())
-
-        c.execute(f"""
-        INSERT INTO {study_name}_details (image_name, exposure_time, lambda), (?, ?, ?)""", (image_name, tau, lam))
-    frame = np.array(frame)
-    tiff.imwrite(image_name, frame)
-
-
-    ## TODO: Add option to feed straight into analysis tools
-
-
-def synchronized_phantom_measurement():
-    tk.messagebox.showwarning('Not implemented')
+    # Start from the saved exposure table and only search the bands it does not cover yet
+    wavelengths, exposures, found, levels = resolve_bands(cmos, lctf, study_db, wavelengths, exposures, auto_exposure,
+                                                          sample_type)
+
+    # Bands may be acquired out of order to save tuning time; planes are still saved in the requested order
+    plan = AcquisitionPlan(wavelengths, exposures) if plan is None else plan
+
+    migrate(study_db)
+    writer = DatabaseWriter(study_db)
+    writer.start()
+    create_stack_tables(writer, study_name)
+    if found:
+        save_exposure_table(writer, sample_type, cmos.binning, found, levels)
+
+    start_timing()
+    # Bands are dark/flat corrected as they are captured when a calibration directory is given
+    store = None
+    if calibration is not None:
+        from controllers.calibration import CalibrationStore
+        store = CalibrationStore(calibration)
+    lapse = None
+    if container is not None:
+        from controllers.timelapse import TimeLapse
+        lapse = TimeLapse(container, plan.wavelengths, plan.exposures)
+    trace = capture_stack(lctf, cmos, writer, study_name, image_name, plan, calibration=store, lapse=lapse)
+    finish_timing(writer, f'capture_images {image_name}')
+    if lapse is not None:
+        lapse.close()
+    lctf.close()
+    print(trace.summary())
+    print(lctf.latency_summary())
+
+    # Unmix the stack into sO2 and tHb maps next to it
+    if analyze:
+        from controllers.unmixing import OnlineAnalysis
+        with OnlineAnalysis(writer) as analysis:
+            analysis.submit(image_name, plan.wavelengths, plan.exposures, study_name)
+        for name, stats in analysis.results:
+            if stats['pixels']:
+                print(f"{name}: median sO2 {stats['so2_median']:.1f} %, median tHb {stats['thb_median']:.1f} uM")
+    writer.close()
+
+
+def synchronized_phantom_measurement(do_port=None, lctf_port=None, study_db=None, exposures=None, wavelengths=None,
+                                     n_stacks=None, interval=0, analyze=False, calibration=None):
+    from controllers.camera import CMOS
+    from controllers.sync import SynchronizedRun
+
+    root = tk.Toplevel()
+    root.title("Synchronized Phantom Measurement")
+
+    # Get user input
+    do_port = select_serial_port("Select DO Probe Port") if do_port is None else do_port
+    lctf_port = select_serial_port("Select LCTF Port") if lctf_port is None else lctf_port
+    study_db = select_database() if study_db is None else study_db
+    if not do_port or not lctf_port or not study_db:
+        print("Error: Both ports and a database are required!")
+        return
+
+    metadata = get_metadata_from_user()
+    if not metadata["sample_name"]:
+        print("Error: Sample name is required!")
+        return
+    sample_name = metadata["sample_name"]
+
+    image_base = filedialog.asksaveasfilename(
+        title="Save Image Stacks As",
+        defaultextension=".tiff",
+        filetypes=[("TIFF", "*.tiff"), ("All Files", "*.*")]
+    )
+    if not image_base:
+        return
+    image_base = os.path.splitext(image_base)[0]
+
+    cmos = CMOS()
+    lctf = LCTF(port=lctf_port)
+    probe = DOProbe(port=do_port)
+    wavelengths, exposures, _, _ = resolve_bands(cmos, lctf, study_db, wavelengths, exposures)
+
+    migrate(study_db)
+    writer = DatabaseWriter(study_db)
+    writer.start()
+    sample_id = writer.execute(INSERT_STUDY, tuple(metadata.values()))
+
+    # Prep plot
+    live_plot = embed_live_plot(root)
+    status = tk.Label(root, text="Starting...")
+    status.pack(pady=5)
+    start_timing(root)
+
+    # DO is read and stored on background threads; stacks are captured on their own thread, all on one clock
+    if analyze:
+        from controllers.unmixing import OnlineAnalysis
+        analysis = OnlineAnalysis(writer)
+    else:
+        analysis = None
+    store = None
+    if calibration is not None:
+        from controllers.calibration import CalibrationStore
+        store = CalibrationStore(calibration)
+    run = SynchronizedRun(probe, lctf, cmos, writer, sample_name, sample_id, analysis=analysis, calibration=store)
+    stop_event = threading.Event()
+
+    def capture():
+        try:
+            run.run(image_base, wavelengths, exposures, n_stacks=n_stacks, interval=interval, stop_event=stop_event)
+        except Exception as e:
+            print(f'Stack capture stopped:\n{e}')
+
+    stacks = threading.Thread(target=capture, daemon=True)
+
+    def process_readings():
+        while True:
+            try:
+                records = run.updates.get_nowait()
+            except queue.Empty:
+                break
+            t, do, _, T = zip(*records)
+            live_plot.append(t, do, T)
+        status.configure(text=f"Stacks captured: {len(run.traces)}")
+
+        if stacks.is_alive() or run.recording:
+            root.after(100, process_readings)
+        else:
+            finish()
+
+    def finish():
+        finish_timing(writer, f'synchronized {sample_id}')
+        if analysis is not None:
+            analysis.close()
+        writer.close()
+        probe.close()
+        lctf.close()
+        print(f'Captured {len(run.traces)} synchronized stacks.')
+        if run.traces:
+            print(run.traces[-1].summary())
+        root.destroy()
+
+    # Closing the window ends the run after the current stack
+    root.protocol("WM_DELETE_WINDOW", lambda: (stop_event.set(), run.reader.stop()))
+
+    run.start()
+    stacks.start()
+    root.after(100, process_readings)
@@ -0,0 +1,306 @@
+"""
+Unattended acquisition from a protocol file, with no GUI.
+
+    python -m controllers.runner protocol.toml [--dry-run]
+
+A protocol (TOML or JSON) names the hardware and database once and lists steps that run back to back:
+
+    study_db = "phantoms.db"
+    do_port = "COM3"
+    lctf_port = "COM4"
+    camera = { binning = 2 }       # Optional camera properties applied before the first stack
+    repeat = 1                     # Run the whole step list this many times
+    timing = false                 # Store per-stage latencies of every step in performance_stages
+    analysis_workers = 1           # Worker processes for steps with analyze = true
+    calibration = "calibration"    # Optional CalibrationStore directory: stacks are dark/flat corrected as captured
+
+    [[steps]]
+    type = "darks"                 # Master darks for the calibration store (block the light path first)
+    exposures = [0.02, 0.05, 0.1]
+    nb_frames = 32                 # Frames averaged per master (also for flats)
+
+    [[steps]]
+    type = "flats"                 # Flat fields of a uniform target, one per band
+    wavelengths = [500, 550, 600]
+    exposures = [0.05, 0.02, 0.03]
+
+    [[steps]]
+    type = "record_do"             # Record one DO study until the probe goes quiet
+    sample = { sample_name = "phantom 1", hemoglobin_concentration_mg_mL = 1.5 }
+    timeout = 10                   # Seconds of probe silence that end the study
+    duration = 3600                # Optional hard limit (s)
+
+    [[steps]]
+    type = "capture"               # Image stacks, as capture_images
+    study_name = "phantom1"
+    image = "stacks/phantom1.tiff" # Numbered _0000, _0001, ... when repeats > 1
+    # container = "stacks/phantom1.lapse"  # Instead of image: append every stack to one compressed time-lapse
+    wavelengths = [500, 550, 600]
+    exposures = [0.05, 0.02, 0.03] # Or auto_exposure = true (with an optional sample_type)
+    repeats = 3
+    interval = 60                  # Seconds from the start of one stack to the next
+    analyze = true                 # Unmix each stack into sO2/tHb maps in worker processes (stack_analysis table)
+
+    [[steps]]
+    type = "synchronized"          # DO recording and stacks on one clock, as synchronized_phantom_measurement
+    sample = { sample_name = "phantom 2" }
+    image = "stacks/phantom2"
+    wavelengths = [500, 550, 600]
+    n_stacks = 10                  # Default: until the probe goes quiet
+    interval = 120
+"""
+import argparse
+import json
+import os
+import time
+
+from controllers import timing
+from controllers.acquisition import study_params, record_study, resolve_bands, dry_run_bands, create_stack_tables, \
+    capture_stack, DRY_RUN_EXPOSURE
+from controllers.database import DatabaseWriter
+from controllers.exposure import save_exposure_table
+from controllers.plan import AcquisitionPlan
+from controllers.schema import migrate, INSERT_STUDY
+
+
+def load_protocol(path):
+    """Read a protocol from a .toml or .json file."""
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def numbered(path, index, count):
+    """path with _0000, _0001, ... before the extension when a step makes more than one file."""
+    if count == 1:
+        return path
+    base, ext = os.path.splitext(path)
+    return f'{base}_{index:04d}{ext}'
+
+
+class Runner:
+    """
+    Runs the steps of a protocol back to back without any GUI.
+
+    Devices are opened the first time a step needs them and kept open for the rest of the protocol; all steps share
+    one DatabaseWriter. With dry_run nothing is recorded and no device is opened: each stack step prints its plan and
+    predicted stack time.
+    """
+
+    def __init__(self, protocol, dry_run=False, timings=None):
+        self.protocol = protocol
+        self.dry_run = dry_run
+        self.timings = protocol.get('timing', False) if timings is None else timings
+        self.study_db = protocol['study_db']
+        self.writer = None
+        self._probe = None
+        self._lctf = None
+        self._cmos = None
+        self._analysis = None
+        self._calibration = None
+        self._lapses = {}  # Container path -> open TimeLapse
+
+    @property
+    def calibration(self):
+        """The protocol's CalibrationStore, or None if it has no calibration directory."""
+        if self._calibration is None and self.protocol.get('calibration'):
+            from controllers.calibration import CalibrationStore
+            self._calibration = CalibrationStore(self.protocol['calibration'])
+        return self._calibration
+
+    @property
+    def analysis(self):
+        if self._analysis is None:
+            from controllers.unmixing import OnlineAnalysis
+            self._analysis = OnlineAnalysis(self.writer, workers=self.protocol.get('analysis_workers', 1))
+        return self._analysis
+
+    def lapse(self, step, plan):
+        """The TimeLapse a step appends its stacks to, or None if it writes TIFF files."""
+        path = step.get('container')
+        if path is None:
+            return None
+        if path not in self._lapses:
+            from controllers.timelapse import TimeLapse
+            metadata = {'calibration': self.protocol.get('calibration')}
+            self._lapses[path] = TimeLapse(path, plan.wavelengths, plan.exposures, metadata=metadata)
+        return self._lapses[path]
+
+    @property
+    def probe(self):
+        if self._probe is None:
+            from controllers.device import DOProbe
+            self._probe = DOProbe(port=self.protocol['do_port'])
+        return self._probe
+
+    @property
+    def lctf(self):
+        if self._lctf is None:
+            from controllers.device import LCTF
+            self._lctf = LCTF(port=self.protocol['lctf_port'])
+        return self._lctf
+
+    @property
+    def cmos(self):
+        if self._cmos is None:
+            from controllers.camera import CMOS
+            self._cmos = CMOS(self.protocol.get('camera_index', 0))
+            if self.protocol.get('camera'):
+                self._cmos.configure(self.protocol['camera'])
+        return self._cmos
+
+    def run(self):
+        steps = self.protocol.get('steps', [])
+        repeat = self.protocol.get('repeat', 1)
+        if not self.dry_run:
+            migrate(self.study_db)
+            self.writer = DatabaseWriter(self.study_db)
+            self.writer.start()
+        was_enabled = timing.enabled
+        timing.enable(self.timings)
+        try:
+            for cycle in range(repeat):
+                for number, step in enumerate(steps):
+                    kind = step.get('type')
+                    print(f'[{time.strftime("%H:%M:%S")}] Cycle {cycle + 1}/{repeat}, step {number + 1}/{len(steps)}: '
+                          f'{kind}')
+                    run_step = getattr(self, f'_run_{kind}', None)
+                    if run_step is None:
+                        raise ValueError(f'Unknown protocol step type {kind!r}.')
+                    timing.reset()
+                    run_step(step, cycle)
+                    if timing.enabled and not self.dry_run:
+                        timing.save(self.writer, f'cycle {cycle + 1} step {number + 1} {kind}')
+                        print(timing.summary())
+        finally:
+            timing.enable(was_enabled)
+            self.close()
+
+    def close(self):
+        # Outstanding analyses still store their results through the writer
+        if self._analysis is not None:
+            self._analysis.close()
+            self._analysis = None
+        for lapse in self._lapses.values():
+            lapse.close()
+        self._lapses = {}
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        for device in (self._probe, self._lctf, self._cmos):
+            if device is not None:
+                device.close()
+        self._probe = self._lctf = self._cmos = None
+
+    def _run_record_do(self, step, cycle):
+        if self.dry_run:
+            print(f'  Would record DO for {step["sample"]["sample_name"]!r}')
+            return
+        sample_id, count = record_study(self.probe, self.writer, step['sample'], timeout=step.get('timeout', 10),
+                                        duration=step.get('duration'))
+        self.writer.flush()
+        print(f'  Recorded {count} readings as study {sample_id}.')
+
+    def _plan(self, step, sample_type):
+        reorder = step.get('reorder', True)
+        if self.dry_run:
+            # Plan from the protocol and the saved exposure table only; no device is opened (or the filter woken)
+            camera = self.protocol.get('camera', {})
+            wavelengths, exposures = dry_run_bands(self.study_db, step.get('wavelengths'), step.get('exposures'),
+                                                   step.get('auto_exposure', False), sample_type,
+                                                   camera.get('binning', 1),
+                                                   camera.get('exposure_time', DRY_RUN_EXPOSURE))
+            plan = AcquisitionPlan(wavelengths, exposures, reorder=reorder)
+            plan.dry_run()
+            return plan
+
+        # Only open the devices the plan actually has to ask or search
+        search = step.get('auto_exposure', False) and step.get('exposures') is None
+        cmos = self.cmos if step.get('exposures') is None else None
+        lctf = self.lctf if step.get('wavelengths') is None or search else None
+        wavelengths, exposures, found, levels = resolve_bands(cmos, lctf, self.study_db, step.get('wavelengths'),
+                                                              step.get('exposures'), search, sample_type)
+        if found:
+            save_exposure_table(self.writer, sample_type, self.cmos.binning, found, levels)
+        return AcquisitionPlan(wavelengths, exposures, reorder=reorder)
+
+    def _run_capture(self, step, cycle):
+        study_name = step['study_name']
+        plan = self._plan(step, step.get('sample_type', study_name))
+        if self.dry_run:
+            return
+        create_stack_tables(self.writer, study_name)
+
+        repeats, interval = step.get('repeats', 1), step.get('interval', 0)
+        lapse = self.lapse(step, plan)
+        for k in range(repeats):
+            start = time.monotonic()
+            image_name = None if lapse is not None else numbered(step['image'], cycle * repeats + k,
+                                                                 repeats * self.protocol.get('repeat', 1))
+            trace = capture_stack(self.lctf, self.cmos, self.writer, study_name, image_name, plan,
+                                  analysis=self.analysis if step.get('analyze') else None,
+                                  calibration=self.calibration, lapse=lapse)
+            print(f'  {image_name or step["container"]}: {trace.stack_time:.2f} s')
+            if k + 1 < repeats:
+                time.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+    def _run_synchronized(self, step, cycle):
+        from controllers.sync import SynchronizedRun
+
+        plan = self._plan(step, step.get('sample_type', step['sample']['sample_name']))
+        if self.dry_run:
+            return
+        sample = step['sample']
+        sample_id = self.writer.execute(INSERT_STUDY, study_params(sample))
+        run = SynchronizedRun(self.probe, self.lctf, self.cmos, self.writer, sample['sample_name'], sample_id,
+                              do_timeout=step.get('timeout', 10),
+                              analysis=self.analysis if step.get('analyze') else None,
+                              calibration=self.calibration, lapse=self.lapse(step, plan))
+        run.start()
+        try:
+            image_base = os.path.splitext(step.get('image', ''))[0]
+            if self.protocol.get('repeat', 1) > 1:
+                image_base = f'{image_base}_cycle{cycle:03d}'
+            count = run.run(image_base, plan.wavelengths, plan.exposures, n_stacks=step.get('n_stacks'),
+                            interval=step.get('interval', 0), plan=plan)
+        finally:
+            run.stop()
+        print(f'  Captured {count} synchronized stacks for study {sample_id}.')
+
+    def _run_darks(self, step, cycle):
+        from controllers.calibration import measure_darks
+
+        if self.calibration is None:
+            raise ValueError('A darks step needs a calibration directory in the protocol.')
+        if self.dry_run:
+            print(f'  Would measure darks at {step["exposures"]} s')
+            return
+        measure_darks(self.cmos, self.calibration, step['exposures'], step.get('nb_frames', 32))
+
+    def _run_flats(self, step, cycle):
+        from controllers.calibration import measure_flats
+
+        if self.calibration is None:
+            raise ValueError('A flats step needs a calibration directory in the protocol.')
+        if self.dry_run:
+            print(f'  Would measure flats at {step["wavelengths"]} nm')
+            return
+        measure_flats(self.cmos, self.lctf, self.calibration, step['wavelengths'], step['exposures'],
+                      step.get('nb_frames', 32))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run an acquisition protocol without the GUI.')
+    parser.add_argument('protocol', help='Protocol file (.toml or .json)')
+    parser.add_argument('--dry-run', action='store_true', help='Print the plan and predicted stack times only')
+    parser.add_argument('--timing', action='store_true', default=None,
+                        help='Record per-stage latencies (overrides the protocol)')
+    options = parser.parse_args(args)
+    Runner(load_protocol(options.protocol), dry_run=options.dry_run, timings=options.timing).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+import argparse
+import sqlite3
+
+from controllers.oxygen import DEFAULT_MODEL
+
+# SQL expression converting a CURRENT_TIMESTAMP string to epoch seconds (text timestamps carry at most ms)
+EPOCH_FROM_TIME = 'round((julianday({time}) - 2440587.5) * 86400.0, 3)'
+
+# Study metadata fields in INSERT_STUDY parameter order, with the value used when a protocol leaves one out
+STUDY_FIELDS = {
+    'sample_name': None,
+    'solvent': 'water',
+    'hemoglobin_concentration_mg_mL': 0.0,
+    'microsphere_concentration_uL_mL': 0.0,
+    'yeast_stock_added_uL_mL': 0.0,
+    'yeast_concentration_mg_mL': 0.0,
+}
+
+# Statements shared by every routine that records DO studies
+INSERT_STUDY = '''
+    INSERT INTO dissolved_oxygen_study_table (
+        start_time, sample_name, solvent, hemoglobin_concentration_mg_mL,
+        microsphere_concentration_uL_mL, yeast_stock_added_uL_mL, yeast_concentration_mg_mL
+    ) VALUES (CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_DO_RECORD = '''
+    INSERT INTO dissolved_oxygen_records (
+        sample_name, sample_id, time, epoch_time, dissolved_oxygen, nanoamperes, temperature
+    ) VALUES (?, ?, CURRENT_TIMESTAMP, ?, ?, ?, ?)
+'''
+
+
+def _create_do_tables(conn):
+    """Version 1: shared study and record tables (the layout migration.ipynb used to build by hand)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dissolved_oxygen_study_table (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sample_name TEXT NOT NULL,
+            solvent TEXT DEFAULT 'water',
+            hemoglobin_concentration_mg_mL REAL DEFAULT NULL,
+            microsphere_concentration_uL_mL REAL DEFAULT NULL,
+            yeast_stock_added_uL_mL REAL DEFAULT NULL,
+            yeast_concentration_mg_mL REAL DEFAULT NULL,
+            UNIQUE(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dissolved_oxygen_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sample_name TEXT NOT NULL,
+            sample_id INTEGER NOT NULL,
+            time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            dissolved_oxygen REAL DEFAULT NULL,
+            nanoamperes REAL DEFAULT NULL,
+            temperature REAL DEFAULT NULL,
+            FOREIGN KEY(sample_name, sample_id) REFERENCES dissolved_oxygen_study_table(sample_name, id)
+        )
+    ''')
+
+
+def _add_epoch_time(conn):
+    """Version 2: numeric epoch_time column backfilled from the text timestamps, and a (sample_id, epoch_time) index."""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(dissolved_oxygen_records)')]
+    if 'epoch_time' not in columns:
+        conn.execute('ALTER TABLE dissolved_oxygen_records ADD COLUMN epoch_time REAL DEFAULT NULL')
+    conn.execute(f'''
+        UPDATE dissolved_oxygen_records SET epoch_time = {EPOCH_FROM_TIME.format(time='time')}
+        WHERE epoch_time IS NULL AND time IS NOT NULL
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS dissolved_oxygen_records_sample_time
+        ON dissolved_oxygen_records (sample_id, epoch_time)
+    ''')
+    # Writers that still only fill the text column get a numeric time as well
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS dissolved_oxygen_records_fill_epoch_time
+        AFTER INSERT ON dissolved_oxygen_records
+        WHEN NEW.epoch_time IS NULL AND NEW.time IS NOT NULL
+        BEGIN
+            UPDATE dissolved_oxygen_records SET epoch_time = {EPOCH_FROM_TIME.format(time='NEW.time')}
+            WHERE id = NEW.id;
+        END
+    ''')
+
+
+def _create_exposure_table(conn):
+    """Version 3: auto-exposure results per wavelength, keyed by sample type and binning."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS exposure_table (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sample_type TEXT NOT NULL,
+            binning INTEGER NOT NULL,
+            wavelength REAL NOT NULL,
+            exposure_time REAL NOT NULL,
+            signal_level REAL DEFAULT NULL,
+            updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(sample_type, binning, wavelength)
+        )
+    ''')
+
+
+def _create_synchronized_bands(conn):
+    """Version 4: oxygenation at the capture time of every band of a synchronized measurement."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS synchronized_band_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sample_id INTEGER NOT NULL,
+            image_name TEXT NOT NULL,
+            band INTEGER NOT NULL,
+            wavelength REAL NOT NULL,
+            exposure_time REAL NOT NULL,
+            epoch_time REAL NOT NULL,
+            dissolved_oxygen REAL DEFAULT NULL,
+            temperature REAL DEFAULT NULL,
+            po2 REAL DEFAULT NULL,
+            so2 REAL DEFAULT NULL,
+            FOREIGN KEY(sample_id) REFERENCES dissolved_oxygen_study_table(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS synchronized_band_records_sample_time
+        ON synchronized_band_records (sample_id, epoch_time)
+    ''')
+
+
+# Rollup bucket widths in seconds, finest first
+ROLLUP_RESOLUTIONS = (10, 60, 600)
+
+# min/max/sum columns kept per bucket, and the SQL expression each one summarizes (for a row alias)
+ROLLUP_COLUMNS = {
+    'do': '{row}.dissolved_oxygen',
+    'temperature': '{row}.temperature',
+    'po2': f'{{row}}.dissolved_oxygen * ({{row}}.temperature + 273.15) * {DEFAULT_MODEL.scale!r}',
+}
+
+
+def _create_rollups(conn):
+    """
+    Version 5: per-sample min/mean/max of DO, temperature and pO2 over 10 s, 1 min and 10 min buckets.
+
+    A trigger folds every inserted reading into its bucket at each resolution, so the rollups stay current during a
+    recording; existing readings are rolled up once here. pO2 uses the default OxygenModel constants.
+    """
+    columns = ', '.join(f'{name}_min REAL, {name}_max REAL, {name}_sum REAL' for name in ROLLUP_COLUMNS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS dissolved_oxygen_rollups (
+            sample_id INTEGER NOT NULL,
+            resolution INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            {columns},
+            PRIMARY KEY (sample_id, resolution, bucket)
+        ) WITHOUT ROWID
+    ''')
+
+    names = ', '.join(f'{name}_min, {name}_max, {name}_sum' for name in ROLLUP_COLUMNS)
+    epoch = f"coalesce(NEW.epoch_time, {EPOCH_FROM_TIME.format(time='NEW.time')})"
+    upserts = []
+    for resolution in ROLLUP_RESOLUTIONS:
+        values = ', '.join(', '.join([expr.format(row='NEW')] * 3) for expr in ROLLUP_COLUMNS.values())
+        updates = ', '.join(f'{name}_min = min({name}_min, excluded.{name}_min), '
+                            f'{name}_max = max({name}_max, excluded.{name}_max), '
+                            f'{name}_sum = {name}_sum + excluded.{name}_sum' for name in ROLLUP_COLUMNS)
+        upserts.append(f'''
+            INSERT INTO dissolved_oxygen_rollups (sample_id, resolution, bucket, n, {names})
+            SELECT NEW.sample_id, {resolution}, CAST({epoch} / {resolution} AS INTEGER) * {resolution}, 1, {values}
+            WHERE 1
+            ON CONFLICT (sample_id, resolution, bucket) DO UPDATE SET n = n + 1, {updates};
+        ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS dissolved_oxygen_records_rollup
+        AFTER INSERT ON dissolved_oxygen_records
+        WHEN NEW.dissolved_oxygen IS NOT NULL AND NEW.temperature IS NOT NULL
+        BEGIN
+            {''.join(upserts)}
+        END
+    ''')
+
+    # Roll up what is already recorded
+    aggregates = ', '.join(f'min({expr}), max({expr}), sum({expr})'
+                           for expr in (e.format(row='r') for e in ROLLUP_COLUMNS.values()))
+    for resolution in ROLLUP_RESOLUTIONS:
+        conn.execute(f'''
+            INSERT OR REPLACE INTO dissolved_oxygen_rollups (sample_id, resolution, bucket, n, {names})
+            SELECT r.sample_id, {resolution}, CAST(r.epoch_time / {resolution} AS INTEGER) * {resolution}, count(*),
+                   {aggregates}
+            FROM dissolved_oxygen_records AS r
+            WHERE r.epoch_time IS NOT NULL AND r.dissolved_oxygen IS NOT NULL AND r.temperature IS NOT NULL
+            GROUP BY r.sample_id, CAST(r.epoch_time / {resolution} AS INTEGER)
+        ''')
+
+
+def _create_performance_stages(conn):
+    """Version 6: per-stage latency summary (see controllers.timing) written at the end of each run."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS performance_stages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            total_s REAL NOT NULL,
+            mean_s REAL NOT NULL,
+            p50_s REAL NOT NULL,
+            p95_s REAL NOT NULL,
+            max_s REAL NOT NULL,
+            epoch_time REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS performance_stages_run ON performance_stages (run, stage)')
+
+
+def _create_stack_analysis(conn):
+    """Version 7: summary statistics of the sO2 and tHb maps unmixed from each stack (see controllers.unmixing)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stack_analysis (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            study_name TEXT,
+            image_name TEXT NOT NULL,
+            wavelengths TEXT NOT NULL,
+            pixels INTEGER NOT NULL,
+            so2_mean REAL,
+            so2_median REAL,
+            so2_std REAL,
+            thb_mean REAL,
+            thb_median REAL,
+            thb_std REAL,
+            so2_path TEXT NOT NULL,
+            thb_path TEXT NOT NULL,
+            analysis_s REAL NOT NULL,
+            epoch_time REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS stack_analysis_image ON stack_analysis (image_name)')
+
+
+# Ordered schema upgrades; the database's user_version is the number of migrations applied
+MIGRATIONS = [
+    _create_do_tables,
+    _add_epoch_time,
+    _create_exposure_table,
+    _create_synchronized_bands,
+    _create_rollups,
+    _create_performance_stages,
+    _create_stack_analysis,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(study_db, target=SCHEMA_VERSION):
+    """
+    Bring a study database up to the target schema version and return the version it started at.
+
+    Accepts a path or an open connection. Each migration runs in its own transaction together with its user_version
+    bump, so an interrupted upgrade can simply be re-run. If the connection already has a transaction open, each
+    migration runs in a savepoint within it instead and committing is left to the caller.
+    """
+    conn = sqlite3.connect(study_db) if isinstance(study_db, str) else study_db
+    try:
+        start = version = schema_version(conn)
+        if version > len(MIGRATIONS):
+            raise ValueError(f'Database schema version {version} is newer than this software ({len(MIGRATIONS)}).')
+
+        nested = conn.in_transaction
+        while version < target:
+            conn.execute('SAVEPOINT migration' if nested else 'BEGIN')
+            try:
+                MIGRATIONS[version](conn)
+                conn.execute(f'PRAGMA user_version = {version + 1}')
+                if nested:
+                    conn.execute('RELEASE migration')
+                else:
+                    conn.commit()
+            except Exception:
+                if nested:
+                    conn.execute('ROLLBACK TO migration')
+                    conn.execute('RELEASE migration')
+                else:
+                    conn.rollback()
+                raise
+            version += 1
+        return start
+    finally:
+        if isinstance(study_db, str):
+            conn.close()
+
+
+# Columns every per-sample table of the original layout has
+LEGACY_DO_COLUMNS = {'time', 'dissolved_oxygen', 'nanoamperes', 'temperature'}
+
+
+def _quote(name):
+    """SQL identifier for a table name, which may hold spaces or hyphens (legacy tables are named after samples)."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _is_legacy_do_table(conn, table):
+    """True if table has the columns of a per-sample DO table of the original layout."""
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({_quote(table)})')}
+    return LEGACY_DO_COLUMNS <= columns
+
+
+def import_legacy_tables(conn, get_metadata, drop=False):
+    """
+    Move per-sample DO tables from the original layout into dissolved_oxygen_records.
+
+    get_metadata is called with each legacy table name and must return the study metadata dict (the same fields
+    get_metadata_from_user returns), or None to leave that table alone. Legacy tables are only dropped when drop is
+    True.
+    """
+    migrate(conn)
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+              if row[0] != 'dissolved_oxygen_records' and _is_legacy_do_table(conn, row[0])]
+
+    for table in tables:
+        metadata = get_metadata(table)
+        if metadata is None:
+            continue
+        cursor = conn.execute('''
+            INSERT INTO dissolved_oxygen_study_table
+            (sample_name, solvent, hemoglobin_concentration_mg_mL, microsphere_concentration_uL_mL,
+            yeast_stock_added_uL_mL, yeast_concentration_mg_mL)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (metadata["sample_name"], metadata["solvent"], metadata["hemoglobin_concentration_mg_mL"],
+              metadata["microsphere_concentration_uL_mL"], metadata["yeast_stock_added_uL_mL"],
+              metadata["yeast_concentration_mg_mL"]))
+        sample_id = cursor.lastrowid
+
+        # Copy in one statement instead of row by row
+        cursor = conn.execute(f'''
+            INSERT INTO dissolved_oxygen_records
+            (sample_name, sample_id, time, epoch_time, dissolved_oxygen, nanoamperes, temperature)
+            SELECT ?, ?, time, {EPOCH_FROM_TIME.format(time='time')}, dissolved_oxygen, nanoamperes, temperature
+            FROM {_quote(table)}
+        ''', (metadata["sample_name"], sample_id))
+        if drop:
+            conn.execute(f'DROP TABLE {_quote(table)}')
+        conn.commit()
+        print(f'Migrated {cursor.rowcount} records from {table}.')
+    return tables
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Upgrade a study database to the current schema.')
+    parser.add_argument('study_db', help='Path to the SQLite study database')
+    parser.add_argument('--check', action='store_true', help='Only report the schema version')
+    options = parser.parse_args(args)
+
+    conn = sqlite3.connect(options.study_db)
+    try:
+        version = schema_version(conn)
+        if options.check or version == SCHEMA_VERSION:
+            print(f'{options.study_db}: schema version {version} (current is {SCHEMA_VERSION})')
+            return
+        migrate(conn)
+        print(f'{options.study_db}: upgraded schema from version {version} to {SCHEMA_VERSION}')
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
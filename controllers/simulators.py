@@ -0,0 +1,702 @@
+import abc
+import ctypes
+import enum
+import math
+import socket
+import threading
+import time
+
+import numpy as np
+
+
+class _SocketLink:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def send(self, data):
+        self.conn.sendall(data)
+
+    def receive(self, timeout):
+        self.conn.settimeout(timeout)
+        try:
+            data = self.conn.recv(4096)
+        except socket.timeout:
+            return b''
+        if not data:
+            raise ConnectionError('Client disconnected.')
+        return data
+
+
+class _PortLink:
+    def __init__(self, port):
+        self.port = port
+
+    def send(self, data):
+        self.port.write(data)
+
+    def receive(self, timeout):
+        self.port.timeout = timeout
+        return self.port.read(max(self.port.in_waiting, 1))
+
+
+class SerialSimulator(abc.ABC):
+    """
+    Base for instruments simulated behind a pyserial URL.
+
+    start() listens on a localhost TCP port and serves one client at a time on a background thread; open the device
+    with the returned url (socket://127.0.0.1:<port>), e.g. DOProbe(simulator.url) or LCTF(simulator.url). attach(port)
+    instead drives an already open port object, such as a pyserial loop:// port whose writes come back as reads; that
+    only suits instruments that never answer commands (the DO probe). Subclasses implement serve(link).
+    """
+
+    def __init__(self):
+        self.url = None
+        self._server = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def __enter__(self):
+        if self._thread is None:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def start(self, port=0):
+        """Serve on a localhost TCP port (0 picks a free one) and return its socket:// URL."""
+        self._server = socket.create_server(('127.0.0.1', port))
+        self._server.settimeout(0.1)
+        self.url = f'socket://127.0.0.1:{self._server.getsockname()[1]}'
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def attach(self, port):
+        """Serve an open serial-like port on a background thread instead of a TCP client."""
+        self._thread = threading.Thread(target=self._serve, args=(_PortLink(port),), daemon=True)
+        self._thread.start()
+        return port
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    @abc.abstractmethod
+    def serve(self, link):
+        """Talk to one client over link (send(data), receive(timeout)) until it disconnects or stop() is called."""
+
+    def _accept(self):
+        while not self.stopped:
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Replies are a few bytes each
+            with conn:
+                self._serve(_SocketLink(conn))
+
+    def _serve(self, link):
+        try:
+            self.serve(link)
+        except (ConnectionError, OSError):
+            pass  # The client closed the port
+
+
+class DOProbeSimulator(SerialSimulator):
+    """
+    A DO probe streaming ';'-delimited lines, with DO decaying exponentially from dissolved_oxygen to final.
+
+    Lines are sent at rate per second (0 sends as fast as the link takes them, to find the throughput limit) and
+    carry the DO (mg/L), current (nA) and temperature (C) at the field positions DOFramer parses, plus Gaussian
+    noise. After count lines (if given) the probe stays connected but silent, as the real one does when a study
+    ends, so a DOReader times out. Streaming starts startup seconds after a client connects, since opening a port
+    discards whatever has already arrived.
+    """
+
+    def __init__(self, rate=1.0, count=None, dissolved_oxygen=8.0, final=2.0, time_constant=600.0, temperature=25.0,
+                 noise=0.02, nanoamperes_per_mg_L=6.0, startup=0.05, seed=None):
+        super().__init__()
+        self.rate = rate
+        self.count = count
+        self.startup = startup
+        self.dissolved_oxygen = dissolved_oxygen
+        self.final = final
+        self.time_constant = time_constant  # Seconds of simulated time
+        self.temperature = temperature
+        self.noise = noise
+        self.nanoamperes_per_mg_L = nanoamperes_per_mg_L
+        self.sent = 0  # Lines sent so far
+        self._rng = np.random.default_rng(seed)
+
+    def line(self, index, elapsed):
+        """The bytes of reading number index, taken elapsed seconds into the run."""
+        do = self.final + (self.dissolved_oxygen - self.final) * math.exp(-elapsed / self.time_constant)
+        do += self.noise * self._rng.standard_normal()
+        temperature = self.temperature + 0.05 * self._rng.standard_normal()
+        stamp = time.localtime()
+        return (f'{time.strftime("%d.%m.%Y;%H:%M:%S", stamp)};{index};OXY-1;Ch1;DO;Sensor OK;mg/L;{do:.3f};nA;'
+                f'{do * self.nanoamperes_per_mg_L:.2f};C;{temperature:.2f};\r\n').encode()
+
+    def serve(self, link):
+        self._stop_event.wait(self.startup)
+        start = time.monotonic()
+        first = self.sent
+        while not self.stopped and (self.count is None or self.sent < self.count):
+            elapsed = time.monotonic() - start
+            # Send every line that is due in one write, so high rates are not limited by sleep granularity
+            due = first + int(elapsed * self.rate) + 1 if self.rate else self.sent + 1000
+            if self.count is not None:
+                due = min(due, self.count)
+            if due > self.sent:
+                link.send(b''.join(self.line(k, elapsed) for k in range(self.sent, due)))
+                self.sent = due
+            elif self.rate:
+                self._stop_event.wait((self.sent - first) / self.rate - elapsed)
+        self._stop_event.wait()  # Silent but still connected
+
+
+class LCTFSimulator(SerialSimulator):
+    """
+    A VariSpec LCTF speaking the CR-terminated command protocol the LCTF driver uses.
+
+    Every command is echoed. 'A' wakes the filter (other commands fail with '*' until it is awake), 'A ?' answers
+    'a     0', 'R 1' clears errors, 'W <nm>' starts tuning and 'W ?' answers 'W <nm>' once the filter has settled,
+    settle + settle_per_nm * |change| seconds after the tune command. Wavelengths outside the tuning range fail.
+    """
+
+    def __init__(self, wavelength=500.0, settle=0.01, settle_per_nm=2e-4, tuning_range=(400.0, 720.0), awake=False):
+        super().__init__()
+        self.wavelength = wavelength
+        self.settle = settle
+        self.settle_per_nm = settle_per_nm
+        self.tuning_range = tuning_range
+        self.awake = awake
+        self.commands = 0
+        self.tunes = 0
+        self._settled = 0.0  # time.monotonic() when the current tune completes
+
+    def serve(self, link):
+        received = bytearray()
+        while not self.stopped:
+            received += link.receive(0.1)
+            while b'\r' in received:
+                end = received.index(b'\r')
+                command = received[:end].decode(errors='ignore').strip()
+                del received[:end + 1]
+                if command:
+                    link.send(''.join(line + '\r' for line in self.respond(command)).encode())
+
+    def respond(self, command):
+        """Lines the filter sends back for one command."""
+        self.commands += 1
+        lines = [command]
+        if command == 'A':
+            self.awake = True
+        elif not self.awake:
+            lines.append('*')
+        elif command == 'A ?':
+            lines.append('a     0')
+        elif command == 'R 1':
+            pass
+        elif command == 'W ?':
+            # The answer only comes once the filter has settled
+            self._stop_event.wait(max(0.0, self._settled - time.monotonic()))
+            lines.append(f'W {self.wavelength:.3f}')
+        elif command.startswith('W '):
+            try:
+                wavelength = float(command.split()[1])
+            except ValueError:
+                wavelength = math.nan
+            if not self.tuning_range[0] <= wavelength <= self.tuning_range[1]:
+                lines.append('*')
+            else:
+                delay = self.settle + self.settle_per_nm * abs(wavelength - self.wavelength)
+                self._settled = max(self._settled, time.monotonic()) + delay
+                self.wavelength = wavelength
+                self.tunes += 1
+        else:
+            lines.append('*')
+        return lines
+
+
+class EWaitEvent(enum.IntFlag):
+    # Same values as hamamatsu.dcam.EWaitEvent
+    CAP_TRANSFERRED = 0x0001
+    CAP_FRAMEREADY = 0x0002
+    CAP_CYCLEEND = 0x0004
+    CAP_EXPOSUREEND = 0x0008
+    CAP_STOPPED = 0x0010
+
+
+class EImagePixelType(enum.IntEnum):
+    MONO8 = 0x00000001
+    MONO16 = 0x00000002
+
+    def bytes_per_pixel(self):
+        return 1 if self is EImagePixelType.MONO8 else 2
+
+    def dtype(self):
+        return np.uint8 if self is EImagePixelType.MONO8 else np.uint16
+
+
+class Attribute(dict):
+    """A property's capability dict, as hamamatsu.dcam builds them ('uname', 'read', 'write', 'enum', ...)."""
+
+    def __getattr__(self, name):
+        return self[name]
+
+    @property
+    def value(self):
+        return self.read()
+
+
+class SimulatedFrame:
+    """The fields of a locked DCAM frame buffer that copy_frame and CMOS read."""
+    __slots__ = ('buf', 'type', 'width', 'height', 'iFrame')
+
+    def __init__(self, buf, type, width, height, index):
+        self.buf = buf
+        self.type = type
+        self.width = width
+        self.height = height
+        self.iFrame = index
+
+
+class TransferInfo:
+    __slots__ = ('nFrameCount', 'nNewestFrameIndex')
+
+    def __init__(self, count, newest):
+        self.nFrameCount = count
+        self.nNewestFrameIndex = newest
+
+
+class SimulatedCamera:
+    """
+    Stand-in for a hamamatsu.dcam Device producing synthetic 16-bit frames.
+
+    Supports the properties CMOS and CameraProperties use (exposure_time, binning, subarray_*, trigger_source,
+    image_width, image_height) and the buffer, capture and wait calls of the DCAM bindings. Each frame integrates
+    for exposure_time, signals CAP_EXPOSUREEND, then takes 1 / fps to read out before CAP_FRAMEREADY; in sequence
+    mode the next exposure overlaps the readout, so frames arrive at min(fps, 1 / exposure_time) per second.
+    Frames are a fixed illumination pattern scaled to brightness * exposure_time counts at the peak (brightness may
+    be a callable, e.g. following a simulated LCTF's wavelength) on top of offset and read noise, clipped at 65535.
+    """
+
+    def __init__(self, width=2048, height=2048, fps=100.0, brightness=1e6, offset=100, read_noise=2.0, seed=0):
+        self.sensor = (width, height)
+        self.fps = fps
+        self.brightness = brightness  # Peak counts per second of exposure, or a callable returning it
+        self.offset = offset
+        self.read_noise = read_noise
+        self.capabilities = {}
+        self._values = {}
+        self._open = False
+        self._rng = np.random.default_rng(seed)
+        self._patterns = {}  # Image shape -> (illumination pattern, noise frames)
+        self._signal = (None, None)  # (shape, level) -> last scaled signal image
+
+        self._cond = threading.Condition()
+        self._buffers = None
+        self._running = False
+        self._thread = None
+        self._frame_count = 0  # Frames of the current acquisition
+        self._events = []  # (sequence number, EWaitEvent), trimmed as it grows
+        self._event_base = 0
+        self._waiters = {}  # Wait handle -> aborted
+        self._next_handle = 1
+
+        self._add('exposure_time', 0.01, 1e-4, 10.0)
+        self._add('binning', 1, 1, 4, enum={'1x1': 1, '2x2': 2, '4x4': 4})
+        self._add('subarray_mode', 1, 1, 2, enum={'OFF': 1, 'ON': 2})
+        self._add('subarray_hpos', 0, 0, width - 4, step=4)
+        self._add('subarray_hsize', width, 4, width, step=4)
+        self._add('subarray_vpos', 0, 0, height - 4, step=4)
+        self._add('subarray_vsize', height, 4, height, step=4)
+        self._add('trigger_source', 1, 1, 3, enum={'INTERNAL': 1, 'EXTERNAL': 2, 'SOFTWARE': 3})
+        self._add('image_width', width, 1, width, writable=False)
+        self._add('image_height', height, 1, height, writable=False)
+        self._add('image_pixeltype', int(EImagePixelType.MONO16), 1, 2, writable=False)
+
+    def _add(self, uname, value, min_value, max_value, step=None, enum=None, writable=True):
+        values = self._values
+        values[uname] = value
+
+        def read():
+            return values[uname]
+
+        def write(new):
+            if not writable:
+                raise ValueError(f'{uname} is read-only.')
+            if self._running and uname != 'exposure_time':
+                raise RuntimeError(f'Cannot write {uname} while capturing.')  # It would change the frame size
+            if enum is not None and int(new) not in enum.values():
+                raise ValueError(f'Invalid value {new!r} for {uname}.')
+            new = min(max(new, min_value), max_value)
+            if step:
+                new = min_value + round((new - min_value) / step) * step
+            values[uname] = type(value)(new)
+            self._update_image_size()
+            return values[uname]
+
+        attribute = Attribute(name=uname.replace('_', ' ').upper(), uname=uname, min_value=min_value,
+                              max_value=max_value, step_value=step or 0, default_value=value, read=read, write=write)
+        if enum is not None:
+            attribute['enum'] = dict(enum)
+            attribute['enum_values'] = {v: k for k, v in enum.items()}
+        self.capabilities[uname] = attribute
+
+    def _update_image_size(self):
+        values = self._values
+        width, height = self.sensor
+        if values['subarray_mode'] == 2:
+            width, height = values['subarray_hsize'], values['subarray_vsize']
+        values['image_width'] = width // values['binning']
+        values['image_height'] = height // values['binning']
+
+    # Device interface
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def is_open(self):
+        return self._open
+
+    def open(self):
+        self._open = True
+
+    def close(self):
+        self.stop()
+        self._open = False
+
+    def __getitem__(self, name):
+        if name in self.capabilities:
+            return self.capabilities[name]
+        for capability in self.capabilities.values():
+            if capability['name'] == name:
+                return capability
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        return self[name].write(value)
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.capabilities)
+
+    def __iter__(self):
+        return iter(self.capabilities)
+
+    def values(self):
+        return self.capabilities.values()
+
+    def keys(self):
+        return self.capabilities.keys()
+
+    def items(self):
+        return self.capabilities.items()
+
+    @property
+    def shape(self):
+        """(height, width) of the frames at the current binning and subarray."""
+        return self._values['image_height'], self._values['image_width']
+
+    def _buf_alloc(self, nb_frames):
+        height, width = self.shape
+        self._buffers = np.zeros((nb_frames, height * width), dtype=np.uint16)
+
+    def _buf_release(self):
+        if self._running:
+            raise RuntimeError('Cannot release buffers while capturing.')
+        self._buffers = None
+
+    def _lock_frame_index(self, index):
+        height, width = self.shape
+        return SimulatedFrame(self._buffers[index].ctypes.data, int(EImagePixelType.MONO16), width, height, index)
+
+    def frame_stream(self, nb_frames):
+        for index in range(nb_frames):
+            yield self._lock_frame_index(index)
+
+    def transfer_stream(self):
+        while True:
+            with self._cond:
+                count = self._frame_count
+            yield TransferInfo(count, (count - 1) % len(self._buffers) if count else -1)
+
+    def _wait_open(self):
+        with self._cond:
+            handle = self._next_handle
+            self._next_handle += 1
+            self._waiters[handle] = [self._event_base + len(self._events), False]  # [cursor, aborted]
+        return handle
+
+    def _wait_abort(self, handle):
+        with self._cond:
+            if handle in self._waiters:
+                self._waiters[handle][1] = True
+            self._cond.notify_all()
+
+    def _wait_close(self, handle):
+        with self._cond:
+            self._waiters.pop(handle, None)
+
+    def event_stream(self, mask, timeout, handle):
+        """Yield the events in mask as they happen until the wait is aborted. Raises TimeoutError after timeout s."""
+        waiter = self._waiters[handle]
+        while True:
+            with self._cond:
+                while True:
+                    if waiter[1]:
+                        return
+                    cursor = waiter[0] - self._event_base
+                    pending = [event for _, event in self._events[max(cursor, 0):] if event & mask]
+                    waiter[0] = self._event_base + len(self._events)
+                    if pending:
+                        break
+                    if not self._cond.wait(timeout):
+                        raise TimeoutError('No camera event before the timeout.')
+            yield from pending
+
+    def start(self, live=False):
+        if self._buffers is None:
+            raise RuntimeError('Allocate buffers before starting a capture.')
+        if self._running:
+            raise RuntimeError('Capture already running.')
+        with self._cond:
+            self._running = True
+            self._frame_count = 0
+        self._thread = threading.Thread(target=self._acquire, args=(live,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+        self._thread = None
+
+    def _emit(self, event):
+        # Called with self._cond held
+        self._events.append((self._event_base + len(self._events), event))
+        if len(self._events) > 4096:
+            oldest = min([waiter[0] for waiter in self._waiters.values()] + [self._event_base + 2048])
+            drop = oldest - self._event_base
+            del self._events[:drop]
+            self._event_base += drop
+        self._cond.notify_all()
+
+    def _sleep_until(self, deadline):
+        # Returns False if the capture was stopped meanwhile
+        with self._cond:
+            while self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return True
+                self._cond.wait(remaining)
+        return False
+
+    def _acquire(self, live):
+        readout = 1 / self.fps
+        nb_buffers = len(self._buffers)
+        start = time.monotonic()
+        index = 0
+        try:
+            while live or index < nb_buffers:
+                exposure = self._values['exposure_time']
+                brightness = self.brightness() if callable(self.brightness) else self.brightness
+                exposure_end = start + exposure
+                if not self._sleep_until(exposure_end):
+                    break
+                with self._cond:
+                    self._emit(EWaitEvent.CAP_EXPOSUREEND)
+
+                ready = exposure_end + readout
+                self._render(index % nb_buffers, brightness * exposure)
+                if not self._sleep_until(ready):
+                    break
+                with self._cond:
+                    self._frame_count += 1
+                    self._emit(EWaitEvent.CAP_FRAMEREADY)
+                index += 1
+                # The next exposure overlaps this readout, but the sensor cannot deliver frames faster than fps
+                start = max(exposure_end, ready - self._values['exposure_time'])
+        finally:
+            with self._cond:
+                self._running = False
+                self._emit(EWaitEvent.CAP_STOPPED)
+
+    def _render(self, slot, level):
+        shape = self.shape
+        if shape not in self._patterns:
+            height, width = shape
+            y, x = np.ogrid[-1:1:height * 1j, -1:1:width * 1j]
+            # A vignetted field with some texture so frames are not flat
+            pattern = np.exp(-(x ** 2 + y ** 2)) * (0.8 + 0.2 * np.sin(12 * x) * np.cos(9 * y))
+            noise = self._rng.normal(self.offset, self.read_noise, (4,) + shape).clip(0, 65535).astype(np.uint16)
+            self._patterns[shape] = (pattern.astype(np.float32), noise)
+        pattern, noise = self._patterns[shape]
+
+        key, signal = self._signal
+        if key != (shape, level):
+            headroom = 65535 - int(noise.max())
+            signal = np.minimum(pattern * level, headroom).astype(np.uint16)
+            self._signal = ((shape, level), signal)
+        frame = self._buffers[slot].reshape(shape)
+        np.add(signal, noise[slot % len(noise)], out=frame)
+
+
+def copy_frame(frame, into=None):
+    """Copy a locked frame buffer into a new (width, height) array, as hamamatsu.dcam.copy_frame does."""
+    pixel_type = EImagePixelType(frame.type)
+    if into is None:
+        into = np.empty(frame.width * frame.height * pixel_type.bytes_per_pixel(), dtype=np.uint8)
+    ctypes.memmove(into.ctypes.data, frame.buf, into.nbytes)
+    into.dtype = pixel_type.dtype()
+    into.shape = frame.width, frame.height
+    return into
+
+
+class FrameStream:
+    def __init__(self, device, nb_frames):
+        self.device = device
+        self.nb_frames = nb_frames
+        self.device._buf_alloc(nb_frames)
+        self.stream = device.frame_stream(nb_frames)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.device._buf_release()
+
+    def __len__(self):
+        return self.nb_frames
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.stream)
+
+
+class EventStream:
+    DefaultMask = EWaitEvent.CAP_FRAMEREADY | EWaitEvent.CAP_STOPPED
+
+    def __init__(self, device, mask=DefaultMask, timeout=None):
+        self.device = device
+        self.mask = mask
+        self._handle = device._wait_open()
+        self.stream = device.event_stream(mask, timeout, self._handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.stream)
+
+    def abort(self):
+        if self._handle is not None:
+            self.device._wait_abort(self._handle)
+
+    def close(self):
+        if self._handle is not None:
+            self.abort()
+            self.device._wait_close(self._handle)
+            self._handle = None
+
+
+class Stream:
+    """Frames of a capture as they become ready, like hamamatsu.dcam.Stream."""
+
+    def __init__(self, device, nb_frames):
+        self.device = device
+        self.nb_frames = nb_frames
+        self.frame_stream = FrameStream(device, nb_frames)
+        self.event_stream = EventStream(device)
+        self.stream = self._frames(device.transfer_stream())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        self.event_stream.close()
+        self.frame_stream.__exit__(None, None, None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.stream)
+
+    def _frames(self, transfers):
+        last = -1
+        for event in self.event_stream:
+            if event & EWaitEvent.CAP_STOPPED:
+                break
+            if event & EWaitEvent.CAP_FRAMEREADY:
+                newest = next(transfers).nNewestFrameIndex
+                while newest > last:
+                    yield next(self.frame_stream)
+                    last += 1
+
+
+class SimulatedDCAM:
+    """
+    Stand-in for the hamamatsu.dcam module, for CMOS(sdk=SimulatedDCAM(...)) on machines without a camera.
+
+    Holds one or more SimulatedCameras (indexed like dcam[0]) and the Stream/FrameStream/EventStream/copy_frame and
+    enum names CMOS takes from the SDK.
+    """
+    EWaitEvent = EWaitEvent
+    EImagePixelType = EImagePixelType
+    Stream = Stream
+    FrameStream = FrameStream
+    EventStream = EventStream
+    copy_frame = staticmethod(copy_frame)
+
+    def __init__(self, *cameras):
+        self.cameras = list(cameras) or [SimulatedCamera()]
+        self.dcam = self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+    def __getitem__(self, index):
+        return self.cameras[index]
+
+    def __len__(self):
+        return len(self.cameras)
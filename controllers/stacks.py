@@ -0,0 +1,108 @@
+import json
+import os
+
+import numpy as np
+import tifffile
+
+from controllers import timing
+
+
+class StackWriter:
+    """
+    Writes a hyperspectral stack to disk one plane at a time, as each band is captured.
+
+    The stack is a BigTIFF memory-mapped file preallocated for every planned band on the first write, so each plane
+    goes straight from the camera frame to disk and peak memory stays at about one frame. The planned wavelength and
+    exposure of every plane are embedded in the TIFF description. Until close() is called a '<path>.partial.json'
+    sidecar lists the planes already written; if a run crashes, the file still holds every completed plane and
+    StackWriter.resume() can pick up where it stopped.
+    """
+
+    def __init__(self, path, wavelengths, exposures, metadata=None):
+        if len(wavelengths) != len(exposures):
+            raise ValueError('Each plane needs one wavelength and one exposure.')
+        self.path = path
+        self.wavelengths = [float(lam) for lam in wavelengths]
+        self.exposures = [float(tau) for tau in exposures]
+        self.metadata = dict(metadata or {})
+        self.completed = []
+        self._stack = None
+
+    def __len__(self):
+        return len(self.wavelengths)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        # Only mark the stack complete if the capture finished without an error
+        self.close(complete=exc_type is None and self.complete)
+
+    @property
+    def partial_path(self):
+        return f'{self.path}.partial.json'
+
+    @property
+    def complete(self):
+        return len(self.completed) == len(self)
+
+    @property
+    def remaining(self):
+        """Indices of planes that have not been written yet."""
+        done = set(self.completed)
+        return [i for i in range(len(self)) if i not in done]
+
+    def write(self, index, frame):
+        """Write frame as plane index of the stack and record it as done."""
+        start = timing.start()
+        frame = np.asarray(frame)
+        if self._stack is None:
+            self._create(frame.shape, frame.dtype)
+        self._stack[index] = frame
+        self._stack.flush()
+        timing.stop('stack.write', start)
+        if index not in self.completed:
+            self.completed.append(index)
+        self._save_progress()
+
+    def close(self, complete=None):
+        """Flush the stack. The partial marker is removed only if every plane was written (or complete is True)."""
+        if self._stack is not None:
+            self._stack.flush()
+            self._stack = None  # Unmaps the file
+        complete = self.complete if complete is None else complete
+        if complete and os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+
+    @classmethod
+    def resume(cls, path):
+        """Reopen an incomplete stack written by a previous run."""
+        with open(f'{path}.partial.json') as f:
+            progress = json.load(f)
+        writer = cls(path, progress['wavelengths'], progress['exposures'], progress.get('metadata'))
+        writer.completed = progress['completed']
+        writer._stack = tifffile.memmap(path, mode='r+')
+        return writer
+
+    def _create(self, shape, dtype):
+        description = dict(self.metadata, wavelengths=self.wavelengths, exposures=self.exposures)
+        self._stack = tifffile.memmap(self.path, shape=(len(self),) + tuple(shape), dtype=dtype, bigtiff=True,
+                                      photometric='minisblack', metadata=dict(description, axes='ZYX'))
+        self._save_progress()
+
+    def _save_progress(self):
+        progress = {'wavelengths': self.wavelengths, 'exposures': self.exposures, 'metadata': self.metadata,
+                    'completed': self.completed}
+        tmp = f'{self.partial_path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(progress, f)
+        os.replace(tmp, self.partial_path)  # Atomic, so the marker is never half written
+
+
+def read_stack(path):
+    """Load a stack written by StackWriter with its per-plane wavelengths, exposures and completion state."""
+    with tifffile.TiffFile(path) as tif:
+        metadata = tif.shaped_metadata[0] if tif.shaped_metadata else {}
+        data = tif.asarray()
+    complete = not os.path.exists(f'{path}.partial.json')
+    return data, metadata, complete
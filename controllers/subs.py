@@ -1,4 +1,3 @@
-import datetime
 import tkinter as tk
 from tkinter import messagebox, filedialog, simpledialog
 import sqlite3
@@ -6,6 +5,8 @@ import sqlite3
 import numpy as np
 from serial.tools import list_ports
 
+from controllers import oxygen, history, timing
+
 
 def convert_time_to_seconds(time_str):
     """Convert time from MM:SS format to total seconds."""
@@ -16,85 +17,210 @@ def convert_time_to_seconds(time_str):
         return 0  # If the time is malformed, return 0
 
 
+def _format_oxygen_axes(ax, ax2):
+    # Left Y-axis (Dissolved Oxygen)
+    ax.set_xlabel('Time (Seconds)')
+    ax.set_ylabel('Oxygen Partial Pressure (mmHg)', color='b')
+    ax.tick_params(axis='y', labelcolor='b')
+    ax.set_ylim(0, 160)
+
+    ax2.set_xlabel('Time (Seconds)')
+    ax2.set_ylabel('Oxygen Saturation (%)', color='r')
+    ax2.set_ylim(0, 100)
+
+
 def update_plot(fig, ax, data_queue):
+    start = timing.start()
     if len(data_queue) > 0:
         ax.clear()
         ax2 = ax.twinx()
 
-        # Extract time, dissolved oxygen, and temperature from data_queue
-        # Calculate pO2 for each reading
-        Hcc = 3.2e-2
-        R = 8314  # LPaK-1mol-1
-        m = 31.999  # g/mol
-        t0 = datetime.datetime.strptime(data_queue[0][0], '%Y-%m-%d %H:%M:%S')
+        # Extract time, dissolved oxygen, and temperature from data_queue and convert them in one pass
         times, do, T = zip(*data_queue)
-        times = [datetime.datetime.strptime(t, '%Y-%m-%d %H:%M:%S') - t0 for t in times]
-        t = np.asarray([t.total_seconds() for t in times])
-        do = np.asarray(do) / 1000 / m  # mol/L
-        T = np.asarray(T) + 273.15  # K
-        kH = Hcc / (R * T)  # molL-1Pa-1
-        pO2 = 7.5 * (do / kH) / 1000  # mmHg
-
-        # Ensure data is sorted by time
-        sorted_data = sorted(zip(t, pO2), key=lambda x: x[0])
-        # Unpack sorted values
-        t, pO2 = zip(*sorted_data)
-        t = np.asarray(t)
-        pO2 = np.asarray(pO2)
-
-        h = 2.7
-        p50 = 27
-        sO2 = 100 * (pO2 ** h) / ((p50 ** h) + (pO2 ** h))
-
-        # Left Y-axis (Dissolved Oxygen)
-        ax.scatter(t, pO2, label='Oxygen Partial Pressure', color='b', marker='o')
-        ax.set_xlabel('Time (Seconds)')
-        ax.set_ylabel('Oxygen Partial Pressure (mmHg)', color='b')
-        ax.tick_params(axis='y', labelcolor='b')
-        ax.set_ylim(0, 160)
+        t, pO2, sO2 = oxygen.convert(times, do, T)
+        t, pO2, sO2 = history.decimate(t, (pO2, sO2), 2 * int(ax.bbox.width))
 
+        ax.scatter(t, pO2, label='Oxygen Partial Pressure', color='b', marker='o')
         ax2.scatter(t, sO2, label='Oxygen Saturation', color='r', marker='^')
-        ax2.set_xlabel('Time (Seconds)')
-        ax2.set_ylabel('Oxygen Saturation (%)', color='r')
-        ax2.set_ylim(0, 100)
+        _format_oxygen_axes(ax, ax2)
 
         fig.canvas.draw()
-
-
-def select_serial_port():
-    """GUI for selecting a serial port."""
+    timing.stop('plot.draw', start)
+
+
+class LivePlot:
+    """
+    Incrementally updated pO2/sO2 plot for live recordings.
+
+    Readings are kept in an in-memory append buffer instead of being re-queried from the database. New points are
+    drawn on top of a cached background and blitted, so each reading costs the same regardless of the run length. A
+    full redraw only happens when the time axis has to grow, which it does geometrically. Only the plot's own axes are
+    blitted, so several LivePlots can share a figure (see embed_live_plots).
+    """
+
+    def __init__(self, fig, ax, capacity=4096, t_span=60, model=None):
+        self.fig = fig
+        self.ax = ax
+        self.ax2 = ax.twinx()  # Secondary axis is created once and reused
+        _format_oxygen_axes(self.ax, self.ax2)
+        self.ax.set_xlim(0, t_span)
+
+        # Append buffer of (t, pO2, sO2) rows, grown by doubling
+        self._data = np.empty((capacity, 3))
+        self._n = 0
+        self._synced = 0  # Number of rows held by the history artists
+        self.t0 = None
+        self.model = oxygen.DEFAULT_MODEL if model is None else model
+
+        # History artists hold everything up to the last full redraw, fresh artists only what was added since
+        self._history = (self.ax.scatter([], [], label='Oxygen Partial Pressure', color='b', marker='o'),
+                         self.ax2.scatter([], [], label='Oxygen Saturation', color='r', marker='^'))
+        self._fresh = (self.ax.scatter([], [], color='b', marker='o', animated=True),
+                       self.ax2.scatter([], [], color='r', marker='^', animated=True))
+
+        self._background = None
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def data(self):
+        """View of the buffered (t, pO2, sO2) rows."""
+        return self._data[:self._n]
+
+    def append(self, t, do, T):
+        """Add readings taken at epoch times t (s) with dissolved oxygen do (mg/L) and temperature T (C)."""
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        if t.size == 0:
+            return
+        if self.t0 is None:
+            self.t0 = t[0]
+        pO2, sO2 = self.model.convert(np.atleast_1d(do), np.atleast_1d(T))
+
+        start, stop = self._n, self._n + t.size
+        if stop > len(self._data):
+            grown = np.empty((max(2 * len(self._data), stop), 3))
+            grown[:start] = self._data[:start]
+            self._data = grown
+        self._data[start:stop, 0] = t - self.t0
+        self._data[start:stop, 1] = pO2
+        self._data[start:stop, 2] = sO2
+        self._n = stop
+
+        self._draw_new(start)
+
+    def redraw(self):
+        """Force a full redraw with every buffered point."""
+        start = timing.start()
+        self._sync_history()
+        self.fig.canvas.draw()
+        timing.stop('plot.redraw', start)
+
+    def _sync_history(self):
+        data = self.data
+        width = int(self.ax.bbox.width)
+        if len(data) > 2 * width:
+            # More points than the axis can show; LTTB keeps the pO2 curve's shape (sO2 follows pO2 monotonically)
+            data = data[history.lttb(data[:, 0], data[:, 1], 2 * width)]
+        self._history[0].set_offsets(data[:, :2])
+        self._history[1].set_offsets(data[:, ::2])
+        self._synced = self._n
+
+    def _draw_new(self, start):
+        t_max = self._data[self._n - 1, 0]
+        left, right = self.ax.get_xlim()
+        if self._background is None or t_max > right:
+            # Grow the time axis geometrically so full redraws stay rare
+            while t_max > right:
+                right = left + 2 * (right - left)
+            self.ax.set_xlim(left, right)
+            self.redraw()
+            return
+
+        started = timing.start()
+        canvas = self.fig.canvas
+        canvas.restore_region(self._background)
+        self._draw_fresh(start)
+        canvas.blit(self.ax.bbox)
+        self._background = canvas.copy_from_bbox(self.ax.bbox)
+        timing.stop('plot.blit', started)
+
+    def _draw_fresh(self, start):
+        fresh = self._data[start:self._n]
+        self._fresh[0].set_offsets(fresh[:, :2])
+        self._fresh[1].set_offsets(fresh[:, ::2])
+        self.ax.draw_artist(self._fresh[0])
+        self.ax2.draw_artist(self._fresh[1])
+
+    def _on_draw(self, event):
+        # Any full draw (including window resizes) renders only the history, so paint the pending points on top
+        # before caching the background
+        if self._synced < self._n:
+            self._draw_fresh(self._synced)
+        self._background = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+
+
+class TimingPanel:
+    """Live per-stage latency table (see controllers.timing) packed into a Tk window."""
+
+    def __init__(self, master, interval_ms=1000):
+        self.label = tk.Label(master, font=("Courier", 9), justify=tk.LEFT, anchor='w')
+        self.label.pack(fill=tk.X, padx=5, pady=5)
+        self.interval_ms = interval_ms
+        self._refresh()
+
+    def _refresh(self):
+        if not self.label.winfo_exists():
+            return
+        self.label.configure(text=timing.summary() or 'No stage timings yet')
+        self.label.after(self.interval_ms, self._refresh)
+
+
+def select_serial_port(title="Select Serial Port"):
+    """GUI for selecting a serial port; title says which device it is for when a routine asks for several."""
+    ports = _select_serial_ports(tk.SINGLE, title)
+    return ports[0] if ports else None
+
+
+def select_serial_ports(title="Select Serial Ports"):
+    """GUI for selecting any number of serial ports, e.g. one per DO probe. Returns a list of port names."""
+    return _select_serial_ports(tk.MULTIPLE, title)
+
+
+def _select_serial_ports(selectmode, title):
     ports = list(list_ports.comports())
     ports = [port for port in ports if port.description != 'n/a']
 
     if not ports:
         messagebox.showerror("No Devices Found", "No serial devices detected. Check connections and try again.")
-        return None
+        return []
 
     # Create a new Tkinter window
     port_selection_window = tk.Toplevel()
-    port_selection_window.title("Select Serial Port")
+    port_selection_window.title(title)
     port_selection_window.geometry("400x300")
 
     # Label at the top
-    tk.Label(port_selection_window, text="Available Serial Ports:", font=("Arial", 12, "bold")).grid(row=0, column=0,
-                                                                                                     columnspan=2,
-                                                                                                     pady=5)
+    tk.Label(port_selection_window, text=f"{title}:", font=("Arial", 12, "bold")).grid(row=0, column=0, columnspan=2,
+                                                                                      pady=5)
 
     # Listbox to display available ports
-    listbox = tk.Listbox(port_selection_window, width=50, height=min(10, len(ports)))  # Limit height to 10 items
+    listbox = tk.Listbox(port_selection_window, width=50, height=min(10, len(ports)),  # Limit height to 10 items
+                         selectmode=selectmode)
     for port in ports:
         listbox.insert(tk.END, f"{port.name} - {port.device} ({port.description})")
     listbox.grid(row=1, column=0, columnspan=2, pady=5)
 
-    # Variable to store the selected port
-    selected_port = tk.StringVar()
+    # Selected ports
+    selected_ports = []
 
     def confirm_selection():
-        """Handles the selection of a port."""
-        selected_index = listbox.curselection()
-        if selected_index:
-            selected_text = listbox.get(selected_index)
-            selected_port.set(selected_text.split(" - ")[1].split(" ")[0])  # Extract port.device
+        """Handles the selection of the ports."""
+        selected_indices = listbox.curselection()
+        if selected_indices:
+            # Extract port.device
+            selected_ports.extend(listbox.get(index).split(" - ")[1].split(" ")[0] for index in selected_indices)
             port_selection_window.destroy()
         else:
             messagebox.showwarning("No Selection", "Please select a port.")
@@ -106,7 +232,7 @@ def select_serial_port():
     # Run the Tkinter event loop
     port_selection_window.wait_window()
 
-    return selected_port.get() if selected_port.get() else None
+    return selected_ports
 
 
 def select_database():
@@ -158,10 +284,10 @@ def select_study_table(db_path):
     return study_name
 
 
-def get_metadata_from_user():
+def get_metadata_from_user(title="Enter Study Metadata"):
     """Prompt user for metadata fields in a single GUI window."""
     root = tk.Tk()
-    root.title("Enter Study Metadata")
+    root.title(title)
     labels = [
         "Sample Name", "Solvent", "Hemoglobin Concentration (mg/mL)",
         "Microsphere Concentration (uL/mL)", "Yeast Stock Added (uL/mL)", "Yeast Concentration (mg/mL)"
@@ -0,0 +1,246 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+from controllers.oxygen import DEFAULT_MODEL
+from controllers.plan import AcquisitionPlan
+from controllers.readers import DOReader
+from controllers.schema import INSERT_DO_RECORD
+from controllers.stacks import StackWriter
+
+
+class SharedClock:
+    """
+    One time base for every instrument of a synchronized run.
+
+    Times are read from time.monotonic_ns(), which never jumps with NTP or daylight saving changes, and reported as
+    epoch seconds anchored to the wall clock once when the clock is created, so they can be stored next to (and
+    compared with) the epoch_time column.
+    """
+
+    def __init__(self):
+        self.start_ns = time.monotonic_ns()
+        self.start_epoch = time.time()
+
+    def __call__(self):
+        return self.epoch()
+
+    def epoch(self, ns=None):
+        """Epoch seconds of a monotonic_ns() reading (default: now)."""
+        ns = time.monotonic_ns() if ns is None else ns
+        return self.start_epoch + (ns - self.start_ns) / 1e9
+
+
+class OxygenIndex:
+    """
+    Time-sorted DO readings with their pO2 and sO2, for looking up the oxygenation at any time.
+
+    Readings are appended as they arrive (into a buffer that grows geometrically) and at() interpolates linearly
+    between the two readings around each requested time, found with one searchsorted call for all of them. Times
+    outside the recorded span give NaN rather than an extrapolated value.
+    """
+    COLUMNS = ('time', 'dissolved_oxygen', 'temperature', 'po2', 'so2')
+
+    def __init__(self, model=None, capacity=4096):
+        self.model = DEFAULT_MODEL if model is None else model
+        self._data = np.empty((capacity, len(self.COLUMNS)))
+        self.size = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def data(self):
+        return self._data[:self.size]
+
+    @property
+    def latest(self):
+        """Time of the newest reading, or None before the first one."""
+        return self._data[self.size - 1, 0] if self.size else None
+
+    def extend(self, records):
+        """Add DORecords (or (time, dissolved_oxygen, nanoamperes, temperature) rows)."""
+        if not records:
+            return
+        t, do, _, T = np.asarray([tuple(r) for r in records], dtype=float).T
+        pO2, sO2 = self.model.convert(do, T)
+        rows = np.column_stack((t, do, T, pO2, sO2))
+
+        with self._cond:
+            n = self.size + len(rows)
+            if n > len(self._data):
+                grown = np.empty((max(n, 2 * len(self._data)), len(self.COLUMNS)))
+                grown[:self.size] = self._data[:self.size]
+                self._data = grown
+            self._data[self.size:n] = rows
+            if self.size and rows[0, 0] < self._data[self.size - 1, 0]:
+                # Rarely needed: keep the index sorted if a batch arrives out of order
+                self._data[:n] = self._data[np.argsort(self._data[:n, 0], kind='stable')]
+            self.size = n
+            self._cond.notify_all()
+
+    def wait_until(self, t, timeout=None):
+        """Block until a reading at or after time t has arrived. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.size and self._data[self.size - 1, 0] >= t, timeout)
+
+    def at(self, times):
+        """Interpolated (dissolved_oxygen, temperature, po2, so2) arrays at each of times."""
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        with self._cond:
+            data = self._data[:self.size].copy()
+        values = np.full((len(times), len(self.COLUMNS) - 1), np.nan)
+        if not len(data):
+            return tuple(values.T)
+
+        t = data[:, 0]
+        if len(data) == 1:
+            values[times == t[0]] = data[0, 1:]
+            return tuple(values.T)
+
+        right = np.clip(np.searchsorted(t, times, side='right'), 1, len(t) - 1)
+        left = right - 1
+        span = t[right] - t[left]
+        weight = np.divide(times - t[left], span, out=np.zeros_like(times), where=span > 0)[:, None]
+        values = data[left, 1:] * (1 - weight) + data[right, 1:] * weight
+        values[(times < t[0]) | (times > t[-1])] = np.nan
+        return tuple(values.T)
+
+
+class SynchronizedRun:
+    """
+    Records a DO probe while capturing image stacks, with every reading and frame stamped by one SharedClock.
+
+    The DOReader thread and a consumer thread store readings through the shared DatabaseWriter and add them to an
+    OxygenIndex while the calling thread captures stacks. After each stack the DO, temperature, pO2 and sO2 at every
+    band's mid-exposure time are interpolated from the index and written to synchronized_band_records, so stacks
+    never have to be aligned with the DO log afterwards. Batches of readings are also put on self.updates for a
+    live plot. If calibration (a CalibrationStore) is given, every band is dark/flat corrected before it is written;
+    if analysis (an OnlineAnalysis) is given, every finished stack is also handed to it for unmixing. With lapse (a
+    TimeLapse) stacks are appended to it instead of being written as separate TIFF files.
+    """
+
+    def __init__(self, probe, lctf, cmos, writer, sample_name, sample_id, clock=None, model=None, do_timeout=10,
+                 analysis=None, calibration=None, lapse=None):
+        self.probe = probe
+        self.lctf = lctf
+        self.cmos = cmos
+        self.writer = writer
+        self.analysis = analysis
+        self.calibration = calibration
+        self.lapse = lapse
+        if analysis is not None and lapse is not None:
+            raise ValueError('Online analysis reads TIFF stacks; it cannot be combined with a time-lapse container.')
+        self.sample_name = sample_name
+        self.sample_id = sample_id
+        self.clock = SharedClock() if clock is None else clock
+        self.probe.clock = self.clock
+        self.reader = DOReader(probe, timeout=do_timeout)
+        self.index = OxygenIndex(model)
+        self.updates = queue.Queue(maxsize=1024)
+        self.traces = []
+        self._consumer = threading.Thread(target=self._consume, daemon=True)
+
+    @property
+    def recording(self):
+        """True while the DO probe is still being read."""
+        return self._consumer.is_alive()
+
+    def start(self):
+        self.reader.start()
+        self._consumer.start()
+
+    def stop(self):
+        self.reader.stop()
+        self._consumer.join()
+
+    def _consume(self):
+        while self.reader.is_alive() or not self.reader.queue.empty():
+            try:
+                records = self.reader.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self.writer.insert_many(INSERT_DO_RECORD, [(self.sample_name, self.sample_id, r.time, r.dissolved_oxygen,
+                                                        r.nanoamperes, r.temperature) for r in records])
+            self.index.extend(records)
+            try:
+                self.updates.put_nowait(records)
+            except queue.Full:
+                pass  # Nobody is plotting
+
+    def capture_stack(self, image_name, wavelengths, exposures, plan=None, coverage_timeout=5):
+        """
+        Capture one stack and store each band's interpolated oxygenation. Returns the StackTrace.
+
+        With a time-lapse the stack is appended to it and image_name is replaced by '<container>#<time point>'.
+        """
+        plan = AcquisitionPlan(wavelengths, exposures) if plan is None else plan
+        metadata = {'sample_name': self.sample_name, 'sample_id': self.sample_id}
+        calibration = self.calibration
+        if calibration is not None:
+            binning = self.cmos.binning
+            calibration.check(plan.exposures, plan.wavelengths, binning)
+            metadata['calibration'] = calibration.directory
+        if self.lapse is not None:
+            stack = self.lapse.stack(epoch_time=self.clock())
+            image_name = stack.name
+        else:
+            stack = StackWriter(image_name, plan.wavelengths, plan.exposures, metadata=metadata)
+
+        with stack:
+            def save_band(index, frame, lam, tau):
+                if calibration is not None:
+                    calibration.correct(frame, tau, lam, binning)
+                stack.write(index, frame)
+
+            trace = plan.run(self.lctf, self.cmos, save_band, clock=self.clock)
+        self.traces.append(trace)
+        if self.analysis is not None:
+            self.analysis.submit(image_name, plan.wavelengths, plan.exposures, self.sample_name)
+
+        # Mid-exposure time of each band, in logical band order
+        times = np.empty(len(plan))
+        for k, band in enumerate(trace.bands):
+            times[plan.order[k]] = band.exposure_end - band.exposure / 2
+
+        # The last band needs a DO reading after it to interpolate between
+        if not self.index.wait_until(times.max(), coverage_timeout):
+            print(f'No DO reading after the end of {image_name}; its last bands are stored without oxygenation.')
+        values = np.column_stack(self.index.at(times))
+
+        rows = []
+        for band, (lam, tau, t, row) in enumerate(zip(plan.wavelengths, plan.exposures, times, values)):
+            rows.append((self.sample_id, image_name, band, lam, tau, t) +
+                        tuple(None if np.isnan(v) else float(v) for v in row))
+        self.writer.insert_many('''
+            INSERT INTO synchronized_band_records (
+                sample_id, image_name, band, wavelength, exposure_time, epoch_time, dissolved_oxygen, temperature,
+                po2, so2
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        return trace
+
+    def run(self, image_base, wavelengths, exposures, n_stacks=None, interval=0, stop_event=None, plan=None):
+        """
+        Capture stacks named <image_base>_0000.tiff, ... every interval seconds.
+
+        Stops after n_stacks, when stop_event is set, or once the DO probe stops sending data (if n_stacks is None).
+        A given plan (an AcquisitionPlan of these bands, e.g. with reorder=False) is used for every stack. Returns
+        the number of stacks captured.
+        """
+        stop_event = threading.Event() if stop_event is None else stop_event
+        plan = AcquisitionPlan(wavelengths, exposures) if plan is None else plan
+        # Bands captured before the first DO reading could not be interpolated
+        self.index.wait_until(self.clock(), timeout=self.reader.timeout)
+        count = 0
+        while not stop_event.is_set() and (n_stacks is None or count < n_stacks):
+            if n_stacks is None and not self.recording:
+                break
+            start = time.monotonic()
+            self.capture_stack(f'{image_base}_{count:04d}.tiff', wavelengths, exposures, plan=plan)
+            count += 1
+            stop_event.wait(max(0.0, interval - (time.monotonic() - start)))
+        return count
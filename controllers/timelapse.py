@@ -0,0 +1,365 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from controllers import timing
+
+
+# Compression level used when none is given: zstd's default, and zlib's fastest (which compresses noisy frames
+# nearly as well as its higher levels)
+DEFAULT_LEVELS = {'zstd': 3, 'zlib': 1}
+
+
+def default_codec():
+    """'zstd' when the zstandard package is installed, otherwise the standard library's 'zlib'."""
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return 'zlib'
+    return 'zstd'
+
+
+class TimeLapse:
+    """
+    Append-only time-lapse of hyperspectral stacks, stored as one (time, band, y, x) dataset in a directory.
+
+    Each band is cut into chunk x chunk tiles. Tiles are byte-shuffled (so the high bytes of 16-bit pixels compress
+    together) and compressed losslessly (zstd, or zlib without the zstandard package) on a pool of worker threads,
+    then appended to data.bin. index.db records the time of every stack, the band plan and the position of every
+    tile, so one band's time series or one pixel's spectrum over time is read by decompressing only the tiles that
+    hold it. A stack becomes visible to readers when its time point is flushed. A time point is only marked complete
+    once its LapseStack is closed with every band written, so a capture that failed partway is kept but flagged in
+    complete (its missing bands read as zeros). Opening an existing container appends to it.
+    """
+
+    def __init__(self, path, wavelengths=None, exposures=None, chunk=128, codec=None, level=None, workers=4,
+                 max_pending=8, metadata=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(os.path.join(path, 'index.db'), check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS times (
+                t INTEGER PRIMARY KEY,
+                epoch_time REAL NOT NULL,
+                complete INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                t INTEGER NOT NULL,
+                band INTEGER NOT NULL,
+                row INTEGER NOT NULL,
+                col INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                nbytes INTEGER NOT NULL,
+                PRIMARY KEY (band, row, col, t)
+            ) WITHOUT ROWID;
+        ''')
+        if 'complete' not in {row[1] for row in self._conn.execute('PRAGMA table_info(times)')}:
+            # Containers written before time points were flagged: their stacks were all closed normally
+            self._conn.execute('ALTER TABLE times ADD COLUMN complete INTEGER NOT NULL DEFAULT 1')
+            self._conn.commit()
+        meta = {key: json.loads(value) for key, value in self._conn.execute('SELECT key, value FROM meta')}
+        if meta:
+            if wavelengths is not None and [float(lam) for lam in wavelengths] != meta['wavelengths']:
+                raise ValueError(f'{path} holds stacks of {meta["wavelengths"]} nm, not {list(wavelengths)}.')
+        else:
+            if wavelengths is None:
+                raise ValueError(f'{path} is not a time-lapse yet; its wavelengths are needed to create it.')
+            exposures = [None] * len(wavelengths) if exposures is None else exposures
+            codec = codec or default_codec()
+            meta = {'wavelengths': [float(lam) for lam in wavelengths], 'exposures': list(exposures), 'chunk': chunk,
+                    'codec': codec, 'level': DEFAULT_LEVELS[codec] if level is None else level, 'shape': None,
+                    'dtype': None, 'metadata': metadata or {}}
+            self._save_meta(meta)
+        self.meta = meta
+        self.wavelengths = meta['wavelengths']
+        self.exposures = meta['exposures']
+        self.chunk = meta['chunk']
+        self.codec = meta['codec']
+
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()  # The reader file handle is shared by concurrent read() calls
+        self._local = threading.local()  # Per-thread (de)compressor objects
+        self._rows = []  # Tile rows waiting for the next flush
+        self._new_times = []  # (t, epoch_time) of time points started since the last flush
+        self._completed = []  # Time points finished with every band since the last flush
+        self._futures = []
+        self._errors = []
+        self._count = self._conn.execute('SELECT count(*) FROM times').fetchone()[0]
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._data = open(os.path.join(path, 'data.bin'), 'ab')
+        self._end = self._data.tell()
+        self._reader = None
+
+    def __len__(self):
+        """Time points flushed so far."""
+        return self._conn.execute('SELECT count(*) FROM times').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    @property
+    def shape(self):
+        """(time points, bands, height, width)."""
+        height, width = self.meta['shape'] or (0, 0)
+        return len(self), len(self.wavelengths), height, width
+
+    @property
+    def complete(self):
+        """Whether each flushed time point has every band (False where a capture stopped partway)."""
+        return np.array([bool(row[0]) for row in self._conn.execute('SELECT complete FROM times ORDER BY t')])
+
+    @property
+    def times(self):
+        """Epoch time at which each flushed time point was started."""
+        return np.array([row[0] for row in self._conn.execute('SELECT epoch_time FROM times ORDER BY t')])
+
+    def band(self, wavelength):
+        """Band index of a wavelength of the plan."""
+        return self.wavelengths.index(float(wavelength))
+
+    # Writing
+
+    def stack(self, epoch_time=None):
+        """Start the next time point and return a LapseStack to write its bands with."""
+        with self._lock:
+            t = self._count
+            self._count += 1
+            self._new_times.append((t, time.time() if epoch_time is None else epoch_time))
+        return LapseStack(self, t)
+
+    def write(self, t, band, frame):
+        """
+        Queue one band of time point t for compression and return at once.
+
+        At most max_pending frames wait for the workers; beyond that write() waits for one to finish, so a slow
+        disk cannot pile frames up in memory. The frame must not be modified until flush().
+        """
+        frame = np.ascontiguousarray(frame)
+        self._check_frame(frame)
+        self._pending.acquire()
+        if self._errors:
+            self._pending.release()
+            raise self._errors[0]
+        future = self._pool.submit(self._compress, t, band, frame)
+        with self._lock:
+            self._futures.append(future)
+
+    def flush(self, complete=()):
+        """
+        Wait for every queued band, then make the time points written so far visible in the index.
+
+        Time points are indexed as incomplete until they are listed in complete (LapseStack.close() does this).
+        """
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+        if self._errors:
+            raise self._errors[0]
+        with self._lock:
+            self._data.flush()
+            rows, self._rows = self._rows, []
+            new_times, self._new_times = self._new_times, []
+            self._conn.executemany('INSERT OR REPLACE INTO chunks (t, band, row, col, offset, nbytes) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._conn.executemany('INSERT INTO times (t, epoch_time, complete) VALUES (?, ?, 0)', new_times)
+            self._conn.executemany('UPDATE times SET complete = 1 WHERE t = ?', [(t,) for t in complete])
+            self._conn.commit()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
+            self._data.close()
+            if self._reader is not None:
+                self._reader.close()
+            self._conn.close()
+
+    def _check_frame(self, frame):
+        with self._lock:
+            if self.meta['shape'] is None:
+                self.meta.update(shape=list(frame.shape), dtype=frame.dtype.str)
+                self._save_meta(self.meta)
+        if list(frame.shape) != self.meta['shape'] or frame.dtype.str != self.meta['dtype']:
+            raise ValueError(f'Frame {frame.shape} {frame.dtype} does not match the time-lapse '
+                             f'{tuple(self.meta["shape"])} {np.dtype(self.meta["dtype"])}.')
+
+    def _compress(self, t, band, frame):
+        try:
+            start = timing.start()
+            compress = self._compressor()
+            c = self.chunk
+            blobs = []
+            for row in range(0, frame.shape[0], c):
+                for col in range(0, frame.shape[1], c):
+                    tile = frame[row:row + c, col:col + c]
+                    # Shuffle: all first bytes of the pixels, then all second bytes, ...
+                    shuffled = np.ascontiguousarray(tile.view(np.uint8).reshape(-1, tile.itemsize).T)
+                    blobs.append((row // c, col // c, compress(shuffled)))
+            timing.stop('lapse.compress', start)
+
+            with self._lock:
+                for row, col, blob in blobs:
+                    self._data.write(blob)
+                    self._rows.append((t, band, row, col, self._end, len(blob)))
+                    self._end += len(blob)
+        except Exception as e:
+            self._errors.append(e)
+            raise
+        finally:
+            self._pending.release()
+
+    def _compressor(self):
+        compress = getattr(self._local, 'compress', None)
+        if compress is None:
+            if self.codec == 'zstd':
+                import zstandard
+                compress = zstandard.ZstdCompressor(level=self.meta['level']).compress
+            else:
+                level = self.meta['level']
+                compress = lambda data: zlib.compress(data, level)  # noqa: E731
+            self._local.compress = compress
+        return compress
+
+    def _decompressor(self):
+        decompress = getattr(self._local, 'decompress', None)
+        if decompress is None:
+            if self.codec == 'zstd':
+                import zstandard
+                decompress = zstandard.ZstdDecompressor().decompress
+            else:
+                decompress = zlib.decompress
+            self._local.decompress = decompress
+        return decompress
+
+    def _save_meta(self, meta):
+        self._conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                               [(key, json.dumps(value)) for key, value in meta.items()])
+        self._conn.commit()
+
+    # Reading
+
+    def read(self, t=None, bands=None, y=None, x=None):
+        """
+        A (time, band, y, x) block of the dataset: t and bands are an index, a list or None (all), y and x a slice.
+
+        Only the tiles overlapping the block are read and decompressed (in parallel on the worker threads). Bands
+        missing from an incomplete time point (see complete) read as zeros.
+        """
+        n_times, n_bands, height, width = self.shape
+        times = _indices(t, n_times)
+        bands = _indices(bands, n_bands)
+        y0, y1, _ = (y or slice(None)).indices(height)
+        x0, x1, _ = (x or slice(None)).indices(width)
+        out = np.zeros((len(times), len(bands), y1 - y0, x1 - x0), dtype=np.dtype(self.meta['dtype']))
+        if not out.size:
+            return out
+
+        c = self.chunk
+        time_slot = {value: k for k, value in enumerate(times)}
+        band_slot = {value: k for k, value in enumerate(bands)}
+        rows = self._conn.execute(f'''
+            SELECT t, band, row, col, offset, nbytes FROM chunks
+            WHERE band IN ({",".join("?" * len(bands))}) AND row BETWEEN ? AND ? AND col BETWEEN ? AND ?
+            AND t < ?
+            ORDER BY offset
+        ''', (*bands, y0 // c, (y1 - 1) // c, x0 // c, (x1 - 1) // c, n_times)).fetchall()
+
+        start = timing.start()
+        blobs = []
+        with self._read_lock:
+            reader = self._reader or self._open_reader()
+            for t_index, band, row, col, offset, nbytes in rows:
+                if t_index in time_slot:
+                    reader.seek(offset)  # In file order, so the reads are sequential
+                    blobs.append((time_slot[t_index], band_slot[band], row, col, reader.read(nbytes)))
+
+        def place(batch):
+            decompress = self._decompressor()
+            for t_slot, b_slot, row, col, blob in batch:
+                shuffled = np.frombuffer(decompress(blob), dtype=np.uint8)
+                tile_height, tile_width = min(c, height - row * c), min(c, width - col * c)
+                tile = shuffled.reshape(out.itemsize, -1).T.copy().view(out.dtype).reshape(tile_height, tile_width)
+
+                # Overlap of the tile with the requested block, in image coordinates
+                top, left = row * c, col * c
+                r0, r1 = max(y0, top), min(y1, top + tile_height)
+                c0, c1 = max(x0, left), min(x1, left + tile_width)
+                out[t_slot, b_slot, r0 - y0:r1 - y0, c0 - x0:c1 - x0] = tile[r0 - top:r1 - top, c0 - left:c1 - left]
+
+        # Tiles are decompressed on the worker threads, one batch per thread; each tile fills its own part of out
+        workers = self.workers
+        for _ in self._pool.map(place, [blobs[k::workers] for k in range(workers)]):
+            pass
+        timing.stop('lapse.read', start)
+        return out
+
+    def band_series(self, wavelength, y=None, x=None):
+        """(time, y, x) series of one band, optionally cropped."""
+        return self.read(bands=[self.band(wavelength)], y=y, x=x)[:, 0]
+
+    def pixel_series(self, y, x):
+        """(time, band) spectrum of one pixel over the whole time-lapse."""
+        return self.read(y=slice(y, y + 1), x=slice(x, x + 1))[:, :, 0, 0]
+
+    def _open_reader(self):
+        self._reader = open(os.path.join(self.path, 'data.bin'), 'rb')
+        return self._reader
+
+
+class LapseStack:
+    """
+    One time point of a TimeLapse being written; write(index, frame) like a StackWriter, flushed on close.
+
+    Like a StackWriter's partial marker, the time point is only marked complete if every band was written.
+    """
+
+    def __init__(self, lapse, t):
+        self.lapse = lapse
+        self.t = t
+        self.completed = set()  # Bands written so far
+
+    @property
+    def name(self):
+        """How the stack is referred to, e.g. in the study's _index table."""
+        return f'{self.lapse.path}#{self.t}'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    @property
+    def complete(self):
+        return len(self.completed) == len(self.lapse.wavelengths)
+
+    def write(self, index, frame):
+        self.lapse.write(self.t, index, frame)
+        self.completed.add(index)
+
+    def close(self, complete=None):
+        """Flush the time point, marking it complete only if every band was written (or complete is True)."""
+        complete = self.complete if complete is None else complete
+        self.lapse.flush(complete=[self.t] if complete else [])
+
+
+def _indices(selection, count):
+    if selection is None:
+        return list(range(count))
+    if isinstance(selection, slice):
+        return list(range(*selection.indices(count)))
+    return [int(i) for i in np.atleast_1d(selection)]
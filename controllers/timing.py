@@ -0,0 +1,150 @@
+import threading
+import time
+
+# Timing is off by default. Hot paths call start()/stop(), which only read the clock while it is enabled:
+#
+#     start = timing.start()
+#     ...
+#     timing.stop('do.parse', start)
+enabled = False
+stages = {}  # Stage name -> StageStats
+_lock = threading.Lock()
+
+# Histogram buckets: exact below 8 ns, then eight per octave, so percentiles are within about 6%
+_SUB_BUCKETS = 8
+_N_BUCKETS = _SUB_BUCKETS * 64
+
+
+def _bucket(ns):
+    if ns < _SUB_BUCKETS:
+        return max(ns, 0)
+    shift = ns.bit_length() - 4
+    return _SUB_BUCKETS * shift + (ns >> shift)
+
+
+def _bucket_range(index):
+    if index < _SUB_BUCKETS:
+        return index, index + 1
+    shift = index // _SUB_BUCKETS - 1
+    top = index % _SUB_BUCKETS + _SUB_BUCKETS
+    return top << shift, (top + 1) << shift
+
+
+class StageStats:
+    """Latency histogram of one stage: count, total and max exactly, percentiles from log-spaced buckets."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * _N_BUCKETS
+        self._lock = threading.Lock()
+
+    def add(self, ns):
+        with self._lock:
+            self.count += 1
+            self.total_ns += ns
+            if ns > self.max_ns:
+                self.max_ns = ns
+            self.buckets[_bucket(ns)] += 1
+
+    @property
+    def mean(self):
+        return self.total_ns / self.count / 1e9 if self.count else 0.0
+
+    @property
+    def max(self):
+        return self.max_ns / 1e9
+
+    @property
+    def total(self):
+        return self.total_ns / 1e9
+
+    def percentile(self, q):
+        """Estimated q-th percentile in seconds (the midpoint of the bucket it falls in)."""
+        with self._lock:
+            rank = q / 100 * self.count
+            seen = 0
+            for index, n in enumerate(self.buckets):
+                seen += n
+                if n and seen >= rank:
+                    low, high = _bucket_range(index)
+                    return min((low + high) / 2, self.max_ns) / 1e9
+        return 0.0
+
+    def __repr__(self):
+        return (f'{self.name:>20} n={self.count:<8} p50={self.percentile(50) * 1e3:9.3f} ms '
+                f'p95={self.percentile(95) * 1e3:9.3f} ms max={self.max * 1e3:9.3f} ms total={self.total:8.3f} s')
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    """Forget every recorded duration, e.g. at the start of a run."""
+    with _lock:
+        stages.clear()
+
+
+def stage(name):
+    """The StageStats of a stage, created on first use."""
+    stats = stages.get(name)
+    if stats is None:
+        with _lock:
+            stats = stages.setdefault(name, StageStats(name))
+    return stats
+
+
+def start():
+    """Clock reading to pass to stop(), or 0 while timing is disabled."""
+    return time.perf_counter_ns() if enabled else 0
+
+
+def stop(name, start):
+    """Record the time since start() under a stage name. Does nothing if timing was disabled at start()."""
+    if start:
+        stage(name).add(time.perf_counter_ns() - start)
+
+
+def add(name, seconds):
+    """Record a duration measured elsewhere (e.g. from a StackTrace) while timing is enabled."""
+    if enabled:
+        stage(name).add(int(seconds * 1e9))
+
+
+class timed:
+    """Context manager timing its block as one stage: with timing.timed('stack.write'): ..."""
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        stop(self.name, self.start)
+
+
+def summary():
+    """One line per stage, sorted by name."""
+    return '\n'.join(repr(stats) for _, stats in sorted(stages.items()))
+
+
+def rows():
+    """(stage, count, total, mean, p50, p95, max) per stage, in seconds."""
+    return [(name, stats.count, stats.total, stats.mean, stats.percentile(50), stats.percentile(95), stats.max)
+            for name, stats in sorted(stages.items()) if stats.count]
+
+
+def save(writer, run):
+    """Queue the current statistics of every stage on a DatabaseWriter as the performance summary of a run."""
+    now = time.time()
+    writer.insert_many('''
+        INSERT INTO performance_stages (run, stage, count, total_s, mean_s, p50_s, p95_s, max_s, epoch_time)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(run,) + row + (now,) for row in rows()])
@@ -0,0 +1,209 @@
+"""Per-pixel unmixing of hyperspectral stacks into oxy/deoxyhemoglobin, sO2 and total hemoglobin maps."""
+import functools
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Molar extinction coefficients (cm^-1/M, decadic) of HbO2 and Hb, from Prahl's compilation, every 10 nm
+EXTINCTION = np.array([
+    # nm     HbO2       Hb
+    (450, 62816.0, 103292.0),
+    (460, 44480.0, 23388.8),
+    (470, 33209.2, 16156.4),
+    (480, 26629.2, 14550.0),
+    (490, 23684.4, 16684.0),
+    (500, 20932.8, 20035.2),
+    (510, 20035.2, 25773.6),
+    (520, 24202.4, 31589.6),
+    (530, 39956.8, 39036.4),
+    (540, 53236.0, 46592.0),
+    (550, 43016.0, 53412.0),
+    (560, 32613.2, 53788.0),
+    (570, 44496.0, 45072.0),
+    (580, 50104.0, 37020.0),
+    (590, 14400.8, 28324.4),
+    (600, 3200.0, 14677.2),
+    (610, 1506.0, 9443.6),
+    (620, 942.0, 6509.6),
+    (630, 610.0, 5148.8),
+    (640, 442.0, 4345.2),
+    (650, 368.0, 3750.12),
+    (660, 319.6, 3226.56),
+    (670, 294.0, 2795.12),
+    (680, 277.6, 2407.92),
+    (690, 276.0, 2051.96),
+    (700, 290.0, 1794.28),
+    (710, 314.0, 1540.48),
+    (720, 348.0, 1325.88),
+])
+
+
+def extinction_matrix(wavelengths, baseline=True):
+    """
+    (bands, 2) matrix of HbO2 and Hb extinction at each wavelength, interpolated linearly from EXTINCTION.
+
+    With baseline a column of ones is appended, so a wavelength-independent attenuation (scattering, an unknown
+    illumination level) is fitted as a third component instead of leaking into the hemoglobin abundances.
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    table = EXTINCTION
+    if wavelengths.min() < table[0, 0] or wavelengths.max() > table[-1, 0]:
+        raise ValueError(f'Extinction coefficients are only tabulated from {table[0, 0]:.0f} to {table[-1, 0]:.0f} nm.')
+    columns = [np.interp(wavelengths, table[:, 0], table[:, 1]), np.interp(wavelengths, table[:, 0], table[:, 2])]
+    if baseline:
+        columns.append(np.ones_like(wavelengths))
+    return np.column_stack(columns)
+
+
+@functools.lru_cache(maxsize=32)
+def unmixing_matrix(wavelengths, baseline=True):
+    """
+    Cached pseudo-inverse of extinction_matrix() for a band plan (wavelengths as a tuple).
+
+    Multiplying it with the absorbance spectra of every pixel gives the least-squares abundances in one matrix
+    product, so a plan's inverse is computed once, however many stacks use it.
+    """
+    if len(wavelengths) < (3 if baseline else 2):
+        raise ValueError('Unmixing needs more bands than fitted components.')
+    pinv = np.linalg.pinv(extinction_matrix(wavelengths, baseline)).astype(np.float32)
+    pinv.flags.writeable = False  # Shared by every caller
+    return pinv
+
+
+def map_paths(path):
+    """(sO2 map, tHb map) file names written next to a stack."""
+    base, ext = os.path.splitext(path)
+    return f'{base}_sO2{ext}', f'{base}_tHb{ext}'
+
+
+def analyze_stack(path, pinv, exposures, reference=None, path_length=1.0, block_rows=64):
+    """
+    Unmix a stack file written by StackWriter and save its sO2 (%) and total hemoglobin (uM) maps next to it.
+
+    Absorbance is -log10 of each plane's counts per second, divided by reference (per-band counts per second of a
+    blank, if given). The stack is memory-mapped and processed block_rows rows at a time, so only the two maps and
+    one block are ever held in memory. Returns a dict of summary statistics over pixels with a positive tHb.
+    """
+    import tifffile
+
+    start = time.perf_counter()
+    stack = tifffile.memmap(path, mode='r')
+    bands, height, width = stack.shape
+    if pinv.shape[1] != bands:
+        raise ValueError(f'{path} has {bands} planes but the unmixing matrix expects {pinv.shape[1]}.')
+    scale = np.asarray(exposures, dtype=np.float32).reshape(-1, 1, 1)
+    if reference is not None:
+        scale = scale * np.asarray(reference, dtype=np.float32).reshape(-1, 1, 1)
+
+    # Maps are written under temporary names and renamed when complete, so a reader never sees half a map
+    so2_path, thb_path = map_paths(path)
+    so2 = tifffile.memmap(f'{so2_path}.tmp', shape=(height, width), dtype=np.float32, photometric='minisblack')
+    thb = tifffile.memmap(f'{thb_path}.tmp', shape=(height, width), dtype=np.float32, photometric='minisblack')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for row in range(0, height, block_rows):
+            block = np.maximum(stack[:, row:row + block_rows], 1).astype(np.float32)
+            block /= scale
+            np.log10(block, out=block)
+            block *= -1
+            oxy, deoxy = np.tensordot(pinv[:2], block, axes=1)
+            total = oxy + deoxy
+            so2[row:row + block_rows] = np.where(total > 0, 100 * oxy / total, np.nan)
+            thb[row:row + block_rows] = total * (1e6 / path_length)
+    so2.flush()
+    thb.flush()
+
+    valid = np.isfinite(so2) & (thb > 0)
+    so2_values, thb_values = so2[valid], thb[valid]
+    stats = {'pixels': int(valid.sum()), 'so2_path': so2_path, 'thb_path': thb_path}
+    for name, values in (('so2', so2_values), ('thb', thb_values)):
+        stats[f'{name}_mean'] = float(values.mean()) if values.size else None
+        stats[f'{name}_median'] = float(np.median(values)) if values.size else None
+        stats[f'{name}_std'] = float(values.std()) if values.size else None
+    del stack, so2, thb  # Unmap the files before renaming them
+    os.replace(f'{so2_path}.tmp', so2_path)
+    os.replace(f'{thb_path}.tmp', thb_path)
+    stats['analysis_s'] = time.perf_counter() - start
+    return stats
+
+
+INSERT_STACK_ANALYSIS = '''
+    INSERT INTO stack_analysis (
+        study_name, image_name, wavelengths, pixels, so2_mean, so2_median, so2_std, thb_mean, thb_median, thb_std,
+        so2_path, thb_path, analysis_s, epoch_time
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class OnlineAnalysis:
+    """
+    Unmixes each finished stack in worker processes while acquisition carries on.
+
+    submit() never blocks: at most max_pending stacks are queued or being analysed, and a stack submitted while that
+    many are outstanding is skipped (counted in skipped) so a slow analysis cannot hold up the acquisition or pile
+    stacks up in memory; it can be analysed later with analyze_stack(). Only the file name and the cached unmixing
+    matrix are sent to the workers. Summary statistics go to the stack_analysis table through writer.
+    """
+
+    def __init__(self, writer, workers=1, max_pending=2, reference=None, path_length=1.0, baseline=True):
+        self.writer = writer
+        self.reference = reference
+        self.path_length = path_length
+        self.baseline = baseline
+        self.skipped = 0
+        self.results = []  # (image_name, stats) of every finished analysis
+        self._pending = threading.BoundedSemaphore(max_pending)
+        # Spawned, not forked, workers: the acquisition threads and their locks must not be copied into them
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def submit(self, image_name, wavelengths, exposures, study_name=None):
+        """Queue a stack for analysis and return its Future, or None if the queue was full."""
+        if not self._pending.acquire(blocking=False):
+            self.skipped += 1
+            print(f'Analysis is behind; {image_name} was not analysed online.')
+            return None
+        try:
+            pinv = unmixing_matrix(tuple(float(lam) for lam in wavelengths), self.baseline)
+        except ValueError as e:
+            # A plan that cannot be unmixed must not stop the acquisition
+            self._pending.release()
+            print(f'{image_name} cannot be analysed: {e}')
+            return None
+        try:
+            future = self.executor.submit(analyze_stack, image_name, pinv, list(exposures), self.reference,
+                                          self.path_length)
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda f: self._done(f, image_name, study_name, wavelengths))
+        return future
+
+    def close(self, wait=True):
+        """Wait for (or with wait=False, cancel) the outstanding analyses and stop the workers."""
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _done(self, future, image_name, study_name, wavelengths):
+        try:
+            if future.cancelled():
+                return
+            stats = future.result()
+        except Exception as e:
+            print(f'Analysis of {image_name} failed: {e}')
+            return
+        finally:
+            self._pending.release()
+        self.results.append((image_name, stats))
+        self.writer.insert(INSERT_STACK_ANALYSIS, (
+            study_name, image_name, json.dumps([float(lam) for lam in wavelengths]), stats['pixels'],
+            stats['so2_mean'], stats['so2_median'], stats['so2_std'], stats['thb_mean'], stats['thb_median'],
+            stats['thb_std'], stats['so2_path'], stats['thb_path'], stats['analysis_s'], time.time()))
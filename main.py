@@ -1,10 +1,21 @@
+import sys
+
+# Only when run as a script: the spawned analysis worker processes re-import this module
+if __name__ == '__main__' and len(sys.argv) > 1:
+    # Headless: python main.py protocol.toml [--dry-run] runs a protocol without opening any window
+    from controllers.runner import main
+    main()
+    sys.exit()
+
 import tkinter as tk
 from tkinter import messagebox
 
-from controllers.routines import record_do, capture_images, synchronized_phantom_measurement, focus_camera
+from controllers import timing
+from controllers.routines import record_do, record_do_multi, capture_images, synchronized_phantom_measurement, \
+    focus_camera
 
 
-def close_all():
+def close_all(root):
     """Closes all Tkinter windows and exits the application."""
     if messagebox.askokcancel("Quit", "Are you sure you want to quit?"):
         for window in list(root.winfo_children()):
@@ -13,26 +24,48 @@ def close_all():
     root.destroy()  # Destroy the main root window
 
 
-root = tk.Tk()
-root.title("What do you want to do?")
-root.geometry("400x300")
+def main():
+    root = tk.Tk()
+    root.title("What do you want to do?")
+    root.geometry("400x430")
+
+    # Unmix each stack into sO2 and tHb maps in worker processes while acquisition carries on
+    analyze = tk.BooleanVar(value=False)
+
+    # Create buttons for different routines
+    button1 = tk.Button(root, text="Track DO", width=20, height=2, command=record_do)
+    button1.pack(pady=10)
+
+    button5 = tk.Button(root, text="Track Multiple DO Probes", width=20, height=2, command=record_do_multi)
+    button5.pack(pady=10)
+
+    button2 = tk.Button(root, text="Capture Images", width=20, height=2,
+                        command=lambda: capture_images(analyze=analyze.get()))
+    button2.pack(pady=10)
+
+    button3 = tk.Button(root, text="Synced Phantom Measuring", width=20, height=2,
+                        command=lambda: synchronized_phantom_measurement(analyze=analyze.get()))
+    button3.pack(pady=10)
+
+    button4 = tk.Button(root, text="View CMOS", width=20, height=2, command=focus_camera)
+    button4.pack(pady=10)
 
-# Create buttons for different routines
-button1 = tk.Button(root, text="Track DO", width=20, height=2, command=record_do)
-button1.pack(pady=10)
+    # Per-stage latency timings (shown live and saved to the study database when on)
+    timing_enabled = tk.BooleanVar(value=timing.enabled)
+    timing_check = tk.Checkbutton(root, text="Record stage timings", variable=timing_enabled,
+                                  command=lambda: timing.enable(timing_enabled.get()))
+    timing_check.pack()
 
-button2 = tk.Button(root, text="Capture Images", width=20, height=2, command=capture_images)
-button2.pack(pady=10)
+    analyze_check = tk.Checkbutton(root, text="Analyse stacks online", variable=analyze)
+    analyze_check.pack()
 
-button3 = tk.Button(root, text="Synced Phantom Measuring", width=20, height=2, command=synchronized_phantom_measurement)
-button3.pack(pady=10)
+    # Add a Close button
+    close_button = tk.Button(root, text="Exit", width=20, height=2, command=lambda: close_all(root))
+    close_button.pack(pady=10)
 
-button4 = tk.Button(root, text="View CMOS", width=20, height=2, command=focus_camera)
-button4.pack(pady=10)
+    # Start the Tkinter event loop
+    root.mainloop()
 
-# Add a Close button
-close_button = tk.Button(root, text="Exit", width=20, height=2, command=close_all)
-close_button.pack(pady=10)
 
-# Start the Tkinter event loop
-root.mainloop()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from controllers.calibration import CalibrationStore
+
+
+def darks(store, binning=1):
+    # Offset of 100 counts plus 1000 counts per second of exposure
+    for exposure in (0.1, 0.3):
+        store.save_dark(np.full((4, 6), 100 + 1000 * exposure), exposure, binning, nb_frames=16)
+
+
+def test_darks_are_interpolated_and_extrapolated(tmp_path):
+    store = CalibrationStore(str(tmp_path))
+    darks(store)
+    assert store.keys('dark', 1) == [0.1, 0.3] and store.keys('dark', 2) == []
+    assert np.allclose(store.dark(0.2, 1), 300)
+    assert np.allclose(store.dark(0.5, 1), 600)  # Beyond the longest exposure
+    assert np.allclose(store.dark(0.1, 1), 200)
+    with pytest.raises(KeyError):
+        store.dark(0.1, 2)
+
+
+def test_flats_are_normalised_and_gains_cached(tmp_path):
+    store = CalibrationStore(str(tmp_path))
+    darks(store)
+    flat = np.full((4, 6), 1400.0)
+    flat[:, :3] = 600.0  # 400 and 1200 counts above the dark
+    store.save_flat(flat, 500, 0.1, 1)
+    store.save_flat(flat[:, ::-1], 600, 0.1, 1)
+
+    assert np.allclose(store.load('flat', 500.0, 1)[0], [0.5] * 3 + [1.5] * 3)
+    assert np.allclose(store.gain(550, 1), 1)  # Halfway between mirrored flats
+    assert np.allclose(store.gain(450, 1), store.gain(500, 1))  # Flats are not extrapolated
+    store.gain(550, 1)
+    assert store.hits == 1 and not store.gain(550, 1).flags.writeable
+    with pytest.raises(ValueError):
+        store.save_flat(np.full((4, 6), 150.0), 700, 0.1, 1)
+
+
+def test_correct_in_place(tmp_path):
+    store = CalibrationStore(str(tmp_path))
+    darks(store)
+    flat = np.full((4, 6), 1200.0)
+    flat[0] = 600.0
+    flat[1, 0] = 200.0  # Dead pixel: no signal above the dark
+    store.save_flat(flat, 500, 0.1, 1)
+
+    frame = np.full((4, 6), 1200, dtype=np.uint16)
+    assert store.correct(frame, 0.1, 500) is frame and frame.dtype == np.uint16
+    expected = np.rint(1000 / np.where(flat > 200, store.load('flat', 500.0, 1), np.inf))
+    assert np.array_equal(frame, expected) and frame[1, 0] == 0 and frame[0, 0] > frame[2, 0]
+
+    frame = np.full((4, 6), 150, dtype=np.uint16)
+    store.correct(frame, 0.1)
+    assert np.all(frame == 0)  # Clipped, not wrapped around
+
+    frame = np.full((4, 6), 250.0, dtype=np.float32)
+    store.correct(frame, 0.1)
+    assert np.allclose(frame, 50)
+    with pytest.raises(ValueError):
+        store.correct(np.zeros((2, 2), dtype=np.uint16), 0.1)
+
+
+def test_index_persists_and_check(tmp_path):
+    store = CalibrationStore(str(tmp_path))
+    darks(store)
+    store.save_flat(np.full((4, 6), 500.0), 500, 0.1, 1)
+    store.save_flat(np.full((4, 6), 500.0), 600, 0.1, 1)
+
+    reopened = CalibrationStore(str(tmp_path))
+    assert reopened.keys('flat', 1) == [500.0, 600.0] and np.allclose(reopened.dark(0.2, 1), 300)
+    reopened.check([0.1, 0.2], [500, 600], 1)
+    with pytest.raises(ValueError):
+        reopened.check([0.1], [650], 1)
+    with pytest.raises(ValueError):
+        reopened.check([0.1], [500], 2)
@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+from controllers.database import DatabaseWriter
+
+INSERT = 'INSERT INTO readings (id, value) VALUES (?, ?)'
+
+
+@pytest.fixture
+def study_db(tmp_path):
+    study_db = str(tmp_path / 'study.db')
+    with sqlite3.connect(study_db) as conn:
+        conn.execute('CREATE TABLE readings (id INTEGER PRIMARY KEY, value REAL)')
+        conn.execute('CREATE TABLE events (name TEXT NOT NULL)')
+    return study_db
+
+
+def count(study_db, table):
+    with sqlite3.connect(study_db) as conn:
+        return conn.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+
+
+def test_rows_are_committed_in_batches(study_db):
+    with DatabaseWriter(study_db, batch_size=100, interval=60) as writer:
+        writer.insert_many(INSERT, [(k, k / 10) for k in range(250)])
+        writer.flush()
+        assert count(study_db, 'readings') == 250
+        assert writer.commits <= 3
+    assert writer.rows_written == 250
+
+
+def test_a_flush_is_one_transaction(study_db):
+    with DatabaseWriter(study_db, interval=60) as writer:
+        writer.insert_many(INSERT, [(1, 1.0), (2, 2.0)])
+        writer.insert(INSERT, (3, 3.0))
+        # Runs after the rows on the writer thread, without committing them
+        writer.execute('INSERT INTO events (name) VALUES (?)', ('start',))
+        assert count(study_db, 'readings') == 0
+        writer.flush()
+        assert count(study_db, 'readings') == 3
+        assert writer.commits == 1
+
+
+def test_execute_keeps_order_and_returns_lastrowid(study_db):
+    with DatabaseWriter(study_db) as writer:
+        writer.insert(INSERT, (1, 0.5))
+        assert writer.execute('INSERT INTO events (name) VALUES (?)', ('start',)) == 1
+    assert count(study_db, 'readings') == 1
+
+
+def test_only_failing_rows_are_discarded(study_db):
+    with DatabaseWriter(study_db, interval=60) as writer:
+        writer.insert_many(INSERT, [(k, float(k)) for k in range(10)])
+        writer.insert_many(INSERT, [(10, 10.0), (3, 3.0), (11, 11.0)])  # (3, 3.0) is a duplicate key
+        writer.insert('INSERT INTO events (name) VALUES (?)', (None,))  # NOT NULL violation
+        writer.flush()
+        writer.insert(INSERT, (12, 12.0))
+        writer.flush()
+        assert writer.is_alive()
+    assert (writer.rows_written, writer.rows_failed) == (13, 2)
+    assert count(study_db, 'readings') == 13
+    assert count(study_db, 'events') == 0
+
+
+def test_calls_after_close_raise(study_db):
+    writer = DatabaseWriter(study_db)
+    writer.start()
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.insert(INSERT, (1, 1.0))
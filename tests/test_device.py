@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from controllers.device import LCTF
+from controllers.simulators import LCTFSimulator
+
+
+@pytest.fixture
+def simulator():
+    with LCTFSimulator(wavelength=500.0, settle=0.01, settle_per_nm=1e-3) as simulator:
+        yield simulator
+
+
+def test_wake_then_tune(simulator):
+    lctf = LCTF(simulator.url)
+    assert simulator.awake
+    assert lctf.known_wavelength is None  # Waking may reset the filter
+    assert lctf.wavelength == 500.0  # Asked once, then known
+    lctf.wavelength = 520
+    assert simulator.wavelength == 520.0 and lctf.known_wavelength == 520
+    assert {'A', 'A ?', 'W', 'W ?'} <= set(lctf.latency)
+    lctf.close()
+
+
+def test_tune_returns_once_the_filter_has_settled(simulator):
+    lctf = LCTF(simulator.url)
+    start = time.monotonic()
+    lctf.wavelength = 700  # 0.01 + 200 nm * 1e-3 s/nm
+    assert time.monotonic() - start >= 0.2
+    lctf.close()
+
+
+def test_a_response_past_the_deadline_raises(simulator):
+    lctf = LCTF(simulator.url, timeout=0.1)
+    start = time.monotonic()
+    with pytest.raises(ValueError):
+        lctf.wavelength = 700  # Settles after about 0.21 s
+    assert time.monotonic() - start < 0.2
+    assert lctf.known_wavelength is None
+    lctf.close()
+
+
+def test_errors_are_raised(simulator):
+    lctf = LCTF(simulator.url, wake=False)
+    with pytest.raises(ValueError):
+        lctf.wavelength = 550  # Asleep
+    lctf.wake()
+    with pytest.raises(ValueError):
+        lctf.wavelength = 900  # Out of the tuning range
+    lctf.wavelength = 550
+    assert lctf.known_wavelength == 550
+    lctf.close()
+
+
+def test_wake_forgets_the_wavelength(simulator):
+    lctf = LCTF(simulator.url)
+    lctf.wavelength = 510
+    lctf.wake()
+    assert lctf.known_wavelength is None
+    lctf.close()
@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pytest
+
+from controllers.database import DatabaseWriter
+from controllers.exposure import AutoExposure, load_exposure_table, save_exposure_table
+
+
+class LCTF:
+    def __init__(self):
+        self.wavelength = None
+        self.tuned = []
+
+    def __setattr__(self, name, value):
+        if name == 'wavelength' and value is not None:
+            self.tuned.append(value)
+        super().__setattr__(name, value)
+
+
+class CMOS:
+    """Counts above a 100 count offset grow linearly with exposure at a per-wavelength rate, up to saturation."""
+
+    def __init__(self, lctf, rates):
+        self.lctf = lctf
+        self.rates = rates
+        self.exposure_time = 0.01
+        self.snaps = 0
+        self.settings = {'binning': 1}
+        self.configured = []
+
+    def snap(self):
+        self.snaps += 1
+        level = 100 + self.rates[self.lctf.wavelength] * self.exposure_time
+        return np.full((8, 8), min(level, 65535), dtype=np.uint16)
+
+    def __getitem__(self, name):
+        return self.settings[name]
+
+    def configure(self, config):
+        self.configured.append(dict(config))
+        self.settings.update(config)
+
+
+def level_of(cmos, wavelength, exposure):
+    return (100 + cmos.rates[wavelength] * exposure) / 65535
+
+
+def test_find_converges_on_the_target_level():
+    lctf = LCTF()
+    lctf.wavelength = 500
+    cmos = CMOS(lctf, {500: 1e6})
+    search = AutoExposure(cmos, target=0.6)
+    exposure, level = search.find(0.001)
+    assert level == pytest.approx(0.6, rel=0.1)
+    assert level == pytest.approx(level_of(cmos, 500, exposure))
+    assert cmos.snaps <= 3
+
+
+def test_saturated_frames_cut_the_exposure():
+    lctf = LCTF()
+    lctf.wavelength = 500
+    cmos = CMOS(lctf, {500: 1e6})
+    exposure, level = AutoExposure(cmos).find(1.0)  # 1e6 counts: far past full scale
+    assert exposure < 0.05 and level == pytest.approx(0.6, rel=0.1)
+
+
+def test_a_dark_band_stops_at_the_longest_exposure():
+    lctf = LCTF()
+    lctf.wavelength = 500
+    cmos = CMOS(lctf, {500: 10.0})
+    exposure, _ = AutoExposure(cmos, max_exposure=2.0, max_iterations=20).find(0.01)
+    assert exposure == 2.0
+
+
+def test_run_sweeps_in_order_and_starts_from_known_bands():
+    lctf = LCTF()
+    cmos = CMOS(lctf, {500: 1e6, 550: 2e6, 600: 4e6})
+    search = AutoExposure(cmos, test_config={'binning': 4})
+    exposures = search.run(lctf, [600, 500, 550], start={500: 0.04})
+    assert lctf.tuned == [500, 550, 600]
+    assert set(exposures) == set(search.levels) == {500, 550, 600}
+    for wavelength, exposure in exposures.items():
+        assert level_of(cmos, wavelength, exposure) == pytest.approx(0.6, rel=0.1)
+    # Test frames are binned; the camera's own binning is restored afterwards
+    assert cmos.configured == [{'binning': 4}, {'binning': 1}]
+
+
+def test_exposure_table_round_trip(tmp_path):
+    study_db = str(tmp_path / 'study.db')
+    assert load_exposure_table(study_db, 'phantom', 1, read_only=True) == {}
+    assert not os.path.exists(study_db)  # A read-only lookup creates nothing
+
+    assert load_exposure_table(study_db, 'phantom', 1) == {}  # Creates the schema
+    with DatabaseWriter(study_db) as writer:
+        save_exposure_table(writer, 'phantom', 1, {500: 0.02, 550: 0.03}, {500: 0.61})
+        save_exposure_table(writer, 'phantom', 2, {500: 0.005})
+    with DatabaseWriter(study_db) as writer:
+        save_exposure_table(writer, 'phantom', 1, {550: 0.04})  # Updated in place
+    assert load_exposure_table(study_db, 'phantom', 1) == {500: 0.02, 550: 0.04}
+    assert load_exposure_table(study_db, 'phantom', 2, read_only=True) == {500: 0.005}
+    assert load_exposure_table(study_db, 'other', 1) == {}
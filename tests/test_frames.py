@@ -0,0 +1,112 @@
+import threading
+
+import numpy as np
+import pytest
+
+from controllers.frames import FrameAccumulator, FrameRing
+
+
+def fill(ring, value, shape=(4, 4)):
+    slot = ring.reserve(shape, np.uint16)
+    slot[:] = value
+    ring.commit()
+
+
+def test_ring_keeps_the_newest_frames():
+    ring = FrameRing(size=3)
+    for value in range(5):
+        fill(ring, value)
+    assert ring.count == 5 and len(ring) == 3
+    assert ring.get()[0, 0] == 4
+    assert ring.get(2)[0, 0] == 2
+    with pytest.raises(IndexError):
+        ring.get(1)
+    assert ring.overwritten == 1
+
+
+def test_reserve_retires_the_frame_being_overwritten():
+    ring = FrameRing(size=2)
+    fill(ring, 0)
+    fill(ring, 1)
+    slot = ring.reserve((4, 4), np.uint16)
+    # While the copy runs the old frame must not be readable, and the new one is not published yet
+    with pytest.raises(IndexError):
+        ring.get(0)
+    slot[:] = 2
+    ring.commit()
+    assert ring.get(2)[0, 0] == 2
+    assert ring.get(1)[0, 0] == 1
+
+
+def test_borrowed_slots_are_skipped_and_drops_counted():
+    ring = FrameRing(size=2)
+    fill(ring, 0)
+    fill(ring, 1)
+    view0, index0 = ring.view(0)
+    view1, index1 = ring.view(1)
+    assert ring.reserve((4, 4), np.uint16) is None
+    assert ring.dropped == 1
+
+    ring.release(index0)
+    fill(ring, 2)
+    assert view1[0, 0] == 1  # The borrowed frame was not overwritten
+    ring.release(index1)
+    ring.add_dropped(3)
+    assert ring.dropped == 4
+
+
+def test_wait_returns_once_the_frame_is_committed():
+    ring = FrameRing(size=4)
+    assert not ring.wait(0, timeout=0.01)
+    producer = threading.Timer(0.05, fill, (ring, 7))
+    producer.start()
+    assert ring.wait(0, timeout=5)
+    producer.join()
+    assert ring.get(0)[0, 0] == 7
+    assert ring.timestamp(0) == ring.timestamp()
+
+
+def test_accumulator_mean_and_variance():
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 4096, (20, 8, 8)).astype(np.uint16)
+    accumulator = FrameAccumulator(variance=True)
+    for frame in frames:
+        accumulator.add(frame)
+    assert accumulator.count == 20
+    np.testing.assert_allclose(accumulator.mean, frames.mean(axis=0), rtol=1e-5)
+    np.testing.assert_allclose(accumulator.variance, frames.var(axis=0, ddof=1), rtol=1e-4)
+
+
+def test_accumulator_integer_sum_is_exact():
+    frames = np.full((64, 2, 2), 65535, dtype=np.uint16)
+    accumulator = FrameAccumulator()
+    for frame in frames:
+        accumulator.add(frame)
+    assert np.all(accumulator.mean == 65535)
+
+
+def test_accumulator_needs_frames_and_variance_tracking():
+    accumulator = FrameAccumulator()
+    with pytest.raises(ValueError):
+        accumulator.mean
+    accumulator.add(np.ones((2, 2), dtype=np.float32))
+    assert accumulator.mean.dtype == np.float32
+    with pytest.raises(ValueError):
+        accumulator.variance
+
+
+def test_capture_averages_a_simulated_camera():
+    from controllers.camera import CMOS
+    from controllers.simulators import SimulatedCamera, SimulatedDCAM
+
+    cmos = CMOS(sdk=SimulatedDCAM(SimulatedCamera(64, 32, fps=1000, brightness=1e5, read_noise=4.0)))
+    try:
+        cmos.exposure_time = 0.001
+        frame = cmos.capture()
+        mean = cmos.capture(nb_frames=50, average=True, nb_buffers=4)
+        assert mean.shape == frame.shape and mean.dtype == np.float32
+        assert abs(float(mean.mean()) - float(frame.mean())) < 1
+        mean, variance = cmos.capture(nb_frames=50, variance=True, nb_buffers=4)
+        assert 8 < float(np.median(variance)) < 32  # Read noise only
+    finally:
+        cmos.close()
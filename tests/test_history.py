@@ -0,0 +1,82 @@
+import sqlite3
+
+import numpy as np
+
+from controllers import schema
+from controllers.history import lttb, decimate, load_history
+
+
+def test_short_series_is_returned_whole():
+    x = np.arange(10)
+    assert list(lttb(x, x, 10)) == list(range(10))
+    assert list(lttb(x, x, 100)) == list(range(10))
+
+
+def test_keeps_endpoints_and_point_count():
+    x = np.arange(10000)
+    y = np.sin(x / 100)
+    keep = lttb(x, y, 500)
+    assert len(keep) == 500
+    assert keep[0] == 0 and keep[-1] == len(x) - 1
+    assert np.all(np.diff(keep) > 0)
+
+
+def test_keeps_a_single_spike():
+    x = np.arange(5000)
+    y = np.zeros(5000)
+    y[1234] = 10.0
+    assert 1234 in lttb(x, y, 50)
+
+
+def test_decimate_thins_every_column_alike():
+    t = np.arange(1000.0)
+    t_out, a, b = decimate(t, (t * 2, t * 3), 100)
+    assert len(t_out) == 100
+    assert np.array_equal(a, t_out * 2) and np.array_equal(b, t_out * 3)
+
+
+def recording(seconds, start=1_700_000_000, target=schema.SCHEMA_VERSION):
+    conn = sqlite3.connect(':memory:')
+    schema.migrate(conn, target=target)
+    conn.execute("INSERT INTO dissolved_oxygen_study_table (sample_name) VALUES ('a')")
+    conn.executemany('''INSERT INTO dissolved_oxygen_records (sample_name, sample_id, time, epoch_time,
+                        dissolved_oxygen, nanoamperes, temperature) VALUES ('a', 1, '', ?, ?, 0, 25.0)''',
+                     [(start + t, 8.0 + (t % 10) / 10) for t in range(seconds)])
+    conn.commit()
+    return conn
+
+
+def test_trigger_keeps_the_rollups_current():
+    conn = recording(25)
+    rows = conn.execute('''SELECT bucket - 1700000000, n, do_min, do_max, do_sum FROM dissolved_oxygen_rollups
+                           WHERE resolution = 10 ORDER BY bucket''').fetchall()
+    assert [row[:2] for row in rows] == [(0, 10), (10, 10), (20, 5)]
+    assert np.allclose(rows[0][2:], (8.0, 8.9, 84.5))
+    assert conn.execute('SELECT sum(n) FROM dissolved_oxygen_rollups WHERE resolution = 600').fetchone() == (25,)
+
+
+def test_migration_rolls_up_existing_readings():
+    conn = recording(30, target=4)
+    schema.migrate(conn)
+    assert conn.execute('SELECT sum(n) FROM dissolved_oxygen_rollups WHERE resolution = 10').fetchone() == (30,)
+
+
+def test_short_history_uses_the_raw_readings():
+    resolution, columns = load_history(recording(100), 1, width=200)
+    assert resolution == 0 and len(columns['time']) == 100
+    assert np.array_equal(columns['do_min'], columns['do_max'])
+    assert np.all((columns['so2_mean'] > 0) & (columns['so2_mean'] < 100))  # Percent
+
+
+def test_long_history_uses_the_finest_rollup_that_fits():
+    conn = recording(6000)
+    resolution, columns = load_history(conn, 1, width=500)
+    assert resolution == 10 and len(columns['time']) == 500  # 600 buckets, thinned with LTTB
+    assert np.all(columns['do_min'] <= columns['do_mean']) and np.all(columns['do_mean'] <= columns['do_max'])
+
+    resolution, columns = load_history(conn, 1, width=50)
+    assert resolution == 60 and len(columns['time']) == 50
+    assert np.allclose(columns['do_mean'], 8.45)
+
+    resolution, columns = load_history(conn, 1, width=500, start=1_700_000_000, end=1_700_000_099)
+    assert resolution == 0 and len(columns['time']) == 100
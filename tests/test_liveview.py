@@ -0,0 +1,41 @@
+import numpy as np
+
+from controllers.liveview import bin_to_fit, ContrastLUT, to_display
+
+
+def test_small_frames_are_not_binned():
+    frame = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    assert bin_to_fit(frame, size=640) is frame
+
+
+def test_bins_are_averaged_and_partial_bins_cropped():
+    frame = np.arange(2050 * 2048, dtype=np.uint16).reshape(2050, 2048)
+    binned = bin_to_fit(frame, size=640)  # 2050 rows need a factor of 4
+    assert binned.shape == (512, 512) and binned.dtype == np.uint16
+    assert binned[1, 2] == frame[4:8, 8:12].astype(np.uint64).mean() // 1
+
+    out = np.empty((512, 512), np.uint16)
+    assert bin_to_fit(frame, size=640, out=out) is out
+    assert np.array_equal(out, binned)
+
+
+def test_default_table_keeps_the_high_byte():
+    lut = ContrastLUT(bits=16)
+    frame = np.array([[0, 255, 256, 65535]], dtype=np.uint16)
+    assert lut.apply(frame).tolist() == [[0, 0, 1, 255]]
+
+
+def test_update_stretches_the_percentile_range_and_clips():
+    frame = np.tile(np.arange(1000, 2000, dtype=np.uint16), (8, 1))
+    lut = ContrastLUT(bits=16, low=0, high=100)
+    lut.update(frame, stride=1)
+    assert lut.range == (1000, 1999)
+    display = lut.apply(np.array([0, 1000, 1999, 60000], dtype=np.uint16))
+    assert display.tolist() == [0, 0, 255, 255]
+    assert display.dtype == np.uint8
+
+
+def test_to_display_fits_and_converts():
+    frame = np.random.default_rng(0).integers(100, 4000, (1300, 700), dtype=np.uint16)
+    display = to_display(frame, size=640)
+    assert display.dtype == np.uint8 and display.shape == (433, 233)  # Binned by 3
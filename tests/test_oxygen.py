@@ -0,0 +1,58 @@
+import sqlite3
+
+import numpy as np
+
+from controllers.oxygen import OxygenModel, DEFAULT_MODEL, to_seconds, convert, convert_chunks, query_chunks
+
+
+def test_matches_the_scalar_formulas():
+    model = OxygenModel()
+    do, T = 8.0, 25.0
+    kH = model.Hcc / (model.R * (T + 273.15))
+    pO2 = 7.5 * do / (1000 * 1000 * model.m * kH)
+    sO2 = 100 * (pO2 / model.p50) ** model.h / (1 + (pO2 / model.p50) ** model.h)
+    assert np.isclose(model.po2(do, T), pO2)
+    assert np.isclose(model.so2(pO2), sO2)
+
+
+def test_saturation_is_half_at_p50_and_never_negative():
+    assert np.isclose(DEFAULT_MODEL.so2(DEFAULT_MODEL.p50), 50.0)
+    assert DEFAULT_MODEL.so2(-5.0) == 0.0
+
+
+def test_dissolved_oxygen_inverts_po2():
+    do = np.linspace(0, 10, 11)
+    T = np.full_like(do, 37.0)
+    assert np.allclose(DEFAULT_MODEL.dissolved_oxygen(DEFAULT_MODEL.po2(do, T), T), do)
+
+
+def test_to_seconds_accepts_sqlite_timestamps():
+    seconds = to_seconds(['2024-01-01 00:00:00', '2024-01-01 00:00:01.5'])
+    assert seconds.tolist() == [1704067200.0, 1704067201.5]
+    assert to_seconds([10, 12], t0=10).tolist() == [0.0, 2.0]
+
+
+def test_convert_sorts_and_starts_at_the_first_reading():
+    t, pO2, sO2 = convert([100.0, 102.0, 101.0], [8.0, 6.0, 7.0], [25.0, 25.0, 25.0])
+    assert t.tolist() == [0.0, 1.0, 2.0]
+    assert np.all(np.diff(pO2) < 0)  # DO was 8, 7, 6 in time order
+
+
+def test_chunks_share_the_first_time_origin():
+    times = np.arange(100.0, 110.0)
+    do = np.linspace(8, 2, 10)
+    T = np.full(10, 25.0)
+    chunks = [(times[:4], do[:4], T[:4]), (times[4:], do[4:], T[4:])]
+    pieces = list(convert_chunks(chunks))
+    whole = convert(times, do, T)
+    for piece_column, whole_column in zip(zip(*pieces), whole):
+        assert np.allclose(np.concatenate(piece_column), whole_column)
+
+
+def test_query_chunks():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE r (time REAL, dissolved_oxygen REAL, temperature REAL)')
+    conn.executemany('INSERT INTO r VALUES (?, ?, ?)', [(k, 8.0, 25.0) for k in range(25)])
+    chunks = list(query_chunks(conn.cursor(), 'SELECT * FROM r ORDER BY time', chunk_size=10))
+    assert [len(times) for times, _, _ in chunks] == [10, 10, 5]
+    assert chunks[0][1].dtype == float
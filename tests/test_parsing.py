@@ -0,0 +1,63 @@
+import time
+
+from controllers.parsing import DOFramer
+from controllers.simulators import DOProbeSimulator
+
+
+def probe_line(index=0):
+    return DOProbeSimulator(noise=0, seed=0).line(index, 0.0)
+
+
+def test_complete_lines_are_parsed():
+    framer = DOFramer()
+    records = framer.feed(probe_line(0) + probe_line(1), time=123.0)
+    assert len(records) == 2
+    assert records[0].time == 123.0
+    assert records[0].dissolved_oxygen == 8.0
+    assert records[0].nanoamperes == 48.0
+    assert framer.pending == 0
+
+
+def test_line_split_across_reads_is_kept():
+    framer = DOFramer()
+    line = probe_line()
+    assert framer.feed(line[:20]) == []
+    assert framer.pending == 20
+    records = framer.feed(line[20:])
+    assert len(records) == 1 and framer.parsed == 1
+
+
+def test_malformed_lines_are_dropped():
+    framer = DOFramer()
+    records = framer.feed(b'garbage;line\r\n' + b'1;2;3;4;5;6;7;8;x;9;y;10;z\r\n' + probe_line())
+    assert len(records) == 1
+    assert framer.dropped == 2
+
+
+def test_unterminated_garbage_resynchronizes():
+    framer = DOFramer(max_line=64)
+    assert framer.feed(b'\x00' * 100) == []
+    assert framer.resynced == 1 and framer.pending == 0
+    assert len(framer.feed(probe_line())) == 1
+
+
+def test_records_unpack_like_tuples():
+    record = DOFramer().feed(probe_line(), time=time.time())[0]
+    t, do, na, temperature = record
+    assert (do, na) == (8.0, 48.0) and temperature == record.temperature
+
+
+def test_byte_at_a_time_gives_each_line_once():
+    framer = DOFramer()
+    data = probe_line(0) + probe_line(1) + probe_line(2)
+    records = [record for k in range(len(data)) for record in framer.feed(data[k:k + 1])]
+    assert len(records) == 3
+    assert framer.dropped == 0  # CRLF split across reads is not an empty or broken line
+
+
+def test_reset_drops_a_partial_line():
+    framer = DOFramer()
+    framer.feed(probe_line()[:30])
+    framer.reset()
+    assert framer.pending == 0
+    assert len(framer.feed(probe_line())) == 1
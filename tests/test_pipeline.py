@@ -0,0 +1,91 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from controllers.pipeline import BandPipeline
+
+
+class LCTF:
+    def __init__(self, settle=0.03, fail_at=None):
+        self.settle = settle
+        self.fail_at = fail_at
+        self.tuned = []
+
+    @property
+    def wavelength(self):
+        return self.tuned[-1]
+
+    @wavelength.setter
+    def wavelength(self, wavelength):
+        if wavelength == self.fail_at:
+            raise RuntimeError('filter did not settle')
+        time.sleep(self.settle)
+        self.tuned.append(wavelength)
+
+
+class CMOS:
+    """Integrates for the exposure time, then takes readout seconds to deliver the frame."""
+
+    def __init__(self, lctf, readout=0.05):
+        self.lctf = lctf
+        self.readout = readout
+        self.exposure_time = 0.0
+
+    def snap(self, on_exposure_end=None):
+        time.sleep(self.exposure_time)
+        value = self.lctf.wavelength  # What the filter was at while the sensor integrated
+        on_exposure_end()
+        time.sleep(self.readout)
+        return np.full((4, 4), value, np.uint16)
+
+
+WAVELENGTHS = [500, 550, 600, 650]
+EXPOSURES = [0.01, 0.02, 0.01, 0.02]
+
+
+def test_every_band_is_captured_at_its_wavelength_and_saved():
+    lctf = LCTF()
+    saved = {}
+    lock = threading.Lock()
+
+    def save(index, frame, wavelength, exposure):
+        with lock:
+            saved[index] = (int(frame[0, 0]), wavelength, exposure)
+
+    trace = BandPipeline(lctf, CMOS(lctf), save).run(WAVELENGTHS, EXPOSURES)
+    assert saved == {k: (lam, lam, tau) for k, (lam, tau) in enumerate(zip(WAVELENGTHS, EXPOSURES))}
+    assert all(band.saved is not None for band in trace.bands)
+
+
+def test_tuning_overlaps_the_previous_readout():
+    lctf = LCTF(settle=0.03)
+    cmos = CMOS(lctf, readout=0.05)
+    trace = BandPipeline(lctf, cmos, lambda *args: None).run(WAVELENGTHS, EXPOSURES)
+    for band, next_band in zip(trace.bands, trace.bands[1:]):
+        assert band.exposure_end <= next_band.tune_start < band.frame_ready
+    serial = len(WAVELENGTHS) * (0.03 + 0.05) + sum(EXPOSURES)
+    assert trace.stack_time < serial - 0.05
+
+
+def test_save_errors_stop_the_stack_and_are_raised():
+    lctf = LCTF(settle=0.0)
+
+    def save(index, frame, wavelength, exposure):
+        raise OSError('disk full')
+
+    with pytest.raises(OSError):
+        BandPipeline(lctf, CMOS(lctf, readout=0.0), save).run(WAVELENGTHS, EXPOSURES)
+
+
+def test_tuning_errors_are_raised():
+    lctf = LCTF(settle=0.0, fail_at=600)
+    with pytest.raises(RuntimeError):
+        BandPipeline(lctf, CMOS(lctf, readout=0.0), lambda *args: None).run(WAVELENGTHS, EXPOSURES)
+    assert lctf.tuned == [500, 550]
+
+
+def test_an_empty_plan_captures_nothing():
+    trace = BandPipeline(None, None, None).run([], [])
+    assert trace.bands == []
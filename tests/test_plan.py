@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from controllers.pipeline import BandTiming, StackTrace
+from controllers.plan import AcquisitionPlan, CameraState, CostModel, FilterState
+
+
+class LCTF:
+    """Counts tunes and forgets its wavelength when re-woken, like the driver."""
+
+    def __init__(self):
+        self.known_wavelength = None
+        self.tunes = 0
+
+    @property
+    def wavelength(self):
+        return self.known_wavelength
+
+    @wavelength.setter
+    def wavelength(self, wavelength):
+        self.known_wavelength = wavelength
+        self.tunes += 1
+
+    def wake(self):
+        self.known_wavelength = None
+
+
+class CMOS:
+    """Rounds exposures to whole milliseconds, like a camera with a coarse exposure step."""
+
+    def __init__(self, lctf=None):
+        self.lctf = lctf
+        self.exposure_time = 0.01
+
+    def __setattr__(self, name, value):
+        if name == 'exposure_time':
+            value = round(value, 3)
+        super().__setattr__(name, value)
+
+    def snap(self, on_exposure_end=None):
+        on_exposure_end()
+        return np.full((2, 2), self.lctf.known_wavelength)
+
+
+def test_filter_state_skips_repeated_tunes_until_the_filter_forgets():
+    lctf = LCTF()
+    state = FilterState(lctf)
+    for wavelength in (500, 500, 550, 550):
+        state.wavelength = wavelength
+    assert (lctf.tunes, state.skipped) == (2, 2)
+
+    lctf.wake()
+    state.wavelength = 550
+    lctf.wavelength = 600  # Tuned from elsewhere
+    state.wavelength = 550
+    assert lctf.tunes == 5
+
+
+def test_camera_state_skips_rounded_repeats_but_not_outside_changes():
+    cmos = CMOS()
+    state = CameraState(cmos)
+    state.exposure_time = 0.0204
+    state.exposure_time = 0.0204  # The camera reports 0.020, which must not count as a change
+    assert (state.sent, state.skipped) == (1, 1)
+
+    cmos.exposure_time = 0.05  # Changed from elsewhere
+    state.exposure_time = 0.0204
+    assert state.sent == 2
+    assert cmos.exposure_time == 0.02
+
+
+def test_plan_picks_the_shortest_sweep():
+    cost = CostModel(tune_base=0.01, tune_per_nm=1e-3)
+    plan = AcquisitionPlan([500, 700, 510, 690], [0.01] * 4, cost=cost)
+    plan.optimize()
+    assert plan.order == [0, 2, 3, 1]
+    assert plan.predicted_time() < plan.predicted_time(order=range(4))
+
+    plan = AcquisitionPlan([500, 700, 510, 690], [0.01] * 4, cost=cost, reorder=False)
+    plan.optimize()
+    assert plan.order == [0, 1, 2, 3]
+
+
+def test_each_band_needs_a_wavelength_and_an_exposure():
+    with pytest.raises(ValueError):
+        AcquisitionPlan([500, 600], [0.01])
+
+
+def test_run_saves_logical_indices_and_skips_repeated_settings():
+    lctf = LCTF()
+    cmos = CMOS(lctf)
+    plan = AcquisitionPlan([600, 500, 550], [0.02, 0.02, 0.02], cost=CostModel(tune_per_nm=1e-3))
+    saved = {}
+    plan.run(lctf, cmos, lambda index, frame, lam, tau: saved.update({index: int(frame[0, 0])}))
+    assert saved == {0: 600, 1: 500, 2: 550}
+    assert lctf.tunes == 3
+
+    # The next stack starts where the last one ended, so its first tune and the exposure are not re-sent
+    plan.run(lctf, cmos, lambda *args: None)
+    assert lctf.tunes == 5
+    assert plan.camera.sent == 1
+
+
+def test_cost_model_fits_a_linear_tune_time():
+    bands = []
+    previous = 500
+    for k, wavelength in enumerate([520, 560, 640]):
+        band = BandTiming(k, wavelength, 0.01)
+        band.tune_start, band.tuned = 0.0, 0.02 + 1e-3 * abs(wavelength - previous)
+        band.exposure_end, band.frame_ready = 1.0, 1.04
+        bands.append(band)
+        previous = wavelength
+    cost = CostModel().fit(StackTrace(bands), start_wavelength=500, exposure_changes=[0.005])
+    assert cost.tune_base == pytest.approx(0.02) and cost.tune_per_nm == pytest.approx(1e-3)
+    assert cost.readout == pytest.approx(0.04) and cost.exposure_change == 0.005
@@ -0,0 +1,110 @@
+import pytest
+
+from controllers.properties import CameraProperties
+
+ENUMS = {'trigger_source': {'INTERNAL': 1, 'SOFTWARE': 3}, 'subarray_mode': {'OFF': 1, 'ON': 2}}
+
+
+class Capability(dict):
+    """A DCAM property attribute that reads and writes the fake camera's state."""
+
+    def __init__(self, camera, uname):
+        super().__init__(uname=uname, name=uname.upper().replace('_', ' '))
+        if uname in ENUMS:
+            self['enum'] = ENUMS[uname]
+        self.camera = camera
+
+    def read(self):
+        self.camera.reads += 1
+        return self.camera.state[self['uname']]
+
+    def write(self, value):
+        self.camera.writes.append((self['uname'], value))
+        self.camera.state[self['uname']] = value
+        return value
+
+
+class FakeCamera(dict):
+    """Capabilities keyed by uname, also found by their DCAM name, with counted device reads and writes."""
+
+    def __init__(self):
+        super().__init__()
+        self.state = {'exposure_time': 0.01, 'binning': 1, 'trigger_source': 1, 'subarray_mode': 1,
+                      'subarray_hpos': 0, 'subarray_hsize': 2048, 'subarray_vpos': 0, 'subarray_vsize': 2048}
+        self.opened = False
+        self.reads = 0
+        self.writes = []
+
+    def is_open(self):
+        return self.opened
+
+    def open(self):
+        self.opened = True
+        for uname in self.state:
+            self[uname] = Capability(self, uname)
+
+    def __missing__(self, name):
+        for capability in self.values():
+            if capability['name'] == name:
+                return capability
+        raise KeyError(name)
+
+
+@pytest.fixture
+def camera():
+    camera = FakeCamera()
+    return camera, CameraProperties(camera)
+
+
+def test_reads_are_cached_by_either_name(camera):
+    camera, properties = camera
+    for _ in range(10):
+        assert properties['exposure_time'] == 0.01
+        assert properties['EXPOSURE TIME'] == 0.01
+    assert camera.reads == 1
+    properties['binning'] = 2
+    assert properties['exposure_time'] == 0.01
+    assert camera.reads == 2  # A write clears the cache
+
+
+def test_apply_writes_only_what_differs(camera):
+    camera, properties = camera
+    config = {'exposure_time': 0.05, 'binning': 2, 'trigger_source': 'SOFTWARE', 'roi': (100, 200, 512, 256)}
+    applied = properties.apply(config)
+    assert applied['trigger_source'] == 3 and applied['subarray_hsize'] == 512 and applied['subarray_mode'] == 2
+    assert camera.writes[-1] == ('exposure_time', 0.05)  # Written last
+    first = len(camera.writes)
+
+    properties.apply(config)
+    assert len(camera.writes) == first
+
+    # With nothing cached the current values are read back rather than written blindly
+    properties.invalidate()
+    properties.apply(config)
+    assert len(camera.writes) == first
+
+    properties.apply(dict(config, binning=4))
+    assert camera.writes[first:] == [('binning', 4)]
+
+
+def test_roi_is_rewritten_in_order_when_it_changes(camera):
+    camera, properties = camera
+    properties.apply({'roi': (0, 0, 1024, 1024)})
+    assert camera.writes == [('subarray_mode', 1), ('subarray_hpos', 0), ('subarray_hsize', 1024),
+                             ('subarray_hpos', 0), ('subarray_vpos', 0), ('subarray_vsize', 1024),
+                             ('subarray_vpos', 0), ('subarray_mode', 2)]
+
+
+def test_apply_on_a_simulated_camera():
+    from controllers.simulators import SimulatedCamera
+
+    properties = CameraProperties(SimulatedCamera(width=256, height=256))
+    applied = properties.apply({'binning': '2x2', 'roi': (8, 8, 130, 64), 'exposure_time': 0.02})
+    # Values are reported as the camera accepted them, after rounding to its steps
+    assert applied['subarray_hsize'] == 132 and applied['binning'] == 2
+    # A write clears the cache, so derived properties are read fresh
+    assert (properties['image_width'], properties['image_height']) == (66, 32)
+    writes = properties.writes
+    properties.apply({'binning': '2x2', 'roi': (8, 8, 132, 64), 'exposure_time': 0.02})
+    assert properties.writes == writes
+    assert 'image_width' in properties.snapshot()
@@ -0,0 +1,95 @@
+import time
+
+import serial
+
+from controllers.device import DOProbe
+from controllers.readers import DOReader, MultiDOReader
+from controllers.simulators import DOProbeSimulator
+
+
+def received(reader):
+    counts = {}
+    for sample_id, records in reader.drain():
+        counts[sample_id] = counts.get(sample_id, 0) + len(records)
+    return counts
+
+
+def test_do_reader_stops_when_the_probe_goes_quiet():
+    with DOProbeSimulator(rate=50, count=5) as simulator:
+        probe = DOProbe(simulator.url)
+        reader = DOReader(probe, timeout=0.3)
+        reader.start()
+        reader.join(5)
+        probe.close()
+        assert not reader.is_alive()
+        assert sum(len(records) for records in reader.drain()) == 5
+        assert reader.finished
+
+
+def test_do_reader_stops_on_request():
+    with DOProbeSimulator(rate=20) as simulator:
+        probe = DOProbe(simulator.url)
+        reader = DOReader(probe, timeout=60, poll=0.05)
+        reader.start()
+        time.sleep(0.3)
+        start = time.monotonic()
+        reader.stop()
+        probe.close()
+        assert time.monotonic() - start < 1
+        assert not reader.is_alive()
+        assert reader.drain()
+
+
+def test_multi_reader_selects_over_sockets():
+    # One probe falls silent early; the others keep being read
+    simulators = [DOProbeSimulator(rate=50, count=count, seed=k) for k, count in enumerate((10, 3, 10))]
+    probes = {sample_id: DOProbe(simulator.start()) for sample_id, simulator in zip((4, 5, 6), simulators)}
+    try:
+        reader = MultiDOReader(probes, timeout=0.3)
+        assert reader.multiplex
+        reader.start()
+        reader.join(5)
+        assert not reader.is_alive()
+        assert received(reader) == {4: 10, 5: 3, 6: 10}
+        assert reader.finished and not reader.active
+        assert all(reader.timed_out(sample_id) for sample_id in probes)
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+        for probe in probes.values():
+            probe.close()
+
+
+def test_multi_reader_falls_back_to_threads_without_a_fileno():
+    simulators = [DOProbeSimulator(rate=50, count=10, seed=k) for k in range(2)]
+    probes = {sample_id: DOProbe(simulator.attach(serial.serial_for_url('loop://')))
+              for sample_id, simulator in zip((7, 9), simulators)}
+    try:
+        reader = MultiDOReader(probes, timeout=0.3)
+        assert not reader.multiplex
+        reader.start()
+        reader.join(5)
+        assert not reader.is_alive()
+        assert received(reader) == {7: 10, 9: 10}
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+
+
+def test_multi_reader_stops_on_request():
+    simulators = [DOProbeSimulator(rate=20, seed=k) for k in range(2)]
+    probes = {sample_id: DOProbe(simulator.start()) for sample_id, simulator in zip((1, 2), simulators)}
+    try:
+        reader = MultiDOReader(probes, timeout=60, poll=0.05)
+        reader.start()
+        time.sleep(0.3)
+        start = time.monotonic()
+        reader.stop()
+        assert time.monotonic() - start < 1
+        assert not reader.is_alive()
+        assert set(received(reader)) == {1, 2}
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+        for probe in probes.values():
+            probe.close()
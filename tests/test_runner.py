@@ -0,0 +1,61 @@
+import os
+import sqlite3
+
+import pytest
+
+from controllers.runner import Runner
+from controllers.schema import migrate
+
+
+class OfflineRunner(Runner):
+    """A Runner whose devices must not be opened."""
+
+    @property
+    def cmos(self):
+        raise AssertionError('The camera was opened')
+
+    @property
+    def lctf(self):
+        raise AssertionError('The filter was opened')
+
+    @property
+    def probe(self):
+        raise AssertionError('The DO probe was opened')
+
+
+def protocol(study_db, **step):
+    return {'study_db': study_db, 'camera': {'binning': 2}, 'steps': [
+        {'type': 'record_do', 'sample': {'sample_name': 'phantom'}},
+        dict({'type': 'capture', 'study_name': 'phantom', 'image': 'phantom.tiff'}, **step),
+        dict({'type': 'synchronized', 'sample': {'sample_name': 'phantom'}}, **step),
+    ]}
+
+
+def test_dry_run_opens_no_device_and_no_database(tmp_path, capsys):
+    study_db = str(tmp_path / 'study.db')
+    OfflineRunner(protocol(study_db, wavelengths=[500, 600], exposures=[0.02, 0.05]), dry_run=True).run()
+    assert not os.path.exists(study_db)
+    assert capsys.readouterr().out.count('Predicted stack time') == 2
+
+
+def test_dry_run_takes_auto_exposures_from_the_saved_table(tmp_path, capsys):
+    study_db = str(tmp_path / 'study.db')
+    migrate(study_db)
+    with sqlite3.connect(study_db) as conn:
+        conn.execute('''INSERT INTO exposure_table (sample_type, binning, wavelength, exposure_time)
+                        VALUES ('phantom', 2, 500, 0.125)''')
+    OfflineRunner(protocol(study_db, wavelengths=[500, 600], auto_exposure=True), dry_run=True).run()
+    out = capsys.readouterr().out
+    assert '125.0' in out and '50.0' in out  # 600 nm is not in the table: placeholder exposure
+
+
+def test_dry_run_needs_the_wavelengths(tmp_path):
+    with pytest.raises(ValueError):
+        OfflineRunner(protocol(str(tmp_path / 'study.db'), exposures=[0.02]), dry_run=True).run()
+
+
+def test_dry_run_uses_the_protocol_exposure_instead_of_asking_the_camera(tmp_path, capsys):
+    steps = protocol(str(tmp_path / 'study.db'), wavelengths=[500, 600])
+    steps['camera']['exposure_time'] = 0.04
+    OfflineRunner(steps, dry_run=True).run()
+    assert '40.0' in capsys.readouterr().out
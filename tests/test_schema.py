@@ -0,0 +1,76 @@
+import sqlite3
+
+import pytest
+
+from controllers import schema
+
+METADATA = {'sample_name': None, 'solvent': 'water', 'hemoglobin_concentration_mg_mL': 0.0,
+            'microsphere_concentration_uL_mL': 0.0, 'yeast_stock_added_uL_mL': 0.0, 'yeast_concentration_mg_mL': 0.0}
+
+
+def tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def test_migrate_creates_the_current_schema():
+    conn = sqlite3.connect(':memory:')
+    assert schema.migrate(conn) == 0
+    assert schema.schema_version(conn) == schema.SCHEMA_VERSION
+    assert {'dissolved_oxygen_study_table', 'dissolved_oxygen_records', 'exposure_table', 'performance_stages',
+            'stack_analysis'} <= tables(conn)
+    assert schema.migrate(conn) == schema.SCHEMA_VERSION  # Nothing left to do
+
+
+def test_upgrade_keeps_records_and_fills_epoch_time():
+    conn = sqlite3.connect(':memory:')
+    schema.migrate(conn, target=1)
+    conn.execute("INSERT INTO dissolved_oxygen_study_table (sample_name) VALUES ('a')")
+    conn.execute('''INSERT INTO dissolved_oxygen_records (sample_name, sample_id, time, dissolved_oxygen, nanoamperes,
+                    temperature) VALUES ('a', 1, '2024-01-01 00:00:10', 8.0, 48.0, 25.0)''')
+    conn.commit()
+
+    assert schema.migrate(conn) == 1
+    epoch_time, = conn.execute('SELECT epoch_time FROM dissolved_oxygen_records').fetchone()
+    assert epoch_time == 1704067210.0
+
+
+def test_migrate_inside_an_open_transaction():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE other (x)')
+    conn.execute('INSERT INTO other VALUES (1)')
+    assert conn.in_transaction
+    schema.migrate(conn)
+    assert conn.in_transaction  # Committing is left to the caller
+    conn.commit()
+    assert schema.schema_version(conn) == schema.SCHEMA_VERSION
+
+
+def test_newer_schema_is_refused():
+    conn = sqlite3.connect(':memory:')
+    conn.execute(f'PRAGMA user_version = {schema.SCHEMA_VERSION + 1}')
+    with pytest.raises(ValueError):
+        schema.migrate(conn)
+
+
+def test_import_legacy_tables_only_takes_per_sample_do_tables():
+    conn = sqlite3.connect(':memory:')
+    schema.migrate(conn)
+    # Legacy tables are named after the sample, which can hold spaces and hyphens
+    conn.execute('''CREATE TABLE "phantom 1-b" (time TIMESTAMP, dissolved_oxygen REAL, nanoamperes REAL,
+                    temperature REAL)''')
+    conn.execute('''INSERT INTO "phantom 1-b" VALUES ('2024-01-01 00:00:00', 8.0, 48.0, 25.0)''')
+    conn.execute('CREATE TABLE "phantom 1-b_index" (id INTEGER PRIMARY KEY, image_name TEXT)')
+    conn.commit()
+    app_tables = tables(conn) - {'phantom 1-b', 'phantom 1-b_index'}
+
+    asked = []
+
+    def get_metadata(table):
+        asked.append(table)
+        return dict(METADATA, sample_name=table)
+
+    assert schema.import_legacy_tables(conn, get_metadata, drop=True) == ['phantom 1-b']
+    assert asked == ['phantom 1-b']
+    assert tables(conn) == app_tables | {'phantom 1-b_index'}
+    rows = conn.execute('SELECT sample_name, dissolved_oxygen, epoch_time FROM dissolved_oxygen_records').fetchall()
+    assert rows == [('phantom 1-b', 8.0, 1704067200.0)]
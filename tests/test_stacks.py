@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pytest
+
+from controllers.stacks import StackWriter, read_stack
+
+
+def planes(count=3, shape=(16, 12)):
+    return np.random.default_rng(0).integers(0, 4096, (count,) + shape, dtype=np.uint16)
+
+
+def test_planes_written_out_of_order_read_back_with_their_plan(tmp_path):
+    path = str(tmp_path / 'stack.tiff')
+    frames = planes()
+    with StackWriter(path, [600, 500, 550], [0.01, 0.02, 0.03], metadata={'study_name': 'phantom'}) as stack:
+        for index in (1, 2, 0):
+            stack.write(index, frames[index])
+    assert not os.path.exists(stack.partial_path)
+
+    data, metadata, complete = read_stack(path)
+    assert complete
+    assert np.array_equal(data, frames)
+    assert metadata['wavelengths'] == [600.0, 500.0, 550.0]
+    assert metadata['exposures'] == [0.01, 0.02, 0.03]
+    assert metadata['study_name'] == 'phantom'
+
+
+def test_an_interrupted_stack_resumes_where_it_stopped(tmp_path):
+    path = str(tmp_path / 'stack.tiff')
+    frames = planes()
+    with pytest.raises(RuntimeError):
+        with StackWriter(path, [500, 550, 600], [0.01] * 3) as stack:
+            stack.write(0, frames[0])
+            raise RuntimeError('capture failed')
+    assert os.path.exists(stack.partial_path)
+    assert not read_stack(path)[2]
+
+    stack = StackWriter.resume(path)
+    assert stack.remaining == [1, 2]
+    for index in stack.remaining:
+        stack.write(index, frames[index])
+    stack.close()
+    data, _, complete = read_stack(path)
+    assert complete and np.array_equal(data, frames)
+
+
+def test_each_plane_needs_a_wavelength_and_an_exposure(tmp_path):
+    with pytest.raises(ValueError):
+        StackWriter(str(tmp_path / 'stack.tiff'), [500, 600], [0.01])
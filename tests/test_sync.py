@@ -0,0 +1,109 @@
+import sqlite3
+import time
+
+import numpy as np
+import pytest
+
+from controllers.database import DatabaseWriter
+from controllers.device import DOProbe
+from controllers.pipeline import BandTiming, StackTrace
+from controllers.plan import AcquisitionPlan
+from controllers.schema import migrate, INSERT_STUDY
+from controllers.simulators import DOProbeSimulator
+from controllers.stacks import read_stack
+from controllers.sync import OxygenIndex, SharedClock, SynchronizedRun
+
+
+def test_shared_clock_reports_epoch_seconds():
+    clock = SharedClock()
+    assert abs(clock() - time.time()) < 0.1
+    assert clock.epoch(clock.start_ns + 2_000_000_000) == pytest.approx(clock.start_epoch + 2)
+
+
+def test_oxygen_index_interpolates_inside_the_recorded_span():
+    index = OxygenIndex(capacity=2)
+    index.extend([(10.0, 8.0, 0.0, 20.0), (12.0, 6.0, 0.0, 22.0)])
+    index.extend([(11.0, 7.5, 0.0, 21.0)])  # Out of order, and past the initial capacity
+    assert len(index) == 3 and index.latest == 12.0
+    do, temperature, po2, so2 = index.at([10.5, 11.5, 9.0, 13.0])
+    assert do[:2].tolist() == [7.75, 6.75] and temperature[:2].tolist() == [20.5, 21.5]
+    assert np.all(np.isnan(do[2:]))
+    assert np.all(np.diff(po2[:2]) < 0) and np.all(so2[:2] > 0)
+
+
+def test_oxygen_index_wait_until():
+    index = OxygenIndex()
+    assert not index.wait_until(5.0, timeout=0.01)
+    index.extend([(5.0, 8.0, 0.0, 25.0)])
+    assert index.wait_until(5.0, timeout=0.01)
+    assert index.at([5.0])[0].tolist() == [8.0]
+
+
+def test_stack_trace_tolerates_bands_that_never_ran():
+    bands = [BandTiming(k, 500 + 10 * k, 0.01) for k in range(3)]
+    bands[0].tune_start, bands[0].tuned = 0.0, 0.05
+    bands[0].capture_start, bands[0].exposure_end, bands[0].frame_ready, bands[0].saved = 0.05, 0.06, 0.09, 0.1
+    trace = StackTrace(bands)
+    trace.start, trace.end = 0.0, 0.1
+
+    assert bands[1].tune_time is None and bands[1].save_time is None
+    assert trace.minimum_time == pytest.approx(0.05 + 0.01 + 0.03)
+    lines = trace.summary().splitlines()
+    assert len(lines) == 5
+    assert lines[2].split()[2] == '-'
+
+
+class LCTF:
+    def __init__(self):
+        self.known_wavelength = None
+
+    @property
+    def wavelength(self):
+        return self.known_wavelength
+
+    @wavelength.setter
+    def wavelength(self, wavelength):
+        time.sleep(0.005)
+        self.known_wavelength = wavelength
+
+
+class CMOS:
+    def __init__(self):
+        self.exposure_time = 0.01
+
+    def snap(self, on_exposure_end=None):
+        time.sleep(self.exposure_time)
+        on_exposure_end()
+        return np.zeros((8, 8), np.uint16)
+
+
+def test_synchronized_run_stores_the_oxygenation_of_every_band(tmp_path):
+    study_db = str(tmp_path / 'study.db')
+    migrate(study_db)
+    with DOProbeSimulator(rate=50) as simulator, DatabaseWriter(study_db) as writer:
+        probe = DOProbe(simulator.url)
+        sample_id = writer.execute(INSERT_STUDY, ('phantom', 'water', 0, 0, 0, 0))
+        run = SynchronizedRun(probe, LCTF(), CMOS(), writer, 'phantom', sample_id, do_timeout=1)
+        plan = AcquisitionPlan([600, 500, 550], [0.02, 0.01, 0.02], reorder=False)
+        run.start()
+        try:
+            count = run.run(str(tmp_path / 'stack'), plan.wavelengths, plan.exposures, n_stacks=2, plan=plan)
+        finally:
+            run.stop()
+            probe.close()
+    assert count == 2 and len(run.traces) == 2
+    assert plan.filter is not None  # The caller's plan was used, not a new one
+
+    with sqlite3.connect(study_db) as conn:
+        rows = conn.execute('''SELECT image_name, band, wavelength, epoch_time, dissolved_oxygen, so2
+                               FROM synchronized_band_records ORDER BY id''').fetchall()
+        readings = conn.execute('SELECT count(*) FROM dissolved_oxygen_records').fetchone()[0]
+    assert len(rows) == 6 and readings > 0
+    assert [row[2] for row in rows[:3]] == [600, 500, 550]
+    assert all(row[4] is not None and row[5] is not None for row in rows)
+    assert read_stack(str(tmp_path / 'stack_0001.tiff'))[2]
+
+
+def test_online_analysis_and_a_time_lapse_are_refused():
+    with pytest.raises(ValueError):
+        SynchronizedRun(DOProbe('loop://'), None, None, None, 'phantom', 1, analysis=object(), lapse=object())
@@ -0,0 +1,78 @@
+import sqlite3
+import threading
+
+import numpy as np
+import pytest
+
+from controllers.timelapse import TimeLapse
+
+
+def frame(value):
+    return np.full((40, 30), value, np.uint16)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'run.lapse')
+
+
+def test_round_trip(path):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 4096, (3, 2, 40, 30), dtype=np.uint16)
+    with TimeLapse(path, [500, 600], chunk=16) as lapse:
+        for stack in frames:
+            with lapse.stack() as lapse_stack:
+                for index, band in enumerate(stack):
+                    lapse_stack.write(index, band)
+    with TimeLapse(path) as lapse:
+        assert lapse.shape == (3, 2, 40, 30)
+        assert np.array_equal(lapse.read(), frames)
+        assert np.array_equal(lapse.read(t=1, bands=[1], y=slice(5, 25), x=slice(3, 20)),
+                              frames[1:2, 1:, 5:25, 3:20])
+        assert np.array_equal(lapse.pixel_series(7, 9), frames[:, :, 7, 9])
+
+
+def test_interrupted_stack_is_marked_incomplete(path, capsys):
+    with TimeLapse(path, [500, 600], chunk=16) as lapse:
+        with lapse.stack() as lapse_stack:
+            lapse_stack.write(0, frame(1))
+            lapse_stack.write(1, frame(2))
+        with pytest.raises(RuntimeError):
+            with lapse.stack() as lapse_stack:
+                lapse_stack.write(0, frame(3))
+                raise RuntimeError('capture failed')
+        with lapse.stack() as lapse_stack:
+            lapse_stack.write(0, frame(5))
+            lapse_stack.write(1, frame(6))
+        assert list(lapse.complete) == [True, False, True]
+        assert lapse.pixel_series(3, 3).tolist() == [[1, 2], [3, 0], [5, 6]]
+    # Reported through the flag, not on stdout
+    assert capsys.readouterr().out == ''
+
+
+def test_concurrent_reads(path):
+    with TimeLapse(path, [500, 600], chunk=16, workers=3) as lapse:
+        for value in range(4):
+            with lapse.stack() as lapse_stack:
+                lapse_stack.write(0, frame(value))
+                lapse_stack.write(1, frame(value + 10))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(lapse.read(t=[0, 3]))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 8
+        assert all(np.array_equal(result, results[0]) for result in results)
+        assert results[0][:, :, 0, 0].tolist() == [[0, 10], [3, 13]]
+
+
+def test_containers_without_the_complete_flag_read_as_complete(path):
+    with TimeLapse(path, [500], chunk=16) as lapse:
+        with lapse.stack() as lapse_stack:
+            lapse_stack.write(0, frame(1))
+    with sqlite3.connect(f'{path}/index.db') as conn:
+        conn.executescript('CREATE TABLE old AS SELECT t, epoch_time FROM times; DROP TABLE times; '
+                           'ALTER TABLE old RENAME TO times;')
+    with TimeLapse(path) as lapse:
+        assert list(lapse.complete) == [True]
@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from controllers import schema, timing
+from controllers.database import DatabaseWriter
+from controllers.timing import StageStats, _bucket, _bucket_range
+
+
+@pytest.fixture(autouse=True)
+def clean_timing():
+    timing.reset()
+    yield
+    timing.enable(False)
+    timing.reset()
+
+
+def test_every_duration_falls_in_its_bucket():
+    for ns in list(range(100)) + [10 ** k + j for k in range(2, 18) for j in (-1, 0, 1)]:
+        low, high = _bucket_range(_bucket(ns))
+        assert low <= ns < high
+        assert high - low <= max(1, low / 8)  # Within about 6% of the midpoint
+
+
+def test_percentiles_and_totals():
+    stats = StageStats('stage')
+    for ms in range(1, 101):
+        stats.add(ms * 1_000_000)
+    assert stats.count == 100 and stats.total == pytest.approx(5.05)
+    assert stats.mean == pytest.approx(0.0505) and stats.max == pytest.approx(0.1)
+    assert stats.percentile(50) == pytest.approx(0.050, rel=0.07)
+    assert stats.percentile(95) == pytest.approx(0.095, rel=0.07)
+    assert stats.percentile(100) <= stats.max
+    assert StageStats('empty').percentile(50) == 0.0
+
+
+def test_nothing_is_recorded_while_disabled():
+    start = timing.start()
+    assert start == 0
+    timing.stop('off', start)
+    timing.add('off', 1.0)
+    with timing.timed('off'):
+        pass
+    assert timing.rows() == []
+
+
+def test_stages_are_recorded_while_enabled():
+    timing.enable()
+    with timing.timed('block'):
+        pass
+    timing.stop('block', timing.start())
+    timing.add('trace', 0.25)
+    assert [(row[0], row[1]) for row in timing.rows()] == [('block', 2), ('trace', 1)]
+    assert timing.stage('trace').max == 0.25
+    assert 'trace' in timing.summary()
+
+
+def test_save_writes_one_row_per_stage(tmp_path):
+    path = str(tmp_path / 'study.db')
+    schema.migrate(path)
+    timing.enable()
+    timing.add('a', 0.1)
+    timing.add('b', 0.2)
+    with DatabaseWriter(path) as writer:
+        timing.save(writer, 'run-1')
+    rows = sqlite3.connect(path).execute('SELECT run, stage, count, max_s FROM performance_stages').fetchall()
+    assert sorted(rows) == [('run-1', 'a', 1, pytest.approx(0.1)), ('run-1', 'b', 1, pytest.approx(0.2))]
@@ -0,0 +1,83 @@
+import json
+import sqlite3
+
+import numpy as np
+import pytest
+import tifffile
+
+from controllers import schema
+from controllers.database import DatabaseWriter
+from controllers.unmixing import OnlineAnalysis, analyze_stack, extinction_matrix, map_paths, unmixing_matrix
+
+WAVELENGTHS = (500.0, 520.0, 540.0, 560.0, 580.0, 600.0)
+EXPOSURES = [0.05, 0.05, 0.1, 0.1, 0.2, 0.2]
+
+
+def write_stack(path, oxy, deoxy):
+    """Stack whose absorbance is that of oxy and deoxy (M, per pixel) plus a constant -4 baseline."""
+    absorbance = np.tensordot(extinction_matrix(WAVELENGTHS, baseline=False), np.stack([oxy, deoxy]), axes=1)
+    counts = np.asarray(EXPOSURES).reshape(-1, 1, 1) * 10 ** (4 - absorbance)
+    tifffile.imwrite(path, counts.astype(np.float32), photometric='minisblack')
+
+
+def test_extinction_matrix():
+    matrix = extinction_matrix([450, 455, 720])
+    assert matrix.shape == (3, 3)
+    assert np.allclose(matrix[1, :2], [(62816.0 + 44480.0) / 2, (103292.0 + 23388.8) / 2])
+    assert np.all(matrix[:, 2] == 1)
+    assert extinction_matrix([500], baseline=False).shape == (1, 2)
+    with pytest.raises(ValueError):
+        extinction_matrix([440, 500])
+
+
+def test_unmixing_matrix_is_cached_and_read_only():
+    pinv = unmixing_matrix(WAVELENGTHS)
+    assert pinv.shape == (3, len(WAVELENGTHS)) and pinv is unmixing_matrix(WAVELENGTHS)
+    with pytest.raises(ValueError):
+        pinv[0, 0] = 1
+    with pytest.raises(ValueError):
+        unmixing_matrix((500.0, 600.0))
+    assert unmixing_matrix((500.0, 600.0), baseline=False).shape == (2, 2)
+
+
+def test_analyze_stack_recovers_the_concentrations(tmp_path):
+    path = str(tmp_path / 'stack.tif')
+    oxy = np.full((10, 7), 30e-6)
+    oxy[:5] = 10e-6
+    deoxy = np.full((10, 7), 10e-6)
+    write_stack(path, oxy, deoxy)
+
+    stats = analyze_stack(path, unmixing_matrix(WAVELENGTHS), EXPOSURES, block_rows=3)
+    so2, thb = (tifffile.imread(name) for name in map_paths(path))
+    assert (stats['so2_path'], stats['thb_path']) == map_paths(path)
+    assert np.allclose(so2[:5], 50, atol=0.1) and np.allclose(so2[5:], 75, atol=0.1)
+    assert np.allclose(thb[:5], 20, rtol=1e-3) and np.allclose(thb[5:], 40, rtol=1e-3)
+    assert stats['pixels'] == 70 and stats['so2_mean'] == pytest.approx(62.5, abs=0.1)
+    assert stats['thb_median'] == pytest.approx(30, rel=1e-3)
+
+
+def test_analyze_stack_checks_the_band_count(tmp_path):
+    path = str(tmp_path / 'stack.tif')
+    write_stack(path, np.full((2, 2), 1e-5), np.full((2, 2), 1e-5))
+    with pytest.raises(ValueError):
+        analyze_stack(path, unmixing_matrix(WAVELENGTHS[:4]), EXPOSURES[:4])
+
+
+def test_online_analysis_stores_results_and_skips_when_behind(tmp_path):
+    study_db = str(tmp_path / 'study.db')
+    schema.migrate(study_db)
+    paths = [str(tmp_path / f'stack_{k}.tif') for k in range(3)]
+    for path in paths:
+        write_stack(path, np.full((4, 4), 30e-6), np.full((4, 4), 10e-6))
+
+    with DatabaseWriter(study_db) as writer:
+        with OnlineAnalysis(writer, max_pending=1) as analysis:
+            assert analysis.submit(paths[2], WAVELENGTHS[:2], EXPOSURES[:2]) is None  # Cannot be unmixed
+            futures = [analysis.submit(path, WAVELENGTHS, EXPOSURES, study_name='study') for path in paths[:2]]
+            assert futures[0] is not None and futures[1] is None
+        assert analysis.skipped == 1 and [name for name, _ in analysis.results] == paths[:1]
+
+    rows = sqlite3.connect(study_db).execute('SELECT study_name, image_name, wavelengths, so2_mean '
+                                             'FROM stack_analysis').fetchall()
+    assert len(rows) == 1 and rows[0][:2] == ('study', paths[0])
+    assert json.loads(rows[0][2]) == list(WAVELENGTHS) and rows[0][3] == pytest.approx(75, abs=0.1)